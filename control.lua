@@ -5,18 +5,54 @@
 -- Modified by lvshrd SUPCON
 -- License: Apache License 2.0
 
--- Tracks existing/new machines, writes a single JSON file "factory_state.json"
+-- Tracks existing/new machines, writes a JSON snapshot (see SNAPSHOT_FORMAT)
 -- with production, pollution, fluids, inventory, electric etc.
 -- 
 -- Key feature: 
--- 1. Scans for existing entities on the first tick after load (if not already
---  scanned) to populate global.assets with old saves' machines.
+-- 1. Scans for existing entities after load (if not already scanned) to
+--  populate global.assets with old saves' machines. The scan goes chunk by
+--  chunk, SCAN_CHUNKS_PER_TICK per tick, and snapshots report its progress.
 
 -- 2. Identify all substation positions to define production area centers.
 -- Subsequently, assign a unique 'line_id' to each machine within these defined areas, 
 -- corresponding to the respective substation center.
+-- The line_id is looked up through a grid index of substation coverage areas
+-- and cached on the asset; it is only recomputed when a substation is built or
+-- removed (for the assets it covers) and when an asset is placed.
 --------------------------------------------------------------------------------
 SUBSTATION_RADIUS=9
+LINE_CELL_SIZE=2*SUBSTATION_RADIUS  -- grid cell edge in tiles: a substation area spans at most 2x2 cells
+SNAPSHOT_INTERVAL=60  -- e.g. every 60 ticks = 1 second
+SCAN_CHUNKS_PER_TICK=16  -- map chunks (32x32 tiles) searched per tick by the initial scan
+DUMP_ALL_ENTITIES=false  -- debug: also write every entity found by the scan to All_entity_type.json
+-- Ticks between two runs of each tracker on an asset, rounded up to whole
+-- SNAPSHOT_INTERVALs. Assets are updated round-robin, a slice per tick, so
+-- every asset is visited once per snapshot interval and the per-tick cost is flat.
+TRACKER_INTERVALS={
+  production = 60,   -- keep at SNAPSHOT_INTERVAL: crafts are counted from crafting_progress samples
+  inventory  = 60,
+  status     = 60,
+  pollution  = 600,
+  fluids     = 60,
+  electric   = 60,
+}
+-- "slots": write every asset each SNAPSHOT_INTERVAL to the next of SNAPSHOT_SLOTS
+-- files (factory_state.0.json, factory_state.1.json, ...), then commit it by
+-- writing SNAPSHOT_MANIFEST_FILE {"slot", "seq", "tick", "size", "slots"}; a
+-- reader following the manifest never sees a half-written snapshot.
+-- "full": rewrite factory_state.json in place each SNAPSHOT_INTERVAL.
+-- "delta": append only the assets that changed (and the unit_numbers removed)
+-- to SNAPSHOT_LOG_FILE, one JSON line per interval with an increasing "seq";
+-- every KEYFRAME_INTERVAL intervals the log is restarted with a full keyframe.
+-- A publisher that finds a gap (e.g. after loading an older save, whose seq
+-- numbers repeat ones already in the log) waits for the next keyframe, so
+-- KEYFRAME_INTERVAL * SNAPSHOT_INTERVAL ticks bounds how long it stalls.
+-- Set [publisher] snapshot_format in scripts/config.toml to match.
+SNAPSHOT_FORMAT="slots"
+SNAPSHOT_SLOTS=2
+SNAPSHOT_MANIFEST_FILE="factory_state.manifest.json"
+SNAPSHOT_LOG_FILE="factory_state_log.jsonl"
+KEYFRAME_INTERVAL=60
 Target_Chest_Position={-0.5,19.5}
 Target_Area={{-18,13},{2,20}}
 --------------------------------------------------------------------------------
@@ -55,6 +91,8 @@ local function ensure_global_tables()
   if not global then global = {} end
   if not global.assets then global.assets = {} end
   if not global.substations then global.substations = {} end  -- New Added
+  -- global.substation_grid / global.asset_grid are built lazily by ensure_line_index()
+  -- global.dirty / global.removed / global.snapshot_seq are created by ensure_snapshot_state()
   if global.scanned == nil then
     global.scanned = false  -- used to mark if we've done our first-tick scanning
   end
@@ -85,12 +123,204 @@ local function is_tracked_entity(entity)
   return (entity and entity.valid and TRACKED_TYPES[entity.type])
 end
 
+--------------------------------------------------------------------------------
+-- Dirty tracking: assets whose snapshot fields changed since the last write
+--------------------------------------------------------------------------------
+local function same_value(a, b)
+  if a == b then return true end
+  if type(a) ~= "table" or type(b) ~= "table" then return false end
+  for k, v in pairs(a) do
+    if not same_value(v, b[k]) then return false end
+  end
+  for k in pairs(b) do
+    if a[k] == nil then return false end
+  end
+  return true
+end
+
+-- Created on first use rather than in ensure_global_tables(), which on_load
+-- also calls and where global may not be written
+local function ensure_snapshot_state()
+  if not global.dirty then global.dirty = {} end      -- unit_numbers changed since the last write
+  if not global.removed then global.removed = {} end  -- unit_numbers removed since the last write
+  if not global.snapshot_seq then global.snapshot_seq = 0 end
+  -- Saved, so every player writes the keyframe at the same tick
+  if global.keyframe_due == nil then global.keyframe_due = true end
+end
+
+local function mark_dirty(asset)
+  ensure_snapshot_state()
+  global.dirty[asset.unit_number] = true
+end
+
+-- Store a snapshot field of an asset, marking it dirty if the value changed
+local function set_tracked(asset, key, value)
+  if not same_value(asset[key], value) then
+    asset[key] = value
+    mark_dirty(asset)
+  end
+end
+
+--------------------------------------------------------------------------------
+-- Line index: substations and assets bucketed by grid cell ("cx:cy")
+--------------------------------------------------------------------------------
+local function cell_coord(v)
+  return math.floor(v / LINE_CELL_SIZE)
+end
+
+local function cell_key(cx, cy)
+  return cx .. ":" .. cy
+end
+
+local function grid_add(grid, cx, cy, unit_number)
+  local key = cell_key(cx, cy)
+  local cell = grid[key]
+  if not cell then
+    cell = {}
+    grid[key] = cell
+  end
+  cell[unit_number] = true
+end
+
+local function grid_remove(grid, cx, cy, unit_number)
+  local key = cell_key(cx, cy)
+  local cell = grid[key]
+  if cell then
+    cell[unit_number] = nil
+    if next(cell) == nil then grid[key] = nil end
+  end
+end
+
+-- Calls func(cx, cy) for every cell the square covered by a substation touches
+local function for_substation_cells(substation, func)
+  local p, r = substation.position, substation.radius
+  for cx = cell_coord(p.x - r), cell_coord(p.x + r) do
+    for cy = cell_coord(p.y - r), cell_coord(p.y + r) do
+      func(cx, cy)
+    end
+  end
+end
+
+-- Assign line_ID for a position: where substation areas overlap, the lowest
+-- unit_number wins so the result does not depend on table iteration order
+local function assign_line_id(entity_position)
+  local cell = global.substation_grid[cell_key(cell_coord(entity_position.x), cell_coord(entity_position.y))]
+  local best = nil
+  if cell then
+    for unit_number in pairs(cell) do
+      local substation = global.substations[unit_number]
+      if substation and (best == nil or unit_number < best) then
+        local dx = math.abs(entity_position.x - substation.position.x)
+        local dy = math.abs(entity_position.y - substation.position.y)
+        if dx <= substation.radius and dy <= substation.radius then
+          best = unit_number
+        end
+      end
+    end
+  end
+  if best then
+    return "Line" .. best
+  end
+  return "Isolated"
+end
+
+-- Recompute the cached line_id of every asset in the cells a substation touches
+local function refresh_line_ids(substation)
+  for_substation_cells(substation, function(cx, cy)
+    local cell = global.asset_grid[cell_key(cx, cy)]
+    if cell then
+      for unit_number in pairs(cell) do
+        local asset = global.assets[unit_number]
+        if asset then
+          set_tracked(asset, "line_id", assign_line_id(asset.position))
+        end
+      end
+    end
+  end)
+end
+
+local function index_asset(asset)
+  grid_add(global.asset_grid, cell_coord(asset.position.x), cell_coord(asset.position.y), asset.unit_number)
+end
+
+local function index_substation(substation)
+  for_substation_cells(substation, function(cx, cy)
+    grid_add(global.substation_grid, cx, cy, substation.unit_number)
+  end)
+end
+
+-- Saves from before the index (or after a migration that dropped it) rebuild
+-- it on first use; on_load may not write to global, so this can't happen there.
+-- The update schedule below is built the same way
+local function ensure_line_index()
+  if global.substation_grid and global.asset_grid then return end
+  global.substation_grid = {}
+  global.asset_grid = {}
+  for _, substation in pairs(global.substations) do
+    index_substation(substation)
+  end
+  for _, asset in pairs(global.assets) do
+    index_asset(asset)
+    set_tracked(asset, "line_id", assign_line_id(asset.position))
+  end
+end
+
+--------------------------------------------------------------------------------
+-- Update schedule: unit_numbers in visiting order (global.update_order), their
+-- positions (global.update_index) and the next position to visit this round
+-- (global.update_cursor). An array rather than next() over global.assets, so
+-- assets can be added and removed in the middle of a round.
+--------------------------------------------------------------------------------
+local function schedule_asset(unit_number)
+  if global.update_index[unit_number] then return end
+  local order = global.update_order
+  order[#order + 1] = unit_number
+  global.update_index[unit_number] = #order
+end
+
+local function swap_scheduled(i, j)
+  local order, index = global.update_order, global.update_index
+  order[i], order[j] = order[j], order[i]
+  index[order[i]] = i
+  index[order[j]] = j
+end
+
+local function unschedule_asset(unit_number)
+  local i = global.update_index[unit_number]
+  if not i then return end
+  if i < global.update_cursor then
+    -- Already visited this round: trade places with the last visited asset and
+    -- step the cursor back over it, so no unvisited asset lands behind the cursor
+    local last_visited = global.update_cursor - 1
+    swap_scheduled(i, last_visited)
+    global.update_cursor = last_visited
+    i = last_visited
+  end
+  local last = #global.update_order
+  swap_scheduled(i, last)
+  global.update_order[last] = nil
+  global.update_index[unit_number] = nil
+end
+
+local function ensure_update_schedule()
+  if global.update_order then return end
+  global.update_order = {}
+  global.update_index = {}
+  global.update_cursor = 1
+  global.update_round = 0
+  for unit_number in pairs(global.assets) do
+    schedule_asset(unit_number)
+  end
+end
+
 --------------------------------------------------------------------------------
 -- 4) Register/Remove assets
 --------------------------------------------------------------------------------
 local function register_asset(entity)
   ensure_global_tables()
-  global.assets[entity.unit_number] = {
+  ensure_line_index()
+  ensure_update_schedule()
+  local asset = {
     unit_number            = entity.unit_number,
     name                   = entity.name,
     type                   = entity.type,
@@ -110,67 +340,163 @@ local function register_asset(entity)
 
     entity_ref             = entity
   }
+  global.assets[entity.unit_number] = asset
+  index_asset(asset)
+  schedule_asset(entity.unit_number)
+  mark_dirty(asset)
   if entity.type == "electric-pole" then
     -- global.assets[entity.unit_number].electric.electric_network_statistics = entity.electric_network_statistics
     if entity.name == "substation" then
-      global.substations[entity.unit_number] = {
+      local substation = {
         unit_number =     entity.unit_number,
         position =        {x = entity.position.x, y = entity.position.y},
         radius =          SUBSTATION_RADIUS
       }
+      global.substations[entity.unit_number] = substation
+      index_substation(substation)
+      refresh_line_ids(substation)  -- also sets this asset's own line_id
+      return
     end
   end
+  asset.line_id = assign_line_id(asset.position)
+end
 
+-- Drop an asset from every table; also used for assets whose entity became
+-- invalid without a removal event
+local function forget_asset(unit_number)
+  ensure_snapshot_state()
+  local asset = global.assets[unit_number]
+  if asset then
+    grid_remove(global.asset_grid, cell_coord(asset.position.x), cell_coord(asset.position.y), unit_number)
+    global.removed[unit_number] = true
+  end
+  unschedule_asset(unit_number)
+  global.assets[unit_number] = nil
+  global.dirty[unit_number] = nil
+  local substation = global.substations[unit_number]
+  if substation then
+    global.substations[unit_number] = nil
+    for_substation_cells(substation, function(cx, cy)
+      grid_remove(global.substation_grid, cx, cy, unit_number)
+    end)
+    -- Assets it covered fall back to another substation or "Isolated"
+    refresh_line_ids(substation)
+  end
 end
 
 local function remove_asset(entity)
   ensure_global_tables()
+  ensure_line_index()
+  ensure_update_schedule()
   if entity and entity.valid and entity.unit_number then
-    global.assets[entity.unit_number] = nil
-    if entity.type == "electric-pole" and entity.name == "substation" then
-      global.substations[entity.unit_number] = nil
-    end
+    forget_asset(entity.unit_number)
   end
 end
 
 --------------------------------------------------------------------------------
--- Assign line_ID for entities
+-- 5) Find existing assets (scan the map), a few chunks per tick.
+-- global.scan holds the surfaces to scan, the position in that list and the
+-- chunk positions of the current surface; global.scanned is set at the end.
 --------------------------------------------------------------------------------
-local function assign_line_id(entity_position)
-  for _, substation in pairs(global.substations) do
-    local dx = math.abs(entity_position.x - substation.position.x)
-    local dy = math.abs(entity_position.y - substation.position.y)
-    if dx <= substation.radius and dy <= substation.radius then
-      return "Line" .. substation.unit_number
+local TRACKED_TYPE_LIST = {}
+for entity_type in pairs(TRACKED_TYPES) do
+  table.insert(TRACKED_TYPE_LIST, entity_type)
+end
+
+local function start_scan()
+  local surfaces = {}
+  for _, surface in pairs(game.surfaces) do
+    table.insert(surfaces, surface.index)
+  end
+  global.scan = {surfaces = surfaces, surface_pos = 0, chunks = {}, chunk_pos = 1, chunks_done = 0}
+end
+
+-- Move on to the next surface and list its chunks; nil once none is left
+local function next_scan_surface(scan)
+  while true do
+    scan.surface_pos = scan.surface_pos + 1
+    local index = scan.surfaces[scan.surface_pos]
+    if index == nil then return nil end
+    local surface = game.get_surface(index)
+    if surface and surface.valid then
+      local chunks = {}
+      for chunk in surface.get_chunks() do
+        table.insert(chunks, {x = chunk.x, y = chunk.y})
+      end
+      scan.chunks = chunks
+      scan.chunk_pos = 1
+      return surface
     end
   end
-  return "Isolated"
 end
 
---------------------------------------------------------------------------------
--- 5) Find existing assets (scan the map)
---------------------------------------------------------------------------------
-local function find_existing_assets()
-  for _, surface in pairs(game.surfaces) do
-    local all_entities = surface.find_entities()
-    for _, e in pairs(all_entities) do
-      print(all_entities)
--- ----------------------------------
--- try to find all the types of entities
+local function scan_chunk(surface, chunk)
+  local area = {{chunk.x * 32, chunk.y * 32}, {chunk.x * 32 + 32, chunk.y * 32 + 32}}
+  if DUMP_ALL_ENTITIES then
+    for _, e in pairs(surface.find_entities_filtered{area = area}) do
       register_all_type_entity(e)
--- --------------------------------
-      if is_tracked_entity(e) then
-        register_asset(e)
-      end
+    end
+  end
+  for _, e in pairs(surface.find_entities_filtered{area = area, type = TRACKED_TYPE_LIST}) do
+    -- Entities on a chunk border are found from both chunks, and ones built
+    -- since the scan started are registered already
+    if e.unit_number and not global.assets[e.unit_number] then
+      register_asset(e)
     end
   end
 end
 
+-- Search up to 'budget' chunks; returns true once the whole map was scanned
+local function scan_existing_assets(budget)
+  local scan = global.scan
+  local index = scan.surfaces[scan.surface_pos]
+  local surface = index and game.get_surface(index)
+  while budget > 0 do
+    local chunk = scan.chunks[scan.chunk_pos]
+    if chunk == nil or not (surface and surface.valid) then
+      surface = next_scan_surface(scan)
+      if surface == nil then return true end
+    else
+      scan_chunk(surface, chunk)
+      scan.chunk_pos = scan.chunk_pos + 1
+      scan.chunks_done = scan.chunks_done + 1
+      budget = budget - 1
+    end
+  end
+  return false
+end
+
+-- Scan progress for the snapshots: surfaces done, the current one counted by
+-- its share of chunks done
+local function scan_progress()
+  if global.scanned then
+    return {complete = true, progress = 1}
+  end
+  local scan = global.scan
+  if not (scan and #scan.surfaces > 0) then
+    return {complete = false, progress = 0, chunks_scanned = 0}
+  end
+  local done = math.max(0, scan.surface_pos - 1)
+  if scan.surface_pos >= 1 and #scan.chunks > 0 then
+    done = done + (scan.chunk_pos - 1) / #scan.chunks
+  end
+  return {complete = false, progress = done / #scan.surfaces, chunks_scanned = scan.chunks_done}
+end
+
 --------------------------------------------------------------------------------
 -- 6) on_init: Just ensure tables, no scanning yet
 --------------------------------------------------------------------------------
 script.on_init(function()
   ensure_global_tables()
+  ensure_snapshot_state()
+end)
+
+-- Mod added, updated or removed: the delta log on disk may belong to another
+-- version, so the next write restarts it with a keyframe
+script.on_configuration_changed(function()
+  ensure_global_tables()
+  ensure_snapshot_state()
+  global.keyframe_due = true
 end)
 
 --------------------------------------------------------------------------------
@@ -181,18 +507,25 @@ script.on_load(function()
 end)
 
 --------------------------------------------------------------------------------
--- 8) on_tick: On the FIRST TICK after load, we do a big scan if not done yet
+-- 8) on_tick: Until the map was scanned, scan SCAN_CHUNKS_PER_TICK chunks.
+-- Every tick, a slice of the assets is updated (see 11)
 --------------------------------------------------------------------------------
+local update_assets_for_tick  -- defined in 11)
+
 script.on_event(defines.events.on_tick, function(event)
   if not global.scanned then
     ensure_global_tables()
-    find_existing_assets()
-    global.scanned = true
--------------------------------------------------------------------------------
-    local json_str = helpers.table_to_json(All_entity)
-    helpers.write_file("All_entity_type.json", json_str, false)
---------------------------------------------------------------------------------
+    if not global.scan then start_scan() end
+    if scan_existing_assets(SCAN_CHUNKS_PER_TICK) then
+      global.scanned = true
+      global.scan = nil
+      if DUMP_ALL_ENTITIES then
+        local json_str = helpers.table_to_json(All_entity)
+        helpers.write_file("All_entity_type.json", json_str, false)
+      end
+    end
   end
+  update_assets_for_tick(event.tick)
 end)
 
 
@@ -222,12 +555,30 @@ script.on_event(defines.events.on_robot_mined_entity,  on_entity_removed)
 
 --------------------------------------------------------------------------------
 -- 10) Tracking logic: production, inventory, status, pollution, fluids
+-- Reads that may not exist for an entity type go through pcall(func, args...)
+-- with the plain functions below, so no closure is created per asset and tick.
 --------------------------------------------------------------------------------
+local function get_crafting_progress(entity)
+  return entity.crafting_progress
+end
+
+local function get_status(entity)
+  return entity.status
+end
+
+-- read_contents gives us a dictionary {["iron-plate"] = count, ...}
+local function read_inventory(entity, inv_data, inv_id, label)
+  local inv = entity.get_inventory(inv_id)
+  if inv and inv.valid then
+    inv_data[label] = inv.get_contents()
+  end
+end
+
 local function track_production(asset)
   local entity = asset.entity_ref
   if not (entity and entity.valid) then return end
 
-  local ok, _ = pcall(function() return entity.crafting_progress end)
+  local ok, _ = pcall(get_crafting_progress, entity)
   if not ok then return end  -- no crafting_progress for this entity
 
   local recipe = entity.get_recipe()
@@ -243,6 +594,7 @@ local function track_production(asset)
         asset.production_count = asset.production_count + 1
       end
       asset.production_last_updated = game.tick
+      mark_dirty(asset)
     end
     asset.last_crafting_progress = current
   else
@@ -256,37 +608,30 @@ local function track_inventory(asset)
 
   local inv_data = {}
 
-  local function read_inventory(inv_id, label)
-    local inv = entity.get_inventory(inv_id)
-    if inv and inv.valid then
-      -- read_contents gives us a dictionary {["iron-plate"] = count, ...}
-      inv_data[label] = inv.get_contents()
-    end
-  end
-
-  pcall(function() read_inventory(defines.inventory.chest, "chest") end)
-  pcall(function() read_inventory(defines.inventory.assembling_machine_input,  "input") end)
-  pcall(function() read_inventory(defines.inventory.assembling_machine_output, "output") end)
+  pcall(read_inventory, entity, inv_data, defines.inventory.chest, "chest")
+  pcall(read_inventory, entity, inv_data, defines.inventory.assembling_machine_input,  "input")
+  pcall(read_inventory, entity, inv_data, defines.inventory.assembling_machine_output, "output")
   if not entity.type == "assembling-machine" then
-    pcall(function() read_inventory(defines.inventory.furnace_source,  "furnace_source") end)
-    pcall(function() read_inventory(defines.inventory.furnace_result,  "furnace_result") end)
+    pcall(read_inventory, entity, inv_data, defines.inventory.furnace_source,  "furnace_source")
+    pcall(read_inventory, entity, inv_data, defines.inventory.furnace_result,  "furnace_result")
   end
   if not entity.type == "container" then
-    pcall(function() read_inventory(defines.inventory.item_main,       "main") end)
+    pcall(read_inventory, entity, inv_data, defines.inventory.item_main,       "main")
   end
-  asset.inventory = inv_data
+  set_tracked(asset, "inventory", inv_data)
 end
 
 local function track_status(asset)
   local entity = asset.entity_ref
   if not (entity and entity.valid) then return end
 
-  local has_status, new_status = pcall(function() return entity.status end)
+  local has_status, new_status = pcall(get_status, entity)
   if has_status then
     local old_status = asset.last_status
     if new_status ~= old_status then
       asset.last_status = new_status
       asset.state_changed_tick = game.tick
+      mark_dirty(asset)
     end
   end
 end
@@ -296,9 +641,9 @@ local function track_pollution(asset)
   if not (entity and entity.valid) then return end
   local surface = entity.surface
   if surface and surface.valid then
-    asset.pollution = surface.get_pollution(entity.position) or 0
+    set_tracked(asset, "pollution", surface.get_pollution(entity.position) or 0)
   else
-    asset.pollution = 0
+    set_tracked(asset, "pollution", 0)
   end
 end
 
@@ -322,7 +667,7 @@ local function track_fluids(asset)
       end
     end
   end
-  asset.fluids = fluids
+  set_tracked(asset, "fluids", fluids)
 end
 
 local function track_electric(asset)
@@ -332,61 +677,135 @@ local function track_electric(asset)
     -- asset.electric.electric_network_statistics = entity.electric_network_statistics
     -- if electrical equipment
   elseif entity.is_connected_to_electric_network() then
-    asset.electric = {
+    set_tracked(asset, "electric", {
       energyUsage = entity.prototype.energy_usage,  -- Power, Watt
       currentEnergy = entity.energy,                -- Storaged energy (J)
-    }
+    })
   end
 end
 
 --------------------------------------------------------------------------------
 -- 11) Periodic updates to track data and write JSON
 --------------------------------------------------------------------------------
-local function update_all_assets()
-  ensure_global_tables()
-  for _, asset in pairs(global.assets) do
-    local e = asset.entity_ref
-    if e and e.valid then
-      track_production(asset)
-      track_inventory(asset)
-      track_status(asset)
-      track_pollution(asset)
-      track_fluids(asset)
-      track_electric(asset)
+-- Each tracker runs on an asset every 'rounds' snapshot intervals; the round it
+-- runs in is staggered by unit_number so e.g. pollution is spread over all rounds
+local TRACKERS = {}
+for _, tracker in ipairs({
+  {name = "production", func = track_production},
+  {name = "inventory",  func = track_inventory},
+  {name = "status",     func = track_status},
+  {name = "pollution",  func = track_pollution},
+  {name = "fluids",     func = track_fluids},
+  {name = "electric",   func = track_electric},
+}) do
+  tracker.rounds = math.max(1, math.ceil((TRACKER_INTERVALS[tracker.name] or SNAPSHOT_INTERVAL) / SNAPSHOT_INTERVAL))
+  table.insert(TRACKERS, tracker)
+end
+
+-- Returns false if the asset's entity is gone
+local function update_asset(asset, round)
+  local e = asset.entity_ref
+  if not (e and e.valid) then return false end
+  for _, tracker in ipairs(TRACKERS) do
+    if tracker.rounds == 1 or (round + asset.unit_number) % tracker.rounds == 0 then
+      tracker.func(asset)
+    end
+  end
+  return true
+end
+
+-- Update the next 'count' assets of this round
+local function update_asset_slice(count)
+  local order = global.update_order
+  local first = global.update_cursor
+  local last = math.min(#order, first + count - 1)
+  local gone = nil
+  for i = first, last do
+    local asset = global.assets[order[i]]
+    if asset and not update_asset(asset, global.update_round) then
+      gone = gone or {}
+      table.insert(gone, asset.unit_number)
+    end
+  end
+  global.update_cursor = last + 1
+  -- After the loop: forgetting an asset reorders global.update_order
+  if gone then
+    for _, unit_number in ipairs(gone) do
+      forget_asset(unit_number)
     end
   end
 end
 
+-- Per tick: spread what is left of the round evenly over the ticks left before
+-- the next snapshot, so the round is done by the tick before it
+update_assets_for_tick = function(tick)
+  ensure_update_schedule()
+  local remaining = #global.update_order - global.update_cursor + 1
+  if remaining > 0 then
+    local ticks_left = SNAPSHOT_INTERVAL - tick % SNAPSHOT_INTERVAL
+    update_asset_slice(math.ceil(remaining / ticks_left))
+  end
+end
+
+-- At the snapshot: finish the round if anything is left (e.g. assets built on
+-- this tick) and start the next one
+local function finish_update_round()
+  ensure_update_schedule()
+  update_asset_slice(#global.update_order - global.update_cursor + 1)
+  global.update_cursor = 1
+  global.update_round = global.update_round + 1
+end
+
+local function asset_record(asset)
+  return {
+    unit_number            = asset.unit_number,
+    name                   = asset.name,
+    type                   = asset.type,
+    position               = asset.position,
+    line_id                = asset.line_id,  -- cached, maintained by the line index
+
+    last_status            = asset.last_status,
+    state_changed_tick     = asset.state_changed_tick,
+
+    production_count       = asset.production_count,
+    production_last_updated= asset.production_last_updated,
+
+    inventory              = asset.inventory,
+    fluids                 = asset.fluids,
+    pollution              = asset.pollution,
+    electric               = asset.electric,
+  }
+end
+
 local function build_snapshot()
   ensure_global_tables()
-  local snapshot = {tick = game.tick, assets = {}}
+  ensure_line_index()
+  local snapshot = {tick = game.tick, scan = scan_progress(), assets = {}}
   for _, asset in pairs(global.assets) do
     local e = asset.entity_ref
     if e and e.valid then
-      local line_id = assign_line_id(asset.position) --Assign line_ID
-      table.insert(snapshot.assets, {
-        unit_number            = asset.unit_number,
-        name                   = asset.name,
-        type                   = asset.type,
-        position               = asset.position,
-        line_id                = line_id,  -- New Added
-
-        last_status            = asset.last_status,
-        state_changed_tick     = asset.state_changed_tick,
-
-        production_count       = asset.production_count,
-        production_last_updated= asset.production_last_updated,
-
-        inventory              = asset.inventory,
-        fluids                 = asset.fluids,
-        pollution              = asset.pollution,
-        electric               = asset.electric,
-      })
+      table.insert(snapshot.assets, asset_record(asset))
     end
   end
   return snapshot
 end
 
+-- Assets marked dirty and unit_numbers removed since the last write
+local function build_delta()
+  local delta = {tick = game.tick, scan = scan_progress(), changed = {}, removed = {}}
+  for unit_number in pairs(global.dirty) do
+    local asset = global.assets[unit_number]
+    local e = asset and asset.entity_ref
+    if e and e.valid then
+      table.insert(delta.changed, asset_record(asset))
+    end
+  end
+  for unit_number in pairs(global.removed) do
+    table.insert(delta.removed, unit_number)
+  end
+  return delta
+end
+
 --------------------------------------------------------------------------------
 -- Extra) Check the target production_count and clear before it's full
 --------------------------------------------------------------------------------
@@ -404,15 +823,57 @@ local function clear_final_product()
   end
 end
 
-local function write_snapshot_to_file()
+local function write_delta_log()
+  global.snapshot_seq = global.snapshot_seq + 1
+  global.since_keyframe = (global.since_keyframe or 0) + 1
+  if global.keyframe_due or global.since_keyframe >= KEYFRAME_INTERVAL then
+    local snapshot = build_snapshot()
+    snapshot.seq = global.snapshot_seq
+    snapshot.kind = "full"
+    -- Not appended: the log restarts with every keyframe
+    helpers.write_file(SNAPSHOT_LOG_FILE, helpers.table_to_json(snapshot) .. "\n", false)
+    global.since_keyframe = 0
+    global.keyframe_due = false
+  else
+    local delta = build_delta()
+    delta.seq = global.snapshot_seq
+    delta.kind = "delta"
+    helpers.write_file(SNAPSHOT_LOG_FILE, helpers.table_to_json(delta) .. "\n", true)
+  end
+end
+
+-- The slot written SNAPSHOT_SLOTS - 1 snapshots ago is the one overwritten, so
+-- the committed slot stays intact for a whole interval after its manifest
+local function write_snapshot_slot()
+  global.snapshot_seq = global.snapshot_seq + 1
+  local slot = "factory_state." .. (global.snapshot_seq % SNAPSHOT_SLOTS) .. ".json"
   local snapshot = build_snapshot()
+  snapshot.seq = global.snapshot_seq
   local json_str = helpers.table_to_json(snapshot)
-  helpers.write_file("factory_state.json", json_str, false)
+  helpers.write_file(slot, json_str, false)
+  -- Commit only once the slot is complete
+  local manifest = {slot = slot, seq = global.snapshot_seq, tick = game.tick, size = #json_str, slots = SNAPSHOT_SLOTS}
+  helpers.write_file(SNAPSHOT_MANIFEST_FILE, helpers.table_to_json(manifest), false)
+end
+
+local function write_snapshot_to_file()
+  ensure_global_tables()
+  ensure_snapshot_state()
+  if SNAPSHOT_FORMAT == "slots" then
+    write_snapshot_slot()
+  elseif SNAPSHOT_FORMAT == "delta" then
+    write_delta_log()
+  else
+    local snapshot = build_snapshot()
+    local json_str = helpers.table_to_json(snapshot)
+    helpers.write_file("factory_state.json", json_str, false)
+  end
+  global.dirty = {}
+  global.removed = {}
 end
 
-local SNAPSHOT_INTERVAL = 60  -- e.g. every 60 ticks = 1 second
 script.on_nth_tick(SNAPSHOT_INTERVAL, function()
-  update_all_assets()
+  finish_update_round()
   write_snapshot_to_file()
   clear_final_product()
 end)
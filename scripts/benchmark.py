@@ -0,0 +1,631 @@
+#####################################################################
+# Regression benchmark for publisher.py.                            #
+#                                                                   #
+# Runs the publish pipeline against an in-process fake MQTT client  #
+# for growing asset counts and checks that the time per cycle grows #
+# linearly with the number of assets (constant time per asset).     #
+#                                                                   #
+# --suite runs the whole read + publish path on synthetic snapshot  #
+# files (snapshot_gen.py), one process per size, and reports cycle  #
+# latency, messages/bytes per cycle and peak RSS; --save keeps the   #
+# results and --baseline compares against a saved run.              #
+#                                                                   #
+# Usage: python benchmark.py [--sizes 500,1000,2000,4000]           #
+#        python benchmark.py --shards 1,2,4 --sizes 20000           #
+#        python benchmark.py --compare-formats --sizes 10000        #
+#        python benchmark.py --suite --save bench.json              #
+#        python benchmark.py --suite --baseline bench.json          #
+#        python benchmark.py --topic-aliases --sizes 5000           #
+#        python benchmark.py --check                                #
+#                                                                   #
+# --check runs correctness checks of the publish path (see CHECKS)  #
+# instead of timing it, and exits non-zero if one fails.            #
+#####################################################################
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import struct
+import subprocess
+import threading
+import sys
+import tempfile
+import time
+
+import publisher
+from payload_codec import PAYLOAD_FORMATS, get_encoder
+from snapshot_gen import SnapshotGenerator, add_generator_arguments, generator_from_args
+from snapshot_reader import SnapshotStream
+from topic_registry import TopicRegistry
+
+SUITE_SIZES = "1000,10000,100000"
+# Result fields compared against a baseline (all "lower is better")
+REGRESSION_FIELDS = ("cycle_ms_median", "first_cycle_ms", "msgs_per_cycle", "kib_per_cycle", "peak_rss_mib")
+
+
+class FakeClient:
+    """Stands in for the paho client and records every publish."""
+    def __init__(self, name="main"):
+        self.messages = 0
+        self.bytes = 0
+
+    def loop_start(self):
+        pass
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        self.messages += 1
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        self.bytes += len(topic.encode("utf-8")) + len(payload or b"")
+
+
+class RecordingClient(FakeClient):
+    """A FakeClient that also keeps (topic, payload) of every publish."""
+    def __init__(self, name="main"):
+        super().__init__(name)
+        self.sent = []
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        super().publish(topic, payload, qos, retain, properties)
+        self.sent.append((topic, payload))
+
+
+class NullRegistry:
+    def record(self, topic, payload):
+        pass
+
+    def sweep(self, keep):
+        return 0
+
+
+def reset_publisher():
+    """Forget everything publisher.py remembers between snapshots."""
+    publisher.last_published.clear()
+    publisher.delta_tracker.clear()
+    publisher.topic_plans.clear()
+    if publisher.deadband is not None:
+        publisher.deadband.clear()
+    if publisher.columnar_index is not None:
+        publisher.columnar_index.clear()
+    if publisher.sparkplug_node is not None:
+        publisher.sparkplug_node.clear()
+
+
+def time_cycles(count, cycles=3):
+    """Return (mean seconds, mean messages, mean bytes) per publish cycle for 'count' assets."""
+    reset_publisher()
+    client = FakeClient()
+    registry = NullRegistry()
+    gen = SnapshotGenerator(count, seed=count)
+    publisher.publish_snapshot(client, gen.decoded(), registry)  # warm-up: first publish of everything
+
+    elapsed = 0.0
+    client.messages = 0
+    client.bytes = 0
+    for _ in range(cycles):
+        gen.advance()
+        # New objects every cycle, like a snapshot read from disk: nothing the
+        # publisher kept from the last cycle may alias the generator's state
+        assets = gen.decoded()
+        start = time.perf_counter()
+        publisher.publish_snapshot(client, assets, registry)
+        elapsed += time.perf_counter() - start
+    return elapsed / cycles, client.messages / cycles, client.bytes / cycles
+
+
+def time_sharded_cycles(count, shards, cycles=3):
+    """Return the mean seconds per publish cycle for 'count' assets over 'shards' workers."""
+    publisher.last_published.clear()
+    client = FakeClient()
+    registry = NullRegistry()
+    gen = SnapshotGenerator(count, seed=count)
+    with tempfile.TemporaryDirectory() as registry_dir:
+        pool = publisher.start_shard_pool(shards, FakeClient, os.path.join(registry_dir, "topic_registry.jsonl"))
+        try:
+            publisher.publish_snapshot_sharded(client, pool, gen.decoded(), registry)
+            pool.wait()
+
+            elapsed = 0.0
+            for _ in range(cycles):
+                gen.advance()
+                assets = gen.decoded()
+                start = time.perf_counter()
+                publisher.publish_snapshot_sharded(client, pool, assets, registry)
+                pool.wait()
+                elapsed += time.perf_counter() - start
+        finally:
+            pool.close()
+    return elapsed / cycles
+
+
+def scaling_curve(count, shard_counts):
+    """Print cycle time and speed-up against one worker for each shard count."""
+    baseline = None
+    for shards in shard_counts:
+        seconds = time_sharded_cycles(count, shards)
+        baseline = baseline or seconds
+        print(f"{shards:>3} shards, {count} assets: {seconds * 1000:8.2f} ms/cycle, "
+              f"speed-up x{baseline / seconds:.2f}")
+
+
+def compare_formats(count):
+    """Print encode time and bytes for one full cycle of 'count' assets in every payload format."""
+    publisher.topic_plans.clear()
+    messages = []
+    for asset in SnapshotGenerator(count).assets:
+        messages.extend(publisher.build_asset_messages(asset))
+    for payload_format in PAYLOAD_FORMATS:
+        try:
+            encode = get_encoder(payload_format)
+        except ImportError as e:
+            print(f"{payload_format:>8}: skipped ({e.name} not installed)")
+            continue
+        start = time.perf_counter()
+        sent = sum(len(encode(value)) for _, value in messages)
+        seconds = time.perf_counter() - start
+        print(f"{payload_format:>8}: {seconds * 1000:8.2f} ms to encode {len(messages)} payloads, "
+              f"{sent / 1024:9.1f} KiB/cycle")
+
+
+class StandInBroker:
+    """
+    Local stand-in for the broker: accepts one connection, answers its
+    CONNECT with a CONNACK (announcing 'topic_alias_maximum' to MQTT v5
+    clients) and counts every byte received after that. QoS 0 only.
+    """
+    def __init__(self, topic_alias_maximum=65535):
+        self.topic_alias_maximum = topic_alias_maximum
+        self.received = 0
+        self._server = socket.create_server(("127.0.0.1", 0))
+        self.port = self._server.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    @staticmethod
+    def _read_packet(conn):
+        first = conn.recv(1)
+        length, shift = 0, 0
+        while True:
+            byte = conn.recv(1)[0]
+            length |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        body = b""
+        while len(body) < length:
+            body += conn.recv(length - len(body))
+        return first, body
+
+    def _serve(self):
+        conn, _ = self._server.accept()
+        with conn:
+            _, connect = self._read_packet(conn)
+            protocol_level = connect[6]   # after the length-prefixed "MQTT"
+            if protocol_level == 5:
+                properties = b"\x22" + struct.pack(">H", self.topic_alias_maximum)
+                connack = b"\x00\x00" + bytes([len(properties)]) + properties
+            else:
+                connack = b"\x00\x00"
+            conn.sendall(bytes([0x20, len(connack)]) + connack)
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    return
+                self.received += len(data)
+
+
+def compare_topic_aliases(count, cycles=5):
+    """
+    Publish 1 + 'cycles' snapshots of 'count' assets through a real paho
+    client to a StandInBroker, as MQTT 3.1.1, v5 and v5 with topic
+    aliases, and print the bytes on the wire per cycle after the first
+    (which publishes every topic once and binds the aliases).
+    """
+    baseline = None
+    for protocol, aliases in (("3.1.1", False), ("5", False), ("5", True)):
+        reset_publisher()
+        broker = StandInBroker()
+        publisher.BROKER, publisher.PORT = "127.0.0.1", broker.port
+        publisher.MQTT_PROTOCOL, publisher.TOPIC_ALIASES = protocol, aliases
+        client = publisher.connect_mqtt("benchmark")
+        client.loop_start()
+        while not client.is_connected():
+            time.sleep(0.01)
+        gen = SnapshotGenerator(count, seed=count)
+        registry = NullRegistry()
+        counter = FakeClient()
+        for cycle in range(cycles + 1):
+            if cycle == 1:
+                first_cycle_bytes = _flushed(client, broker)
+                counter.messages = 0
+            if cycle:
+                gen.advance()
+            publisher.publish_snapshot(_Tee(client, counter), gen.decoded(), registry)
+        sent = (_flushed(client, broker) - first_cycle_bytes) / cycles
+        messages = counter.messages / cycles
+        client.disconnect()
+        client.loop_stop()
+        baseline = baseline or sent
+        label = f"MQTT {protocol}" + (" + aliases" if aliases else "")
+        print(f"{label:>18}: {messages:8.0f} msgs/cycle, {sent / 1024:8.1f} KiB/cycle on the wire "
+              f"({sent / messages:6.1f} B/msg, x{sent / baseline:.2f}); first cycle {first_cycle_bytes / 1024:.1f} KiB")
+
+
+def _flushed(client, broker):
+    """Wait until the client's queue is empty and the stand-in stopped receiving; return its byte count."""
+    last = -1
+    while last != broker.received or client._out_packet:
+        last = broker.received
+        time.sleep(0.2)
+    return broker.received
+
+
+class _Tee:
+    """Publish to a client and count the messages on a FakeClient."""
+    def __init__(self, client, counter):
+        self.client, self.counter = client, counter
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        self.counter.publish(topic, payload)
+        return self.client.publish(topic, payload, qos, retain, properties)
+
+
+def peak_rss_mib():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_pipeline(count, args):
+    """
+    The full publish path for 'count' synthetic assets: write the snapshot
+    file, read it back (streaming or not, as configured), publish it and
+    flush the registry, for 1 + args.cycles snapshots. The first cycle
+    publishes everything and is reported on its own. Run it in a fresh
+    process per size so the peak RSS belongs to that size alone (it
+    includes the generator's own copy of the snapshot).
+    """
+    gen = generator_from_args(count, args)
+    client = FakeClient()
+    latencies = []
+    messages = sent = 0
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, "factory_state.json")
+        registry = TopicRegistry(os.path.join(work_dir, "topic_registry.jsonl"),
+                                 publisher.REGISTRY_FLUSH_INTERVAL, publisher.PAYLOAD_FORMAT)
+        for cycle in range(args.cycles + 1):
+            if cycle:
+                gen.advance()
+            gen.write(path)
+            client.messages = client.bytes = 0
+            start = time.perf_counter()
+            if publisher.STREAMING:
+                assets = SnapshotStream(path, publisher.STREAM_CHUNK_SIZE)
+            else:
+                assets = publisher.read_snapshot(path)
+            publisher.publish_snapshot(client, assets, registry)
+            registry.flush_if_due()
+            elapsed = time.perf_counter() - start
+            if cycle:
+                latencies.append(elapsed)
+                messages += client.messages
+                sent += client.bytes
+            else:
+                first = elapsed
+    return {
+        "assets": count,
+        "first_cycle_ms": round(first * 1000, 2),
+        "cycle_ms_median": round(statistics.median(latencies) * 1000, 2),
+        "cycle_ms_max": round(max(latencies) * 1000, 2),
+        "msgs_per_cycle": round(messages / args.cycles, 1),
+        "kib_per_cycle": round(sent / 1024 / args.cycles, 1),
+        "peak_rss_mib": round(peak_rss_mib(), 1),
+    }
+
+
+def run_suite(sizes, args):
+    """Run run_pipeline() for every size in a child process; returns the list of results."""
+    results = []
+    for count in sizes:
+        # The child sees the same options, so mode/format/generator settings carry over
+        command = [sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--pipeline-one", str(count)]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append(result)
+        print(f"{count:>7} assets: {result['cycle_ms_median']:9.2f} ms/cycle (max {result['cycle_ms_max']:.2f}, "
+              f"first {result['first_cycle_ms']:.2f}), {result['msgs_per_cycle']:9.0f} msgs/cycle, "
+              f"{result['kib_per_cycle']:9.1f} KiB/cycle, peak RSS {result['peak_rss_mib']:7.1f} MiB")
+    return results
+
+
+def compare_to_baseline(results, baseline_path, max_ratio):
+    """Print new/baseline ratios per size and field; returns False if any exceeds 'max_ratio'."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {result["assets"]: result for result in json.load(f)["results"]}
+    ok = True
+    for result in results:
+        old = baseline.get(result["assets"])
+        if old is None:
+            print(f"{result['assets']:>7} assets: not in baseline")
+            continue
+        ratios = []
+        for field in REGRESSION_FIELDS:
+            if old.get(field):
+                ratio = result[field] / old[field]
+                ratios.append(f"{field} x{ratio:.2f}")
+                if ratio > max_ratio:
+                    ok = False
+                    ratios[-1] += " REGRESSION"
+        print(f"{result['assets']:>7} assets: " + ", ".join(ratios))
+    return ok
+
+
+# -- correctness checks (--check) ------------------------------------------
+def check_line_move():
+    """An asset moved to another line publishes every section on its new topics."""
+    saved = publisher.columnar_index
+    try:
+        from columnar import ColumnarIndex
+    except ImportError:
+        print("skip: check_line_move needs numpy")
+        return True
+    publisher.columnar_index = ColumnarIndex(publisher.decode_dominant_flag, publisher.decode_all_flags)
+    try:
+        reset_publisher()
+        client = RecordingClient()
+        gen = SnapshotGenerator(20, type_mix={"furnace": 1}, lines=2, seed=5)
+        publisher.publish_snapshot(client, gen.assets, NullRegistry())
+        asset = gen.assets[0]
+        old_base = publisher.topic_plans.get(asset).base
+        asset["line_id"] = "LineMoved"
+        client.sent.clear()
+        publisher.publish_snapshot(client, gen.assets, NullRegistry())
+        base = publisher.topic_plans.get(asset).base
+        sent = {topic for topic, _ in client.sent}
+        missing = [f"{base}/{section}" for section in ("basic", "pos", "status", "production", "pollution")
+                   if f"{base}/{section}" not in sent]
+        return base != old_base and not missing
+    finally:
+        publisher.columnar_index = saved
+        reset_publisher()
+
+
+def check_registry_sweep():
+    """A removed asset leaves the topic registry and its file at the next compaction."""
+    reset_publisher()
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            path = os.path.join(work_dir, "topic_registry.jsonl")
+            registry = TopicRegistry(path, flush_interval=0.0, payload_format=publisher.PAYLOAD_FORMAT)
+            gen = SnapshotGenerator(20, lines=2, seed=5)
+            assets = gen.decoded()
+            publisher.publish_snapshot(FakeClient(), assets, registry)
+            registry.flush_if_due()
+            base = publisher.topic_plans.get(assets[0]).base
+            publisher.publish_snapshot(FakeClient(), assets[1:], registry)
+            registry.flush_if_due()
+            with open(path, encoding="utf-8") as f:
+                on_disk = [json.loads(line)["topic"] for line in f]
+            stale = [topic for topic in list(registry.topics) + on_disk
+                     if topic == base or topic.startswith(base + "/")]
+            return len(on_disk) == len(registry.topics) > 0 and not stale
+    finally:
+        reset_publisher()
+
+
+def check_outbox_round_trip():
+    """Outbox records keep qos/retain/properties across a reopen; a torn segment tail is skipped."""
+    from outbox import SEGMENT_SUFFIX, Outbox
+    from paho.mqtt.packettypes import PacketTypes
+    from paho.mqtt.properties import Properties
+
+    properties = Properties(PacketTypes.PUBLISH)
+    properties.MessageExpiryInterval = 30
+    with tempfile.TemporaryDirectory() as directory:
+        outbox = Outbox(directory, segment_bytes=64)
+        outbox.put("a/status", '{"status":1}', qos=1, retain=True, properties=properties)
+        outbox.put("a/pos", b"[1,2]")
+        outbox.put("a/basic", b"{}", qos=2)
+        written = outbox.pending_bytes() == sum(
+            os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+            if name.endswith(SEGMENT_SUFFIX))
+        first = outbox.peek(1)
+        outbox.consume(1)
+        # Cut the last record short as a crash would, then reopen as after a restart
+        segment = os.path.join(directory, sorted(os.listdir(directory))[-1])
+        with open(segment, "r+b") as f:
+            f.truncate(os.path.getsize(segment) - 1)
+        outbox = Outbox(directory, segment_bytes=64)
+        rest = outbox.peek(10)
+        outbox.consume(len(rest))
+        torn = outbox.peek(10)    # only the torn bytes are left: dropped
+        topic, payload, qos, retain, props = first[0]
+        return (topic == "a/status" and payload == b'{"status":1}' and qos == 1 and retain
+                and props.MessageExpiryInterval == 30
+                and rest == [("a/pos", b"[1,2]", 0, False, None)]
+                and torn == [] and not outbox.pending() and written)
+
+
+def check_outbox_compaction():
+    """The "latest" outbox policy keeps every merge patch after a topic's latest full document."""
+    from outbox import Outbox
+
+    with tempfile.TemporaryDirectory() as directory:
+        outbox = Outbox(directory, drop_policy="latest")
+        for topic, payload in [("a", "F1"), ("a/delta", "P1"), ("b", "B1"), ("a/delta", "P2"),
+                               ("b", "B2"), ("c/delta", "C1"), ("c", "C2"), ("c/delta", "C3")]:
+            outbox.put(topic, payload)
+        outbox.compact()
+        kept = [(topic, payload) for topic, payload, *_ in outbox.peek(10)]
+    return kept == [("a", b"F1"), ("a/delta", b"P1"), ("a/delta", b"P2"), ("b", b"B2"),
+                    ("c", b"C2"), ("c/delta", b"C3")] and outbox.dropped == 2
+
+
+def check_stack_patch():
+    """In delta mode a changed inventory count is patched as that one item."""
+    from merge_patch import DeltaTracker, apply_merge_patch, stacks_to_dict
+
+    tracker = DeltaTracker(keyframe_interval=1000)
+    old = [{"name": "iron-plate", "quality": "normal", "count": 5},
+           {"name": "coal", "quality": "normal", "count": 9}]
+    new = [{"name": "iron-plate", "quality": "normal", "count": 6},
+           {"name": "coal", "quality": "normal", "count": 9}]
+    tracker.begin_cycle()
+    _, full = tracker.plan("t", stacks_to_dict(old))
+    tracker.begin_cycle()
+    kind, patch = tracker.plan("t", stacks_to_dict(new))
+    return (kind == "delta" and patch == {"iron-plate": {"normal": 6}}
+            and apply_merge_patch(full, patch) == stacks_to_dict(new))
+
+
+def check_scheduler_patches():
+    """A queued full document replaces its topic's patches in place; the patch queue and priority cache are capped."""
+    from scheduler import PriorityScheduler
+
+    client = RecordingClient()
+    dropped = []
+    scheduler = PriorityScheduler(client, {"medium": 0.001}, max_queued_patches=2,
+                                  on_patches_dropped=dropped.append, max_cached_topics=2)
+    scheduler.publish("f/doc", "full0")        # takes the only token
+    scheduler.publish("f/other", "other")
+    scheduler.publish("f/doc/delta", "patch1")
+    scheduler.publish("f/doc", "full1")        # drops patch1, stays behind f/other
+    scheduler.publish("f/doc/delta", "patch2")
+    scheduler.publish("f/x/delta", "x1")
+    scheduler.publish("f/x/delta", "x2")       # over the cap: x's patches are dropped
+    scheduler.buckets["medium"].rate = 0
+    while scheduler._drain_once():
+        pass
+    return (client.sent == [("f/doc", "full0"), ("f/other", "other"),
+                            ("f/doc", "full1"), ("f/doc/delta", "patch2")]
+            and dropped == ["f/x"] and scheduler.patches_dropped == 2
+            and scheduler.pending()["medium"] == 0
+            and list(scheduler._sections) == ["f/doc/delta", "f/x/delta"])
+
+
+def check_columnar_electricity():
+    """The columnar path publishes the same electricity topics, skipping unchanged rows."""
+    try:
+        from columnar import ColumnarIndex
+    except ImportError:
+        print("skip: check_columnar_electricity needs numpy")
+        return True
+    saved = publisher.columnar_index
+    sent = []
+    try:
+        for index in (None, ColumnarIndex(publisher.decode_dominant_flag, publisher.decode_all_flags)):
+            publisher.columnar_index = index
+            reset_publisher()
+            client = RecordingClient()
+            gen = SnapshotGenerator(200, seed=7)
+            for cycle in range(4):
+                if cycle:
+                    gen.advance()
+                snapshot = gen.decoded()
+                publisher.publish_snapshot(client, snapshot, NullRegistry())
+            sent.append([message for message in client.sent if message[0].endswith("/electricity")])
+        frame = index.ingest(snapshot)
+        electric = sum(1 for asset in gen.assets if "electric" in asset)
+        return (sent[0] == sent[1] and electric > 0
+                and not frame.changed["electricity"].any())
+    finally:
+        publisher.columnar_index = saved
+        reset_publisher()
+
+
+CHECKS = [check_line_move, check_columnar_electricity, check_registry_sweep, check_outbox_round_trip, check_outbox_compaction,
+          check_stack_patch, check_scheduler_patches]
+
+
+def run_checks():
+    ok = True
+    for check in CHECKS:
+        passed = check()
+        print(f"{'OK  ' if passed else 'FAIL'} {check.__name__}: {check.__doc__}")
+        ok &= bool(passed)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="publisher.py regression benchmark")
+    parser.add_argument("--sizes", default=None,
+                        help=f"comma-separated asset counts (default 500,1000,2000,4000; {SUITE_SIZES} with --suite)")
+    parser.add_argument("--mode", choices=publisher.PUBLISH_MODES, default=publisher.PUBLISH_MODE)
+    parser.add_argument("--delta", action="store_true", help="publish merge-patch deltas")
+    parser.add_argument("--columnar", action="store_true", help="use the NumPy columnar ingest path")
+    parser.add_argument("--payload-format", choices=PAYLOAD_FORMATS, default=publisher.PAYLOAD_FORMAT)
+    parser.add_argument("--compare-formats", action="store_true",
+                        help="compare encode time and bytes per cycle of every payload format")
+    parser.add_argument("--topic-aliases", action="store_true",
+                        help="compare bytes on the wire with and without MQTT v5 topic aliases")
+    parser.add_argument("--shards", default="",
+                        help="comma-separated worker counts: print the sharded scaling curve instead")
+    parser.add_argument("--tolerance", type=float, default=2.0,
+                        help="max allowed ratio of per-asset cost between largest and smallest size")
+    parser.add_argument("--suite", action="store_true",
+                        help="run the file read + publish pipeline per size in its own process")
+    parser.add_argument("--cycles", type=int, default=5, help="snapshots per size after the first (--suite)")
+    parser.add_argument("--save", help="write the --suite results to this JSON file")
+    parser.add_argument("--baseline", help="compare the --suite results against this saved JSON file")
+    parser.add_argument("--max-regression", type=float, default=1.25,
+                        help="max allowed new/baseline ratio for any field (--baseline)")
+    parser.add_argument("--check", action="store_true", help="run the correctness checks instead of timing")
+    parser.add_argument("--pipeline-one", type=int, help=argparse.SUPPRESS)
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+
+    publisher.PUBLISH_MODE = args.mode
+    if args.mode == "sparkplug" and publisher.sparkplug_node is None:
+        from sparkplug import SparkplugNode
+        publisher.sparkplug_node = SparkplugNode("Factorio", "Benchmark")
+    publisher.DELTA_MODE = args.delta or publisher.DELTA_MODE
+    if args.columnar and publisher.columnar_index is None:
+        from columnar import ColumnarIndex
+        publisher.columnar_index = ColumnarIndex(publisher.decode_dominant_flag, publisher.decode_all_flags)
+    publisher.encode_payload = get_encoder(args.payload_format)
+    if args.check:
+        sys.exit(0 if run_checks() else 1)
+    if args.pipeline_one:
+        print(json.dumps(run_pipeline(args.pipeline_one, args)))
+        return
+    sizes = [int(s) for s in (args.sizes or (SUITE_SIZES if args.suite else "500,1000,2000,4000")).split(",")]
+    if args.suite:
+        results = run_suite(sizes, args)
+        if args.save:
+            with open(args.save, "w", encoding="utf-8") as f:
+                json.dump({"python": platform.python_version(), "platform": platform.platform(),
+                           "argv": sys.argv[1:], "results": results}, f, indent=2)
+            print(f"Results saved to {args.save}")
+        if args.baseline and not compare_to_baseline(results, args.baseline, args.max_regression):
+            print(f"FAIL: regression beyond x{args.max_regression} against {args.baseline}")
+            sys.exit(1)
+        return
+    if args.compare_formats:
+        compare_formats(sizes[-1])
+        return
+    if args.topic_aliases:
+        compare_topic_aliases(sizes[-1], args.cycles)
+        return
+    if args.shards:
+        scaling_curve(sizes[-1], [int(s) for s in args.shards.split(",")])
+        return
+
+    per_asset = []
+    for count in sizes:
+        seconds, messages, sent = time_cycles(count)
+        per_asset.append(seconds / count)
+        print(f"{count:>7} assets: {seconds * 1000:8.2f} ms/cycle, {seconds / count * 1e6:6.2f} us/asset, "
+              f"{messages:8.0f} msgs/cycle, {sent / 1024:8.1f} KiB/cycle")
+
+    ratio = per_asset[-1] / per_asset[0]
+    print(f"per-asset cost ratio (largest/smallest): {ratio:.2f}")
+    if ratio > args.tolerance:
+        print("FAIL: publish cycle does not scale linearly with asset count")
+        sys.exit(1)
+    print("OK: publish cycle scales linearly with asset count")
+
+
+if __name__ == "__main__":
+    main()
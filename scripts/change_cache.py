@@ -0,0 +1,84 @@
+#####################################################################
+# Compact change-detection store for publisher.py.                  #
+#                                                                   #
+# Keeps one 64-bit digest per topic instead of the full payload,    #
+# drops topics that were not part of the latest snapshot (mined or  #
+# destroyed entities), and can optionally cap its size with LRU.    #
+#####################################################################
+import sys
+from collections import OrderedDict
+
+
+class ChangeCache:
+    """
+    Topic -> payload digest store.
+
+        cache.begin_cycle()
+        if cache.update(topic, payload):   # True if payload differs from last time
+            client.publish(topic, payload)
+        cache.sweep()                      # forget topics not seen this cycle
+
+    'max_topics' > 0 bounds the number of entries; the least recently
+    updated topic is evicted first (and simply republished if it returns).
+    """
+    def __init__(self, max_topics=0):
+        self.max_topics = max_topics
+        self._digests = OrderedDict() if max_topics else {}
+        self._seen = set()
+        self.unchanged = 0   # update() calls that found the same payload
+
+    def __len__(self):
+        return len(self._digests)
+
+    def __contains__(self, topic):
+        return topic in self._digests
+
+    def update(self, topic, payload):
+        """
+        Record 'payload' for 'topic'. Returns True if it differs from the
+        previously recorded payload (or the topic is new), False otherwise.
+        """
+        # str/bytes hashing is 64-bit SipHash; the digests never leave this
+        # process, so per-process hash seeding does not matter
+        digest = hash(payload)
+        digests = self._digests
+        old = digests.get(topic)
+        if old is None:
+            topic = sys.intern(topic)
+        self._seen.add(topic)
+        if old == digest:
+            self.unchanged += 1
+            if self.max_topics:
+                digests.move_to_end(topic)
+            return False
+
+        digests[topic] = digest
+        if self.max_topics:
+            digests.move_to_end(topic)
+            if len(digests) > self.max_topics:
+                digests.popitem(last=False)
+        return True
+
+    def touch(self, topic):
+        """Mark 'topic' as still present this cycle without re-checking its payload."""
+        if topic in self._digests:
+            self._seen.add(topic)
+
+    def discard(self, topic):
+        self._digests.pop(topic, None)
+        self._seen.discard(topic)
+
+    def begin_cycle(self):
+        self._seen = set()
+
+    def sweep(self):
+        """Drop every topic not updated or touched since begin_cycle(). Returns the count."""
+        seen = self._seen
+        stale = [topic for topic in self._digests if topic not in seen]
+        for topic in stale:
+            del self._digests[topic]
+        return len(stale)
+
+    def clear(self):
+        self._digests.clear()
+        self._seen = set()
@@ -0,0 +1,137 @@
+#####################################################################
+# Optional columnar (NumPy) ingest path for publisher.py.           #
+#                                                                   #
+# Loads the scalar fields of a snapshot into arrays, decodes the    #
+# status bitmask of the whole fleet with one table lookup, and      #
+# compares against the previous snapshot by unit_number, so only    #
+# rows whose status/production/pollution/position/electricity       #
+# changed need to be encoded and published for those subtopics.     #
+#                                                                   #
+# Requires numpy (pip install numpy); the publisher runs without it #
+# when [publisher] columnar is off.                                 #
+#####################################################################
+import numpy as np
+
+STATUS_BITS = 11            # highest status flag is 1024
+STATUS_MASK = (1 << STATUS_BITS) - 1
+
+# section -> the asset fields it is built from, with their defaults
+SECTIONS = {
+    "status":     (("last_status", 0), ("state_changed_tick", 0)),
+    "production": (("production_count", 0), ("production_last_updated", 0)),
+    "pollution":  (("pollution", 0.0),),
+}
+# The "electricity" section, from the asset's "electric" dict
+ELECTRIC_FIELDS = ("energyUsage", "currentEnergy")
+# electric_shape column: no/empty dict, exactly ELECTRIC_FIELDS, anything else (always changed)
+ELECTRIC_EMPTY, ELECTRIC_FIELDS_ONLY, ELECTRIC_OTHER = 0, 1, 2
+
+
+def electric_shape(electric):
+    if not electric:
+        return ELECTRIC_EMPTY
+    if (isinstance(electric, dict) and electric.keys() == set(ELECTRIC_FIELDS)
+            and all(isinstance(electric[name], (int, float)) for name in ELECTRIC_FIELDS)):
+        return ELECTRIC_FIELDS_ONLY
+    return ELECTRIC_OTHER
+
+
+def build_status_tables(decode_dominant_flag, decode_all_flags):
+    """
+    Precompute the decoded status for every 11-bit mask (2048 entries):
+    returns (dominant label per mask, comma-joined flag names per mask).
+    """
+    dominant = np.array([decode_dominant_flag(mask) for mask in range(STATUS_MASK + 1)], dtype=object)
+    flags = np.array([', '.join(decode_all_flags(mask)) for mask in range(STATUS_MASK + 1)], dtype=object)
+    return dominant, flags
+
+
+class ColumnarFrame:
+    """
+    One snapshot in columnar form. Row i describes assets[i].
+
+    'changed[section][i]' is False when that section of row i is identical
+    to the previous committed snapshot; 'dominant[i]' / 'flags[i]' hold the
+    decoded status of row i.
+    """
+    def __init__(self, units, columns, changed, dominant, flags):
+        self.units = units
+        self.columns = columns
+        self.changed = changed
+        # Plain lists: indexing them per row is much cheaper than numpy scalars
+        self.dominant = dominant.tolist()
+        self.flags = flags.tolist()
+        self._changed_rows = [(section, mask.tolist()) for section, mask in changed.items()]
+
+    def unchanged_sections(self, row):
+        return [section for section, mask in self._changed_rows if not mask[row]]
+
+
+class ColumnarIndex:
+    """
+    Holds the last committed snapshot's columns, sorted by unit_number,
+    and builds a ColumnarFrame for each new snapshot.
+
+        frame = index.ingest(assets)
+        ...publish using frame...
+        index.commit(frame)      # only once the snapshot was fully published
+    """
+    def __init__(self, decode_dominant_flag, decode_all_flags):
+        self._dominant_table, self._flags_table = build_status_tables(
+            decode_dominant_flag, decode_all_flags)
+        self._previous = None   # (sorted units, {column: sorted values})
+
+    def ingest(self, assets):
+        count = len(assets)
+        units = np.fromiter(
+            (asset.get("unit_number", asset.get("id", -1)) for asset in assets),
+            dtype=np.int64, count=count)
+        columns = {}
+        for fields in SECTIONS.values():
+            for name, default in fields:
+                columns[name] = np.fromiter(
+                    (asset.get(name, default) for asset in assets), dtype=np.float64, count=count)
+        position = [asset.get("position") or {} for asset in assets]
+        columns["x"] = np.fromiter((p.get("x", 0.0) for p in position), dtype=np.float64, count=count)
+        columns["y"] = np.fromiter((p.get("y", 0.0) for p in position), dtype=np.float64, count=count)
+        electric = [asset.get("electric") for asset in assets]
+        shape = np.fromiter((electric_shape(e) for e in electric), dtype=np.int8, count=count)
+        columns["electric_shape"] = shape
+        for name in ELECTRIC_FIELDS:
+            columns[name] = np.fromiter(
+                (e[name] if s == ELECTRIC_FIELDS_ONLY else 0.0 for e, s in zip(electric, shape.tolist())),
+                dtype=np.float64, count=count)
+
+        status = columns["last_status"].astype(np.int64) & STATUS_MASK
+        dominant = self._dominant_table[status]
+        flags = self._flags_table[status]
+
+        changed = {section: np.ones(count, dtype=bool) for section in list(SECTIONS) + ["pos", "electricity"]}
+        if self._previous is not None and count and len(self._previous[0]):
+            prev_units, prev_columns = self._previous
+            # Match each row to the same unit_number in the previous snapshot
+            slot = np.searchsorted(prev_units, units)
+            slot[slot >= len(prev_units)] = 0
+            known = prev_units[slot] == units
+            for section, fields in SECTIONS.items():
+                same = known.copy()
+                for name, _ in fields:
+                    same &= prev_columns[name][slot] == columns[name]
+                changed[section] = ~same
+            changed["pos"] = ~(known
+                               & (prev_columns["x"][slot] == columns["x"])
+                               & (prev_columns["y"][slot] == columns["y"]))
+            same = known & (prev_columns["electric_shape"][slot] == shape) & (shape != ELECTRIC_OTHER)
+            for name in ELECTRIC_FIELDS:
+                same &= prev_columns[name][slot] == columns[name]
+            changed["electricity"] = ~same
+
+        return ColumnarFrame(units, columns, changed, dominant, flags)
+
+    def commit(self, frame):
+        order = np.argsort(frame.units, kind="stable")
+        self._previous = (frame.units[order],
+                          {name: column[order] for name, column in frame.columns.items()})
+
+    def clear(self):
+        self._previous = None
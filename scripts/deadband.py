@@ -0,0 +1,125 @@
+#####################################################################
+# Deadband / rate filtering for numeric time-series topics.         #
+#                                                                   #
+# Rules are configured per topic class ([deadband.<class>] in       #
+# config.toml) for the pollution, electricity, fluids and           #
+# production subtopics:                                             #
+#   abs          - ignore changes of a number smaller than this     #
+#   pct          - ignore changes smaller than this % of the old    #
+#   min_interval - never publish a topic more often (seconds)       #
+#   max_interval - republish at least this often, changed or not    #
+# Numbers nested in dicts and lists (e.g. the electric info) are    #
+# compared one by one; any non-numeric change always counts.        #
+#####################################################################
+import time
+
+from merge_patch import copy_value
+
+TOPIC_CLASSES = ("pollution", "electricity", "fluids", "production")
+
+# check() verdicts
+DROP, SEND, HEARTBEAT = "drop", "send", "heartbeat"
+
+
+class DeadbandRule:
+    def __init__(self, abs=None, pct=None, min_interval=0.0, max_interval=0.0):
+        self.abs = abs
+        self.pct = pct
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+    def significant(self, old, new):
+        """True if 'new' differs from 'old' by more than the deadband anywhere."""
+        if isinstance(new, bool) or isinstance(old, bool):
+            return old != new
+        if isinstance(new, (int, float)) and isinstance(old, (int, float)):
+            delta = abs(new - old)
+            if self.abs is None and self.pct is None:
+                return delta != 0
+            if self.abs is not None and delta > self.abs:
+                return True
+            return self.pct is not None and delta > abs(old) * self.pct / 100.0
+        if isinstance(new, dict) and isinstance(old, dict):
+            if new.keys() != old.keys():
+                return True
+            return any(self.significant(old[key], value) for key, value in new.items())
+        if isinstance(new, list) and isinstance(old, list):
+            if len(new) != len(old):
+                return True
+            return any(self.significant(o, n) for o, n in zip(old, new))
+        return old != new
+
+
+def topic_class(topic):
+    """The deadband class of a field-mode subtopic, or None."""
+    parent, _, leaf = topic.rpartition('/')
+    if leaf in TOPIC_CLASSES:
+        return leaf
+    if leaf.startswith("box") and parent.endswith("/fluids"):
+        return "fluids"
+    return None
+
+
+class DeadbandFilter:
+    """
+    Decides per publish whether a value is worth sending:
+      DROP      - within the deadband or min_interval, skip it
+      SEND      - publish as usual (subject to change detection)
+      HEARTBEAT - max_interval elapsed, publish even if unchanged
+    """
+    def __init__(self, rules):
+        self.rules = rules           # class -> DeadbandRule
+        self._classes = {}           # topic -> class (None if unfiltered)
+        self._state = {}             # topic -> (last sent value, last sent time)
+        self._seen = set()
+
+    @classmethod
+    def from_config(cls, section):
+        rules = {}
+        for name, options in section.items():
+            if name not in TOPIC_CLASSES:
+                raise ValueError(f"unknown deadband class '{name}', expected one of {', '.join(TOPIC_CLASSES)}")
+            rules[name] = DeadbandRule(**options)
+        return cls(rules)
+
+    def check(self, topic, value, now=None):
+        rule_class = self._classes.get(topic, False)
+        if rule_class is False:
+            rule_class = self._classes[topic] = topic_class(topic)
+        rule = self.rules.get(rule_class) if rule_class else None
+        if rule is None:
+            return SEND
+        self._seen.add(topic)
+        now = time.monotonic() if now is None else now
+        state = self._state.get(topic)
+        if state is not None:
+            old, sent_at = state
+            elapsed = now - sent_at
+            if rule.max_interval and elapsed >= rule.max_interval:
+                self._state[topic] = (copy_value(value), now)
+                return HEARTBEAT
+            if elapsed < rule.min_interval or not rule.significant(old, value):
+                return DROP
+        self._state[topic] = (copy_value(value), now)
+        return SEND
+
+    def touch(self, topic):
+        """Keep 'topic' for this cycle without checking a value for it."""
+        if topic in self._state:
+            self._seen.add(topic)
+
+    def begin_cycle(self):
+        self._seen = set()
+
+    def sweep(self):
+        """Forget topics that were not checked since begin_cycle(). Returns the count."""
+        stale = [topic for topic in self._state if topic not in self._seen]
+        for topic in stale:
+            del self._state[topic]
+            self._classes.pop(topic, None)
+        return len(stale)
+
+    def clear(self):
+        self._state.clear()
+        self._classes.clear()
+        self._seen = set()
@@ -4,11 +4,13 @@
 # It needs blank rows like `Factorio/Sandbox/`, `Factorio/Sandbox/Smelting/`, `Factorio/Sandbox/Smelting/Line2530/`, etc.
     
 from openpyxl import load_workbook
+import glob
 import json
 import os
 import toml
 import shutil
 from datetime import datetime
+from topic_registry import read_registry
 
 try:
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -17,7 +19,7 @@ try:
 except Exception as e:
     print(f"Error loading config.toml: {e}")
     exit(1)
-LOG_FILE = os.path.join(script_dir, config["paths"]["log_file"])
+REGISTRY_FILE = os.path.join(script_dir, config["paths"].get("registry_file", "topic_registry.jsonl"))
 
 class ExcelGenerator:
     def __init__(self, template_filename, output_filename):
@@ -152,12 +154,15 @@ def main():
     output_filename = f"output-{datetime.now().strftime('%Y%m%d%H%M')}.xlsx"
     excel_gen = ExcelGenerator(template_filename, output_filename)  # Initialize Excel generator
     try:
-        with open(LOG_FILE, "r") as log_file:
-            for row in log_file:
-                row = row.strip()  # Remove newline characters
-                if ': ' in row:
-                    topic, msg = row.split(': ', 1)  # Ensure only the first ': ' is split
-                    excel_gen.add_topic(topic, json.loads(msg))
+        # In sharded mode every publisher worker writes its own "<registry_file>.shard<N>"
+        # (and "<registry_file>.shard<N>.tmp" while compacting it, which is skipped)
+        shard_files = [path for path in glob.glob(REGISTRY_FILE + ".shard*")
+                       if path.rpartition(".shard")[2].isdigit()]
+        for registry_path in [REGISTRY_FILE] + sorted(shard_files):
+            if not os.path.exists(registry_path):
+                continue
+            for topic, payload in read_registry(registry_path):
+                excel_gen.add_topic(topic, payload)
         excel_gen.save_excel()        
     except Exception as e:
         print(f"Error: {e}")
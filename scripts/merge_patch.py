@@ -0,0 +1,178 @@
+#####################################################################
+# Field-level delta payloads (JSON Merge Patch, RFC 7386).          #
+#                                                                   #
+# In delta mode the publisher sends only the changed keys of a      #
+# subtopic as a merge patch on "<topic>/delta", and a full keyframe #
+# on "<topic>" every N cycles so late subscribers can resync.       #
+# Consumers rebuild the current document with apply_merge_patch.    #
+# Merge patches replace lists whole, so item stack lists are sent   #
+# as {name: {quality: count}} (see stacks_to_dict) in this mode.    #
+#####################################################################
+import zlib
+
+DELTA_SUFFIX = "/delta"   # merge patches of "<topic>" go to "<topic>/delta"
+_MISSING = object()
+
+
+class UnrepresentableChange(ValueError):
+    """The change sets a value to null, which a merge patch cannot express."""
+
+
+def merge_patch_diff(old, new):
+    """
+    Return the merge patch that turns 'old' into 'new'. Both must be dicts;
+    nested dicts are diffed recursively, anything else (lists included) is
+    replaced whole, and removed keys are set to None.
+    """
+    patch = {}
+    for key, value in new.items():
+        old_value = old.get(key, _MISSING)
+        if old_value == value:
+            continue
+        if isinstance(old_value, dict) and isinstance(value, dict):
+            patch[key] = merge_patch_diff(old_value, value)
+        elif value is None:
+            raise UnrepresentableChange(key)
+        else:
+            patch[key] = value
+    for key in old:
+        if key not in new:
+            patch[key] = None
+    return patch
+
+
+def _is_stack_list(value):
+    return bool(value) and all(isinstance(item, dict) and "name" in item and "count" in item
+                               for item in value)
+
+
+def stacks_to_dict(value):
+    """
+    'value' with every item stack list ([{"name", "quality", "count"}, ...],
+    as LuaInventory.get_contents() returns) turned into {name: {quality: count}},
+    at any depth of nested dicts, so a changed count diffs to one key:
+
+        [{"name": "iron-plate", "quality": "normal", "count": 5}]
+        -> {"iron-plate": {"normal": 5}}
+    """
+    if isinstance(value, dict):
+        converted = None
+        for key, item in value.items():
+            new_item = stacks_to_dict(item)
+            if new_item is not item:
+                if converted is None:
+                    converted = dict(value)   # only copied if something in it is converted
+                converted[key] = new_item
+        return value if converted is None else converted
+    if isinstance(value, list):
+        if not _is_stack_list(value):
+            return value
+        stacks = {}
+        for stack in value:
+            qualities = stacks.setdefault(stack["name"], {})
+            quality = stack.get("quality", "normal")
+            qualities[quality] = qualities.get(quality, 0) + stack["count"]
+        return stacks
+    return value
+
+
+def copy_value(value):
+    """
+    Deep copy of a JSON-like value (dicts, lists, scalars). Values kept to
+    diff against later must not share objects with the caller, who may
+    mutate them in place before the next cycle.
+    """
+    if isinstance(value, dict):
+        return {key: copy_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [copy_value(item) for item in value]
+    return value
+
+
+def apply_merge_patch(target, patch):
+    """Apply merge patch 'patch' to 'target' as RFC 7386 describes; returns the result."""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = apply_merge_patch(result.get(key), value)
+    return result
+
+
+class DeltaTracker:
+    """
+    Remembers the last value sent per topic and decides, for each new
+    value, whether to send nothing, a merge patch or a full keyframe.
+
+    Keyframes are due every 'keyframe_interval' cycles per topic, offset
+    by a hash of the topic so they don't all land on the same cycle, and
+    are only sent for topics that received patches since their last full
+    document.
+    """
+    def __init__(self, keyframe_interval=30):
+        self.keyframe_interval = max(1, keyframe_interval)
+        self._last = {}   # topic -> (copy of the value, keyframe offset, patched since last keyframe)
+        self._seen = set()
+        self._cycle = 0
+
+    def __contains__(self, topic):
+        return topic in self._last
+
+    def begin_cycle(self):
+        self._cycle += 1
+        self._seen = set()
+
+    def plan(self, topic, value):
+        """
+        Returns ("full", value), ("delta", patch) or (None, None) when
+        'value' is unchanged and no keyframe is due.
+        """
+        self._seen.add(topic)
+        entry = self._last.get(topic)
+        if entry is None:
+            offset = zlib.crc32(topic.encode()) % self.keyframe_interval
+        else:
+            old, offset, patched = entry
+            keyframe_due = (self._cycle + offset) % self.keyframe_interval == 0
+            if old == value:
+                # Only topics that moved on by patches need a resync keyframe
+                if not (keyframe_due and patched):
+                    return None, None
+            elif not keyframe_due and isinstance(old, dict) and isinstance(value, dict):
+                try:
+                    patch = merge_patch_diff(old, value)
+                except UnrepresentableChange:
+                    patch = None
+                if patch is not None:
+                    self._last[topic] = (copy_value(value), offset, True)
+                    return "delta", patch
+        self._last[topic] = (copy_value(value), offset, False)
+        return "full", value
+
+    def touch(self, topic):
+        """Keep 'topic' for this cycle without planning a value for it."""
+        if topic in self._last:
+            self._seen.add(topic)
+
+    def discard(self, topic):
+        """Forget 'topic': its next plan() is a full document."""
+        self._last.pop(topic, None)
+
+    def patch_rejected(self, topic):
+        """The last planned patch was sent as a full document after all."""
+        value, offset, _ = self._last[topic]
+        self._last[topic] = (value, offset, False)
+
+    def sweep(self):
+        """Forget topics not planned since begin_cycle(). Returns the count."""
+        stale = [topic for topic in self._last if topic not in self._seen]
+        for topic in stale:
+            del self._last[topic]
+        return len(stale)
+
+    def clear(self):
+        self._last.clear()
+        self._seen = set()
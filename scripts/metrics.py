@@ -0,0 +1,182 @@
+#####################################################################
+# Self-instrumentation for publisher.py ([metrics] in config.toml). #
+#                                                                   #
+# Per-cycle time spent in each stage (read, parse, group, encode,   #
+# publish, whole cycle) goes into fixed-bucket histograms; messages #
+# and bytes sent, payloads suppressed as unchanged and the client   #
+# queue depths are counted alongside. A report is published every   #
+# 'interval' seconds as JSON on <topic_prefix>/$SYS/publisher and   #
+# optionally written as a Prometheus textfile. When [metrics] is    #
+# off none of this is installed and the publisher pays nothing.     #
+#####################################################################
+import json
+import os
+import time
+
+STAGES = ("read", "parse", "group", "encode", "publish", "cycle")
+# Histogram upper bounds in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = 0
+        for bound in self.bounds:
+            if value <= bound:
+                break
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """[(upper bound, observations <= bound)], ending with ("+Inf", count)."""
+        total, result = 0, []
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class PublisherMetrics:
+    """
+    Stage timers and counters. Time is accumulated per stage during a
+    cycle and observed into that stage's histogram by end_cycle().
+
+        encode = metrics.timed("encode", encode)     # wrap a hot function
+        metrics.add("read", seconds)                 # or add time directly
+        metrics.end_cycle(cycle_seconds)
+    """
+    def __init__(self):
+        self.histograms = {stage: Histogram() for stage in STAGES}
+        self._current = dict.fromkeys(STAGES, 0.0)
+        self.cycles = 0
+        self.messages = 0
+        self.unchanged = 0      # payloads suppressed by change detection (set by the publisher)
+        self.bytes_out = 0
+        self.started = time.time()
+
+    def add(self, stage, seconds):
+        self._current[stage] += seconds
+
+    def timed(self, stage, func):
+        current, clock = self._current, time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                current[stage] += clock() - start
+        return wrapper
+
+    def timed_iter(self, stage, iterable):
+        """Yield from 'iterable', charging the time spent producing each item to 'stage'."""
+        current, clock = self._current, time.perf_counter
+        iterator = iter(iterable)
+        while True:
+            start = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                current[stage] += clock() - start
+                return
+            current[stage] += clock() - start
+            yield item
+
+    def end_cycle(self, seconds):
+        self._current["cycle"] = seconds
+        for stage, spent in self._current.items():
+            self.histograms[stage].observe(spent)
+            self._current[stage] = 0.0
+        self.cycles += 1
+
+    def as_dict(self, gauges=None):
+        return {
+            "uptime": round(time.time() - self.started, 1),
+            "cycles": self.cycles,
+            "messages": self.messages,
+            "unchanged": self.unchanged,
+            "bytes_out": self.bytes_out,
+            **(gauges or {}),
+            "stages": {
+                stage: {
+                    "count": h.count,
+                    "sum": round(h.sum, 6),
+                    "buckets": {str(bound): count for bound, count in h.cumulative()},
+                }
+                for stage, h in self.histograms.items()
+            },
+        }
+
+    def prometheus(self, gauges=None):
+        """Prometheus text exposition of the same data."""
+        lines = [
+            "# TYPE factorio_publisher_cycles_total counter",
+            f"factorio_publisher_cycles_total {self.cycles}",
+            "# TYPE factorio_publisher_messages_total counter",
+            f"factorio_publisher_messages_total {self.messages}",
+            "# TYPE factorio_publisher_unchanged_total counter",
+            f"factorio_publisher_unchanged_total {self.unchanged}",
+            "# TYPE factorio_publisher_bytes_out_total counter",
+            f"factorio_publisher_bytes_out_total {self.bytes_out}",
+        ]
+        for name, value in (gauges or {}).items():
+            lines.append(f"# TYPE factorio_publisher_{name} gauge")
+            lines.append(f"factorio_publisher_{name} {value}")
+        lines.append("# TYPE factorio_publisher_stage_seconds histogram")
+        for stage, h in self.histograms.items():
+            for bound, count in h.cumulative():
+                lines.append(f'factorio_publisher_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'factorio_publisher_stage_seconds_sum{{stage="{stage}"}} {h.sum}')
+            lines.append(f'factorio_publisher_stage_seconds_count{{stage="{stage}"}} {h.count}')
+        return "\n".join(lines) + "\n"
+
+
+class MetricsClient:
+    """Counts messages, bytes and publish time of a client; everything else is delegated."""
+    def __init__(self, client, metrics):
+        self._client = client
+        self._metrics = metrics
+        self._publish = metrics.timed("publish", client.publish)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        metrics = self._metrics
+        metrics.messages += 1
+        if isinstance(payload, str):
+            metrics.bytes_out += len(payload.encode("utf-8"))
+        elif payload is not None:
+            metrics.bytes_out += len(payload)
+        return self._publish(topic, payload, qos, retain, properties)
+
+
+class MetricsReporter:
+    """Publishes / writes a metrics report every 'interval' seconds."""
+    def __init__(self, metrics, topic, interval=10.0, textfile=None):
+        self.metrics = metrics
+        self.topic = topic
+        self.interval = interval
+        self.textfile = textfile
+        self._last = time.monotonic()
+
+    def report_if_due(self, client, gauges=None):
+        now = time.monotonic()
+        if now - self._last < self.interval:
+            return
+        self._last = now
+        gauges = gauges() if callable(gauges) else gauges
+        client.publish(self.topic, json.dumps(self.metrics.as_dict(gauges)))
+        if self.textfile:
+            tmp_path = f"{self.textfile}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.metrics.prometheus(gauges))
+            os.replace(tmp_path, self.textfile)
@@ -0,0 +1,362 @@
+#####################################################################
+# Disk-backed store-and-forward buffer for publisher.py.            #
+#                                                                   #
+# While the broker is unreachable, publishes are appended to        #
+# segment files in an outbox directory (bounded in total size).     #
+# Once the client reconnects they are drained in order at a         #
+# controlled rate, and new publishes queue behind them until the    #
+# backlog is gone. Segments survive a publisher restart. Every      #
+# record keeps the QoS, retain flag and MQTT v5 properties it was   #
+# published with.                                                   #
+#                                                                   #
+# Drop policies when the outbox is full:                            #
+#   oldest - delete the oldest segment                              #
+#   latest - keep only the latest payload per topic (merge patches  #
+#            on '<topic>/delta' after it are all kept), then delete #
+#            the oldest segments down to half of the limit          #
+#####################################################################
+import os
+import struct
+import threading
+import time
+
+from paho.mqtt import client as mqtt_client
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from merge_patch import DELTA_SUFFIX
+
+DROP_POLICIES = ("oldest", "latest")
+# flags (qos | retain << 2), topic length, packed properties length (0: none), payload length
+_RECORD = struct.Struct(">BHHI")
+_RETAIN = 4
+SEGMENT_SUFFIX = ".rec"
+CURSOR_FILE = "cursor"   # "<first segment name> <read offset>", so sent records are not resent after a restart
+
+
+def _encode_record(topic, payload, qos=0, retain=False, properties=None):
+    topic_bytes = topic.encode("utf-8")
+    props = properties.pack() if properties is not None else b""
+    flags = qos | (_RETAIN if retain else 0)
+    return _RECORD.pack(flags, len(topic_bytes), len(props), len(payload)) + topic_bytes + props + payload
+
+
+def _decode_properties(data):
+    if not data:
+        return None
+    properties = Properties(PacketTypes.PUBLISH)
+    properties.unpack(data)
+    return properties
+
+
+class Outbox:
+    """
+    FIFO of (topic, payload bytes, qos, retain, properties) records in
+    size-bounded segment files.
+
+        outbox.put(topic, payload, qos, retain, properties)
+        records = outbox.peek(100)     # oldest first, not yet removed
+        outbox.consume(len(records))   # once they were handed to the broker
+    """
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, segment_bytes=4 * 1024 * 1024,
+                 drop_policy="oldest", on_dropped=None):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"drop_policy must be one of {', '.join(DROP_POLICIES)}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.drop_policy = drop_policy
+        # Called with the topic of every record deleted unsent ('<topic>' for '<topic>/delta'),
+        # e.g. so the publisher sends its next value as a full document
+        self.on_dropped = on_dropped
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._writer = None
+        self._generation = 0      # bumped whenever segments are rewritten under a peek
+        self._peeked = []         # (segment index, end offset) per record returned by peek()
+        self._peek_generation = -1
+        # Pick up segments left over from a previous run
+        self._segments = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.startswith("seg-") and name.endswith(SEGMENT_SUFFIX))
+        self._sizes = {path: os.path.getsize(path) for path in self._segments}
+        self._read_offset = self._load_cursor()     # into self._segments[0]
+        self._total = sum(self._sizes.values())
+        self._next_id = 1 + max((int(os.path.basename(p)[4:-len(SEGMENT_SUFFIX)]) for p in self._segments),
+                                default=0)
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE), "r", encoding="utf-8") as f:
+                name, offset = f.read().split()
+        except (OSError, ValueError):
+            return 0
+        if self._segments and os.path.basename(self._segments[0]) == name:
+            return min(int(offset), self._sizes[self._segments[0]])
+        return 0   # that segment was fully sent and deleted
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            f.write(f"{os.path.basename(self._segments[0])} {self._read_offset}")
+        os.replace(f"{path}.tmp", path)
+
+    def pending(self):
+        return self.pending_bytes() > 0
+
+    def pending_bytes(self):
+        """Bytes of records on disk not yet delivered."""
+        with self._lock:
+            return self._total - self._read_offset
+
+    # -- writing ------------------------------------------------------------
+    def _roll(self):
+        if self._writer is not None:
+            self._writer.close()
+        path = os.path.join(self.directory, f"seg-{self._next_id:012d}{SEGMENT_SUFFIX}")
+        self._next_id += 1
+        self._writer = open(path, "ab")
+        self._segments.append(path)
+        self._sizes[path] = 0
+
+    def put(self, topic, payload, qos=0, retain=False, properties=None):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        elif payload is None:
+            payload = b""
+        record = _encode_record(topic, payload, qos, retain, properties)
+        with self._lock:
+            if self._writer is None or self._sizes[self._segments[-1]] >= self.segment_bytes:
+                self._roll()
+            self._writer.write(record)
+            self._writer.flush()
+            self._sizes[self._segments[-1]] += len(record)
+            self._total += len(record)
+            if self._total > self.max_bytes:
+                self._enforce_limit()
+
+    def _enforce_limit(self):
+        limit = self.max_bytes
+        if self.drop_policy == "latest":
+            self._compact()
+            # A low-water mark, so the next compaction is half an outbox of publishes away
+            limit //= 2
+        while self._total > limit and len(self._segments) > 1:
+            self._drop_oldest()
+
+    def _drop_oldest(self):
+        path = self._segments.pop(0)
+        size = self._sizes.pop(path)
+        topics = [message[0] for message in self._iter_records(path, self._read_offset)]
+        self.dropped += len(topics)
+        if self.on_dropped is not None:
+            for topic in set(topics):
+                self.on_dropped(topic[:-len(DELTA_SUFFIX)] if topic.endswith(DELTA_SUFFIX) else topic)
+        self._total -= size
+        self._read_offset = 0
+        self._generation += 1
+        os.remove(path)
+
+    def clear(self):
+        """Drop every unsent record."""
+        with self._lock:
+            self.dropped += sum(
+                sum(1 for _ in self._iter_records(path, self._read_offset if index == 0 else 0))
+                for index, path in enumerate(self._segments))
+            self._discard_segments()
+
+    def _discard_segments(self):
+        for path in self._segments:
+            os.remove(path)
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._segments, self._sizes, self._total, self._read_offset = [], {}, 0, 0
+        self._generation += 1
+
+    def compact(self):
+        """
+        Keep only the latest unsent payload per topic. Merge patches build on
+        each other: every patch written after the latest full payload of its
+        topic (or all of them, if none is buffered) is kept, in order.
+        """
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        latest = {}   # topic -> [full payload, patches after it...] or [patches...]
+        count = kept = 0
+        for index, path in enumerate(self._segments):
+            for message in self._iter_records(path, self._read_offset if index == 0 else 0):
+                topic = message[0]
+                count += 1
+                if topic.endswith(DELTA_SUFFIX):
+                    chain = latest.pop(topic[:-len(DELTA_SUFFIX)], [])
+                    chain.append(message[:-1])
+                    kept += 1
+                else:
+                    chain = latest.pop(topic, None)
+                    kept += 1 - len(chain or ())
+                    chain = [message[:-1]]
+                # re-insert so order follows the latest write
+                latest[topic[:-len(DELTA_SUFFIX)] if topic.endswith(DELTA_SUFFIX) else topic] = chain
+        self.dropped += count - kept
+        self._discard_segments()
+        for message in (message for chain in latest.values() for message in chain):
+            record = _encode_record(*message)
+            if self._writer is None or self._sizes[self._segments[-1]] >= self.segment_bytes:
+                self._roll()
+            self._writer.write(record)
+            self._sizes[self._segments[-1]] += len(record)
+            self._total += len(record)
+        if self._writer is not None:
+            self._writer.flush()
+
+    # -- reading ------------------------------------------------------------
+    @staticmethod
+    def _iter_records(path, offset):
+        """Yield (topic, payload, qos, retain, properties, end offset) from 'offset' to the end of a segment."""
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while True:
+                header = f.read(_RECORD.size)
+                if len(header) < _RECORD.size:
+                    return
+                flags, topic_len, props_len, payload_len = _RECORD.unpack(header)
+                body = f.read(topic_len + props_len + payload_len)
+                if len(body) < topic_len + props_len + payload_len:
+                    return   # torn tail of a segment from a crash
+                topic = body[:topic_len].decode("utf-8")
+                properties = _decode_properties(body[topic_len:topic_len + props_len])
+                offset += _RECORD.size + len(body)
+                yield topic, body[topic_len + props_len:], flags & 3, bool(flags & _RETAIN), properties, offset
+
+    def peek(self, limit):
+        """
+        Return up to 'limit' of the oldest records as (topic, payload, qos,
+        retain, properties) without removing them.
+        """
+        with self._lock:
+            if self._writer is not None:
+                self._writer.flush()
+            records, self._peeked = [], []
+            for index, path in enumerate(self._segments):
+                offset = self._read_offset if index == 0 else 0
+                for *message, end in self._iter_records(path, offset):
+                    records.append(tuple(message))
+                    self._peeked.append((index, end))
+                    if len(records) >= limit:
+                        break
+                if len(records) >= limit:
+                    break
+            if not records and self._segments:
+                # Only unreadable (torn) bytes left: discard them so we stop trying
+                self._discard_segments()
+            self._peek_generation = self._generation
+            return records
+
+    def consume(self, count):
+        """Remove the first 'count' records returned by the last peek()."""
+        with self._lock:
+            if count <= 0 or self._generation != self._peek_generation:
+                return   # segments were rewritten meanwhile: records will be sent again
+            index, end = self._peeked[count - 1]
+            for _ in range(index):
+                path = self._segments.pop(0)
+                self._total -= self._sizes.pop(path)
+                os.remove(path)
+            self._read_offset = end
+            path = self._segments[0]
+            if end >= self._sizes[path]:
+                # Fully sent segment: delete it (and start a new one if it was the live one)
+                if path == self._segments[-1] and self._writer is not None:
+                    self._writer.close()
+                    self._writer = None
+                self._segments.pop(0)
+                self._total -= self._sizes.pop(path)
+                self._read_offset = 0
+                os.remove(path)
+            else:
+                self._save_cursor()
+            self._peeked = []
+            self._generation += 1
+
+
+class BufferedClient:
+    """
+    Wraps a paho client: publishes go straight to the broker while it is
+    connected and the outbox is empty, and into the outbox otherwise. A
+    background thread drains the outbox at 'drain_rate' messages/second
+    after (re)connecting. Everything else is delegated to the paho client.
+
+    'discard_on_connect' drops the backlog on (re)connecting instead, for
+    Sparkplug B: the births that follow every connect restate the whole
+    state, and DATA buffered under the previous session's births and seq
+    numbers must not reach the broker after them.
+    """
+    def __init__(self, client, outbox, drain_rate=1000, discard_on_connect=False):
+        self._client = client
+        self.outbox = outbox
+        self.drain_rate = drain_rate
+        self.discard_on_connect = discard_on_connect
+        self.connected = False
+        self._wake = threading.Event()
+        self._user_on_connect = client.on_connect
+        self._user_on_disconnect = client.on_disconnect
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        threading.Thread(target=self._drain_loop, name="outbox-drain", daemon=True).start()
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _on_connect(self, client, userdata, flags, reason_code, *args):
+        if reason_code == 0 and self.discard_on_connect and self.outbox.pending():
+            # Before the user callback, which schedules the births
+            self.outbox.clear()
+            print("Outbox discarded on connect, births follow")
+        self.connected = reason_code == 0
+        if self._user_on_connect:
+            self._user_on_connect(client, userdata, flags, reason_code, *args)
+        if self.connected:
+            if self.outbox.drop_policy == "latest" and not self.discard_on_connect:
+                self.outbox.compact()
+            self._wake.set()
+
+    def _on_disconnect(self, client, userdata, *args):
+        self.connected = False
+        print("Disconnected from MQTT broker, buffering to outbox")
+        if self._user_on_disconnect:
+            self._user_on_disconnect(client, userdata, *args)
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        # Keep ordering: while a backlog exists, new messages queue behind it
+        if self.connected and not self.outbox.pending():
+            info = self._client.publish(topic, payload, qos, retain, properties)
+            if info.rc == mqtt_client.MQTT_ERR_SUCCESS:
+                return info
+        self.outbox.put(topic, payload, qos, retain, properties)
+        self._wake.set()
+        return None
+
+    def _drain_loop(self):
+        interval = 0.1
+        while True:
+            self._wake.wait(timeout=1.0)
+            if not (self.connected and self.outbox.pending()):
+                self._wake.clear()
+                continue
+            start = time.monotonic()
+            records = self.outbox.peek(max(1, int(self.drain_rate * interval)))
+            sent = 0
+            for record in records:
+                if not self.connected:
+                    break
+                if self._client.publish(*record).rc != mqtt_client.MQTT_ERR_SUCCESS:
+                    break
+                sent += 1
+            self.outbox.consume(sent)
+            if not self.outbox.pending():
+                print("Outbox drained")
+            time.sleep(max(0.0, interval - (time.monotonic() - start)))
@@ -0,0 +1,47 @@
+#####################################################################
+# Payload encodings for publisher.py topics.                        #
+#                                                                   #
+# "json" (default) sends text, "msgpack" and "cbor" send compact    #
+# binary documents with the same structure. Consumers use           #
+# decode_payload(msg.payload, format) to get the Python value back. #
+#                                                                   #
+# msgpack / cbor need their packages (pip install msgpack cbor2);   #
+# they are only imported when selected.                             #
+#####################################################################
+import json
+
+PAYLOAD_FORMATS = ("json", "msgpack", "cbor")
+
+
+def _codec(payload_format):
+    if payload_format == "json":
+        return json.dumps, _json_loads
+    if payload_format == "msgpack":
+        import msgpack
+        return (lambda value: msgpack.packb(value, use_bin_type=True),
+                lambda data: msgpack.unpackb(data, raw=False))
+    if payload_format == "cbor":
+        import cbor2
+        return cbor2.dumps, cbor2.loads
+    raise ValueError(f"payload_format must be one of {', '.join(PAYLOAD_FORMATS)}")
+
+
+def _json_loads(data):
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode("utf-8")
+    return json.loads(data)
+
+
+def get_encoder(payload_format="json"):
+    """Return the value -> payload (str for json, bytes otherwise) function for 'payload_format'."""
+    return _codec(payload_format)[0]
+
+
+def get_decoder(payload_format="json"):
+    """Return the payload -> value function for 'payload_format'."""
+    return _codec(payload_format)[1]
+
+
+def decode_payload(data, payload_format="json"):
+    """Decode a received payload (str or bytes) published in 'payload_format'."""
+    return get_decoder(payload_format)(data)
@@ -17,8 +17,23 @@
 import time
 import os
 import json
+import functools
 import toml
 from paho.mqtt import client as mqtt_client
+from change_cache import ChangeCache
+from merge_patch import DELTA_SUFFIX, DeltaTracker, stacks_to_dict
+from deadband import DROP, HEARTBEAT, DeadbandFilter
+from topic_plan import TopicPlan, TopicPlanCache
+from topic_alias import TopicAliasClient
+from topic_registry import TopicRegistry
+from payload_codec import get_encoder
+from outbox import BufferedClient, Outbox
+from metrics import MetricsClient, MetricsReporter, PublisherMetrics
+from scheduler import PRIORITIES, PriorityScheduler
+from snapshot_reader import DeltaLogReader, SlotReader, SnapshotGate, SnapshotStream, TruncatedSnapshotError
+from snapshot_watch import LatencyStats, open_watcher
+from sharding import ShardPool
+from sparkplug import SparkplugNode
 
 try:
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -30,44 +45,204 @@ except Exception as e:
 
 # Get values from config.toml
 FACTORY_STATE_FILE = os.path.expanduser(config['paths']['factory_state_file'])
+# The mod's slot manifest (snapshot_format = "slots") and delta log (snapshot_format = "delta"),
+# next to factory_state.json unless configured
+FACTORY_STATE_MANIFEST = os.path.expanduser(config['paths'].get(
+    'factory_state_manifest', os.path.join(os.path.dirname(FACTORY_STATE_FILE), 'factory_state.manifest.json')))
+FACTORY_STATE_LOG = os.path.expanduser(config['paths'].get(
+    'factory_state_log', os.path.join(os.path.dirname(FACTORY_STATE_FILE), 'factory_state_log.jsonl')))
 BROKER = config['mqtt']['broker']
 PORT = config['mqtt']['port']
 TOPIC_PREFIX = config['mqtt']['topic_prefix']
 ADMIN = config['mqtt']['username']
 PASSWORD = config['mqtt']['password']
-LOG_FILE = os.path.join(script_dir, config['paths']['log_file'])
+MQTT_PROTOCOL = str(config['mqtt'].get('protocol', '3.1.1'))
+TOPIC_ALIASES = config['mqtt'].get('topic_aliases', True)
+TOPIC_ALIAS_MAXIMUM = config['mqtt'].get('topic_alias_maximum', 0)
+MAX_INFLIGHT_MESSAGES = config['mqtt'].get('max_inflight_messages', 20)
+MAX_QUEUED_MESSAGES = config['mqtt'].get('max_queued_messages', 0)
+REGISTRY_FILE = os.path.join(script_dir, config['paths'].get('registry_file', 'topic_registry.jsonl'))
+REGISTRY_FLUSH_INTERVAL = config['paths'].get('registry_flush_interval', 60)
+OUTBOX = config.get('outbox', {})
+OUTBOX_ENABLED = OUTBOX.get('enabled', False)
+OUTBOX_DIR = os.path.join(script_dir, OUTBOX.get('directory', 'outbox'))
+METRICS = config.get('metrics', {})
+METRICS_ENABLED = METRICS.get('enabled', False)
+SCHEDULER = config.get('scheduler', {})
+SCHEDULER_ENABLED = SCHEDULER.get('enabled', False)
+PUBLISHER = config.get('publisher', {})
+STREAMING = PUBLISHER.get('streaming', True)
+STREAM_CHUNK_SIZE = PUBLISHER.get('stream_chunk_size', 65536)
+CACHE_MAX_TOPICS = PUBLISHER.get('cache_max_topics', 0)
+PUBLISH_MODE = PUBLISHER.get('publish_mode', 'field')
+WATCH_BACKEND = PUBLISHER.get('watch_backend', 'auto')
+POLL_INTERVAL = PUBLISHER.get('poll_interval', 0.25)
+WATCH_DEBOUNCE = PUBLISHER.get('watch_debounce', 0.005)
+SHARDS = PUBLISHER.get('shards', 0)
+DELTA_MODE = PUBLISHER.get('delta', False)
+DELTA_KEYFRAME_INTERVAL = PUBLISHER.get('delta_keyframe_interval', 30)
+TORN_RETRIES = PUBLISHER.get('torn_retries', 5)
+TORN_BACKOFF = PUBLISHER.get('torn_backoff', 0.02)
+COLUMNAR = PUBLISHER.get('columnar', False)
+PAYLOAD_FORMAT = PUBLISHER.get('payload_format', 'json')
+SNAPSHOT_FORMAT = PUBLISHER.get('snapshot_format', 'slots')
+
+MQTT_PROTOCOLS = {"3.1.1": mqtt_client.MQTTv311, "5": mqtt_client.MQTTv5}
+if MQTT_PROTOCOL not in MQTT_PROTOCOLS:
+    print(f"Error in config.toml: [mqtt] protocol must be one of {', '.join(MQTT_PROTOCOLS)}")
+    exit(1)
+
+# field: one message per subtopic, asset: one document per asset, line: one document per line_id,
+# sparkplug: Sparkplug B births and alias-based DATA messages, one device per line_id
+PUBLISH_MODES = ("field", "asset", "line", "sparkplug")
+if SNAPSHOT_FORMAT not in ("slots", "full", "delta"):
+    print('Error in config.toml: snapshot_format must be "slots", "full" or "delta"')
+    exit(1)
+
+if PUBLISH_MODE not in PUBLISH_MODES:
+    print(f"Error in config.toml: publish_mode must be one of {', '.join(PUBLISH_MODES)}")
+    exit(1)
+
+# Edge node state of the sparkplug mode (None in the other modes)
+SPARKPLUG = config.get('sparkplug', {})
+sparkplug_node = None
+if PUBLISH_MODE == "sparkplug":
+    if SHARDS > 1:
+        print("Error in config.toml: publish_mode = \"sparkplug\" is one edge node and cannot be sharded")
+        exit(1)
+    if SCHEDULER_ENABLED:
+        # The scheduler coalesces queued messages per topic: DDATA seq numbers would be lost
+        # and a queued DDATA could overtake the DBIRTH of a later rebirth
+        print("Error in config.toml: publish_mode = \"sparkplug\" cannot be used with [scheduler] enabled")
+        exit(1)
+    sparkplug_node = SparkplugNode(SPARKPLUG.get('group_id', 'Factorio'),
+                                   SPARKPLUG.get('edge_node_id', 'Publisher'),
+                                   SPARKPLUG.get('qos', 0))
 
-# Keep track of last published values for each subtopic, so we only publish if changed
-last_published = {}
+# value -> payload for every topic: JSON text, or MessagePack/CBOR bytes
+try:
+    encode_payload = get_encoder(PAYLOAD_FORMAT)
+except ImportError as e:
+    print(f"Error: payload_format = \"{PAYLOAD_FORMAT}\" needs its package ({e.name}): pip install {e.name}")
+    exit(1)
+except ValueError as e:
+    print(f"Error in config.toml: {e}")
+    exit(1)
 
-def publish_if_changed(client, subtopic, new_payload,log_file):
+# Per topic class deadband / interval rules ([deadband.<class>]), None when there are none
+try:
+    deadband = DeadbandFilter.from_config(config['deadband']) if config.get('deadband') else None
+except (TypeError, ValueError) as e:
+    print(f"Error in config.toml [deadband]: {e}")
+    exit(1)
+
+# Stage timers and counters, None unless [metrics] is enabled (see instrument())
+metrics = None
+
+# Keep track of a digest of the last published value for each subtopic, so we only publish if changed
+last_published = ChangeCache(CACHE_MAX_TOPICS)
+# In delta mode: the last value sent per subtopic, to build merge patches from
+delta_tracker = DeltaTracker(DELTA_KEYFRAME_INTERVAL)
+def begin_publish_cycle():
+    last_published.begin_cycle()
+    delta_tracker.begin_cycle()
+    topic_plans.begin_cycle()
+    if deadband is not None:
+        deadband.begin_cycle()
+    if sparkplug_node is not None:
+        sparkplug_node.begin_cycle()
+
+def touch_topic(subtopic):
+    """'subtopic' is known to be unchanged this cycle: keep its state without re-encoding it."""
+    last_published.touch(subtopic)
+    delta_tracker.touch(subtopic)
+    if deadband is not None:
+        deadband.touch(subtopic)
+
+def end_publish_cycle():
+    """Forget the state of topics and assets that were not part of the (fully read) snapshot."""
+    last_published.sweep()
+    delta_tracker.sweep()
+    topic_plans.sweep()
+    if deadband is not None:
+        deadband.sweep()
+
+def topic_published(subtopic):
+    """True if 'subtopic' has a last sent value on record (in delta mode: a planned document)."""
+    return subtopic in (delta_tracker if DELTA_MODE else last_published)
+
+def sweep_registry(registry):
+    """
+    Drop registry topics whose change-detection state end_publish_cycle() swept
+    (with cache_max_topics, an evicted topic is back once it is published again).
+    """
+    registry.sweep(topic_published)
+
+def publish_if_changed(client, subtopic, new_payload, registry):
     """
     Publish 'new_payload' to 'subtopic' only if 'new_payload' differs 
     from the last published payload for this subtopic.
     """
-    old_payload = last_published.get(subtopic)
-    if old_payload != new_payload:
+    if last_published.update(subtopic, new_payload):
         client.publish(subtopic, new_payload)
-        last_published[subtopic] = new_payload
-        log_file.write(f"{subtopic}: {new_payload}\n")
+        registry.record(subtopic, new_payload)
 
-def publish_no_matter(client, subtopic, payload,log_file):
+def publish_no_matter(client, subtopic, payload, registry):
     """
     Publish 'payload' to 'subtopic' unconditionally.
     """
     client.publish(subtopic, payload)
-    log_file.write(f"{subtopic}: {payload}\n")
+    registry.record(subtopic, payload)
 
-def publish_json(client, subtopic, value,log_file):
+def publish_json(client, subtopic, value, registry):
     """
-    Convert 'value' to a valid JSON string via json.dumps(...),
-    then publish if changed.
+    Encode 'value' with encode_payload (a JSON string via json.dumps(...)
+    unless payload_format says otherwise), then publish if changed.
+    Deadband rules are applied to the raw value first.
     """
-    # always a valid JSON representation
-    payload = json.dumps(value) 
+    if deadband is not None:
+        verdict = deadband.check(subtopic, value)
+        if verdict == DROP:
+            touch_topic(subtopic)
+            return
+        if verdict == HEARTBEAT:
+            if DELTA_MODE:
+                delta_tracker.discard(subtopic)   # heartbeats are full documents
+                publish_delta(client, subtopic, value, registry)
+                return
+            payload = encode_payload(value)
+            last_published.update(subtopic, payload)
+            publish_no_matter(client, subtopic, payload, registry)
+            return
+    # encode_payload gives JSON text, or msgpack/CBOR bytes with payload_format set
+    if DELTA_MODE:
+        publish_delta(client, subtopic, value, registry)
+        return
+    payload = encode_payload(value) 
     #publish_if_changed is mainly used unless u want to test, then you can use publish_no_matter
-    publish_if_changed(client, subtopic, payload,log_file) 
-    # publish_no_matter(client, subtopic, payload,log_file)
+    publish_if_changed(client, subtopic, payload, registry) 
+    # publish_no_matter(client, subtopic, payload, registry)
+
+def publish_delta(client, subtopic, value, registry):
+    """
+    Delta mode: publish only the changed keys of 'value' as a JSON merge
+    patch on '<subtopic>/delta', or the full document on 'subtopic' when a
+    keyframe is due or a patch would not be smaller. Item stack lists are
+    published as {name: {quality: count}} so they diff per item.
+    """
+    value = stacks_to_dict(value)
+    kind, data = delta_tracker.plan(subtopic, value)
+    if kind is None:
+        return
+    payload = encode_payload(value)
+    if kind == "delta":
+        patch_payload = encode_payload(data)
+        if len(patch_payload) < len(payload):
+            # Patches are not logged: the full topic already describes the data model
+            client.publish(subtopic + DELTA_SUFFIX, patch_payload)
+            return
+        delta_tracker.patch_rejected(subtopic)
+    publish_no_matter(client, subtopic, payload, registry)
 
 # 1) Category map
 TYPE_TO_CATEGORY = {
@@ -133,26 +308,100 @@ def decode_dominant_flag(status_int):
             return label
     return "none"
 
+# Every status bit is below 2048, so decode each 11-bit mask once up front:
+# mask -> (dominant label, all flags joined with ', ')
+STATUS_MASK = 2047
+STATUS_TEXT = [(decode_dominant_flag(mask), ', '.join(decode_all_flags(mask)))
+               for mask in range(STATUS_MASK + 1)]
+
+def decode_status(status_int):
+    if isinstance(status_int, int):
+        return STATUS_TEXT[status_int & STATUS_MASK]
+    return decode_dominant_flag(status_int), ', '.join(decode_all_flags(status_int))
+
+# Optional columnar ingest: vectorized status decode and change detection (needs numpy)
+columnar_index = None
+if COLUMNAR:
+    if PUBLISH_MODE != "field":
+        print("Warning: [publisher] columnar only applies to publish_mode = \"field\", ignoring it")
+    else:
+        try:
+            from columnar import ColumnarIndex
+        except ImportError:
+            print("Error: [publisher] columnar = true needs numpy (pip install numpy)")
+            exit(1)
+        columnar_index = ColumnarIndex(decode_dominant_flag, decode_all_flags)
+
 def on_connect(client, userdata, flags, reason_code, properties=None):
     if reason_code == 0:
         print("Connected to MQTT Broker successfully!")
     else:
         print(f"Failed to connect, return code {reason_code}")
 
-def connect_mqtt():
-    client = mqtt_client.Client()
+def schedule(client):
+    """With [scheduler] enabled, rate limit and prioritise the client's publishes."""
+    if not SCHEDULER_ENABLED:
+        return client
+    try:
+        return PriorityScheduler(
+            client,
+            {priority: SCHEDULER.get(priority, 0) for priority in PRIORITIES},
+            priorities=SCHEDULER.get('priorities'),
+            default_priority=SCHEDULER.get('default_priority', 'medium'),
+            max_queued_patches=SCHEDULER.get('max_queued_patches', 10000),
+            # Dropped patches leave the topic's subscribers behind: send it in full next time
+            on_patches_dropped=delta_tracker.discard,
+            # cache as many topic priorities as the change cache keeps topics
+            max_cached_topics=CACHE_MAX_TOPICS or 10000,
+        )
+    except ValueError as e:
+        print(f"Error in config.toml [scheduler]: {e}")
+        exit(1)
+
+def connect_mqtt(name="main"):
+    """
+    Connect to the broker. With [outbox] enabled the connection is made in
+    the background and retried forever; meanwhile publishes are buffered on
+    disk under '<outbox directory>/<name>' and drained after connecting.
+    With [scheduler] enabled publishes are prioritised by topic section.
+    With protocol = "5" the most published topics get MQTT v5 topic aliases.
+    """
+    client = mqtt_client.Client(protocol=MQTT_PROTOCOLS[MQTT_PROTOCOL])
     try:
         if ADMIN and PASSWORD:
             client.username_pw_set(ADMIN, PASSWORD)
         client.on_connect = on_connect
+        client.max_inflight_messages_set(MAX_INFLIGHT_MESSAGES)
+        client.max_queued_messages_set(MAX_QUEUED_MESSAGES)
+        if sparkplug_node is not None:
+            # NDEATH will, NCMD rebirth requests and rebirth after every connect
+            sparkplug_node.attach(client)
+        if MQTT_PROTOCOL == "5" and TOPIC_ALIASES:
+            # Below the outbox: buffered messages are stored with their full topic
+            client = TopicAliasClient(client, TOPIC_ALIAS_MAXIMUM)
+        if OUTBOX_ENABLED:
+            outbox = Outbox(
+                os.path.join(OUTBOX_DIR, name),
+                max_bytes=OUTBOX.get('max_megabytes', 256) * 1024 * 1024,
+                segment_bytes=OUTBOX.get('segment_megabytes', 4) * 1024 * 1024,
+                drop_policy=OUTBOX.get('drop_policy', 'oldest'),
+                # A dropped value or patch leaves subscribers behind: send the topic in full next time
+                on_dropped=delta_tracker.discard,
+            )
+            client.reconnect_delay_set(min_delay=1, max_delay=30)
+            client.connect_async(BROKER, PORT, keepalive=60)
+            print("Connecting to MQTT broker...")
+            # Sparkplug: the births after every connect supersede whatever was buffered
+            return schedule(BufferedClient(client, outbox, OUTBOX.get('drain_rate', 1000),
+                                           discard_on_connect=sparkplug_node is not None))
         client.connect(BROKER, PORT, keepalive=60)
         print("Connecting to MQTT broker...")
-        return client
+        return schedule(client)
     except Exception as e:
         print(f"Error connecting to MQTT broker: {e}")
         exit(1)
 
-def publish_asset_list(client, asset_groups,log_file):
+def publish_asset_list(client, asset_groups, registry):
     """
     For each (category, type_slug), publish the array of IDs (as JSON).
     E.g. factorio/Mining/line_123/mining_drill => '[{"id":14},{"id":20}]'
@@ -160,19 +409,14 @@ def publish_asset_list(client, asset_groups,log_file):
     for (category,line_id, type_slug), id_list in asset_groups.items():
         topic = f"{TOPIC_PREFIX}/{category}/{line_id}/{type_slug}"
         # 'id_list' is a Python list like: [ {"id":14}, {"id":20} ]
-        publish_json(client, topic, id_list,log_file)
+        publish_json(client, topic, id_list, registry)
 
-def publish_asset_data(client, asset,log_file):
+def make_topic_plan(asset):
     """
-    Publish data for a single asset to multiple subtopics:
-      factorio/<category>/<type_slug>/<id>/<subtopic>
-    All values are JSON-encoded for correct parsing.
-
-    'unit_number' -> 'id'
+    Build the topics of 'asset'. Every subtopic hangs off its base topic:
+      <TOPIC_PREFIX>/<category>/<line_id>/<type_slug><id>
     """
     asset_id = asset.get("id", asset.get("unit_number", "unknown_id"))
-    asset["id"] = asset_id
-
     asset_type = asset.get("type", "unknown")
     category   = TYPE_TO_CATEGORY.get(asset_type, "other")
     type_slug  = asset_type.replace('-', '')
@@ -181,7 +425,37 @@ def publish_asset_data(client, asset,log_file):
     line_id = asset.get("line_id", "Isolated")  # Get Line ID，default "Isolated"
     type_plus_id = type_slug + str(asset_id)
 
-    base_topic = f"{TOPIC_PREFIX}/{category}/{line_id}/{type_plus_id}"
+    return TopicPlan(
+        asset_type,
+        line_id,
+        f"{TOPIC_PREFIX}/{category}/{line_id}/{type_plus_id}",
+        f"{category}/{type_plus_id}",
+        # the ID lists keep the long type name, with '_' for '-'
+        (category, line_id, asset_type.replace('-', '_')),
+    )
+
+# unit_number -> precomputed topic strings of that asset
+topic_plans = TopicPlanCache(make_topic_plan)
+
+def build_asset_messages(asset, plan=None, unchanged=(), status_text=None):
+    """
+    Build the (subtopic, value) pairs for a single asset, without publishing.
+    'value' is the plain Python object that will be JSON-encoded later.
+    Topic strings come from the asset's cached TopicPlan.
+
+    Sections named in 'unchanged' ("pos", "status", "production",
+    "pollution", "electricity") are left out; 'status_text' is an already decoded
+    (dominant, all flags) pair for the asset's status.
+
+    'unit_number' -> 'id'
+    """
+    asset_id = asset.get("id", asset.get("unit_number", "unknown_id"))
+    asset["id"] = asset_id
+    asset_type = asset.get("type", "unknown")
+
+    if plan is None:
+        plan = topic_plans.get(asset)
+    messages = []
 
     # 1) Basic info
     basic_info = {
@@ -189,126 +463,434 @@ def publish_asset_data(client, asset,log_file):
         "name": asset.get("name", "unknown_name"),
         "type": asset_type,
     }
-    publish_json(client, f"{base_topic}/basic", basic_info, log_file)
+    messages.append((plan.basic, basic_info))
 
-    publish_json(client, f"{base_topic}/pos", asset.get("position", {}),log_file)
+    if "pos" not in unchanged:
+        messages.append((plan.pos, asset.get("position", {})))
 
     # 2) Status
-    raw_status = asset.get("last_status", 0)
-    dominant   = decode_dominant_flag(raw_status)
-    all_flags  = decode_all_flags(raw_status)
-    all_flags_str = ', '.join(all_flags)
-    # state_changed_tick
-    state_changed_tick = asset.get("state_changed_tick", 0)
-
-    status_info = {
-        "status": dominant,
-        "statusBitmask": raw_status,
-        "allFlags": all_flags_str,
-        "stateChangedTick" : state_changed_tick
-    }
-    publish_json(client, f"{base_topic}/status", status_info,log_file)
+    if "status" not in unchanged:
+        raw_status = asset.get("last_status", 0)
+        dominant, all_flags_str = status_text or decode_status(raw_status)
+        # state_changed_tick
+        state_changed_tick = asset.get("state_changed_tick", 0)
+
+        status_info = {
+            "status": dominant,
+            "statusBitmask": raw_status,
+            "allFlags": all_flags_str,
+            "stateChangedTick" : state_changed_tick
+        }
+        messages.append((plan.status, status_info))
 
     # 3) Production
-    production_count       = asset.get("production_count", 0)
-    production_last_update = asset.get("production_last_updated", 0)
-    production_info ={
-        "count": production_count,
-        "lastUpdated": production_last_update
-    }
-    publish_json(client, f"{base_topic}/production", production_info , log_file)
+    if "production" not in unchanged:
+        production_count       = asset.get("production_count", 0)
+        production_last_update = asset.get("production_last_updated", 0)
+        production_info ={
+            "count": production_count,
+            "lastUpdated": production_last_update
+        }
+        messages.append((plan.production, production_info))
 
     # 4) Pollution (Time series data)
-    pollution_value = asset.get("pollution", 0.0)
-    pollution_info={
-        "pollution": pollution_value
-    }
-    publish_json(client, f"{base_topic}/pollution", pollution_info, log_file)
+    if "pollution" not in unchanged:
+        pollution_value = asset.get("pollution", 0.0)
+        pollution_info={
+            "pollution": pollution_value
+        }
+        messages.append((plan.pollution, pollution_info))
 
     # 5) Inventory can be either a dict or a list, so handle both cases
     inventory = asset.get("inventory", {})
-    inventory_topic_prefix = f"{base_topic}/inventory"
     if isinstance(inventory, dict):
         for inv_label, stack_list in inventory.items():
-            publish_json(client, f"{inventory_topic_prefix}/{inv_label}", stack_list,log_file)
+            messages.append((plan.inventory_topic(inv_label), stack_list))
     elif isinstance(inventory, list):
-        publish_json(client, f"{inventory_topic_prefix}", inventory,log_file)
+        messages.append((plan.inventory, inventory))
     else:
-        publish_json(client, f"{inventory_topic_prefix}", str(inventory),log_file)
+        messages.append((plan.inventory, str(inventory)))
 
     # 6) Fluids
     fluids = asset.get("fluids", [])
     # If you want each fluid box in a single array, you can do:
-    # publish_json(client, f"{base_topic}/fluids", fluids)
+    # messages.append((f"{plan.base}/fluids", fluids))
     # Or individually:
     for i, fluid in enumerate(fluids):
-        fluid_topic = f"{base_topic}/fluids/box{i}"
-        publish_json(client, fluid_topic, fluid if fluid else "empty",log_file)
+        messages.append((plan.fluid_topic(i), fluid if fluid else "empty"))
 
     # 7) NEW: Electrical
-    electric_info = asset.get("electric",{})
-    publish_json(client, f"{base_topic}/electricity", electric_info, log_file)
-
-# Create a temp log file object, used to collect all the topic from this time
-class TopicCollector:
-    def __init__(self):
-        self.topics = {}
-    
-    def write(self, line):
-        # Decode lines, extract topic and payload
-        if ": " in line:
-            parts = line.split(": ", 1)
-            if len(parts) == 2:
-                topic, payload = parts
-                self.topics[topic] = payload
+    if "electricity" not in unchanged:
+        electric_info = asset.get("electric",{})
+        messages.append((plan.electricity, electric_info))
+
+    return messages
+
+def publish_asset_data(client, asset, registry, plan=None, unchanged=(), status_text=None):
+    """
+    Publish data for a single asset to multiple subtopics:
+      factorio/<category>/<line_id>/<type_slug><id>/<subtopic>
+    All values are encoded (JSON by default) for correct parsing.
+    Subtopics of 'unchanged' sections are skipped (see build_asset_messages).
+    """
+    if plan is None:
+        plan = topic_plans.get(asset)
+    for section in unchanged:
+        touch_topic(getattr(plan, section))
+    for subtopic, value in build_asset_messages(asset, plan, unchanged, status_text):
+        publish_json(client, subtopic, value, registry)
+
+def build_asset_document(asset, plan=None):
+    """
+    Bundle every subtopic of 'asset' into one document keyed by the
+    subtopic path relative to the asset's base topic, e.g.
+      {"basic": {...}, "status": {...}, "inventory/input": [...], "fluids/box0": {...}}
+    """
+    if plan is None:
+        plan = topic_plans.get(asset)
+    offset = len(plan.base) + 1
+    return {topic[offset:]: value for topic, value in build_asset_messages(asset, plan)}
+
+def publish_asset_document(client, asset, registry, plan=None):
+    """
+    Publish all data for a single asset as one JSON document on its base topic:
+      factorio/<category>/<line_id>/<type_slug><id>
+    """
+    if plan is None:
+        plan = topic_plans.get(asset)
+    publish_json(client, plan.base, build_asset_document(asset, plan), registry)
+
+def collect_line_document(line_docs, asset, plan=None):
+    """
+    Add the document of 'asset' to its line's bundle in 'line_docs':
+      line_id -> {"<category>/<type_slug><id>": {asset document}}
+    """
+    if plan is None:
+        plan = topic_plans.get(asset)
+    line_doc = line_docs.get(plan.line_id)
+    if line_doc is None:
+        line_doc = line_docs[plan.line_id] = {}
+    line_doc[plan.line_key] = build_asset_document(asset, plan)
+
+def publish_line_documents(client, line_docs, registry):
+    """
+    Publish one JSON document per production line:
+      factorio/Lines/<line_id>
+    """
+    for line_id, line_doc in line_docs.items():
+        publish_json(client, f"{TOPIC_PREFIX}/Lines/{line_id}", line_doc, registry)
+
+def group_asset(asset_groups, asset, plan=None):
+    """
+    Add 'asset' to the (category, line_id, type_slug) -> [{"id": ...}] grouping
+    used by publish_asset_list.
+    """
+    if plan is None:
+        plan = topic_plans.get(asset)
+    asset_id = asset.get("id", asset.get("unit_number", "unknown_id"))
+
+    group = asset_groups.get(plan.group_key)
+    if group is None:
+        group = asset_groups[plan.group_key] = []
+    group.append({"id": asset_id})
+
+def publish_snapshot(client, assets, registry, publish_groups=True):
+    """
+    Publish one snapshot in a single pass over 'assets':
+      parse -> group -> build topics -> diff -> publish
+    Every asset is visited exactly once; the grouped ID lists go out
+    through publish_asset_list once all assets have been seen.
+    Topics that were not part of this snapshot are then dropped from the
+    change-detection cache (only if the whole snapshot was read).
+
+    PUBLISH_MODE picks the granularity: per subtopic ("field"), one
+    document per asset ("asset"), one document per line_id ("line",
+    which holds every asset of the snapshot until the end of the pass)
+    or Sparkplug B metrics per line_id device ("sparkplug", also held
+    until the end of the pass; the asset lists become device metrics).
+    With the columnar path on, the snapshot is loaded into arrays first so
+    unchanged status/production/pollution/position/electricity rows are skipped.
+
+    Shard workers pass publish_groups=False; their coordinator publishes
+    the ID lists for the whole snapshot instead.
+    """
+    begin_publish_cycle()
+    frame = None
+    if columnar_index is not None:
+        assets = assets if isinstance(assets, list) else list(assets)
+        frame = columnar_index.ingest(assets)
+    asset_groups = {}
+    line_docs = {}
+    for row, asset in enumerate(assets):
+        plan = topic_plans.get(asset)
+        group_asset(asset_groups, asset, plan)
+        if frame is not None:
+            # Only sections whose scalar fields moved since the last snapshot get encoded.
+            # A section whose topic has nothing on record (the asset changed line or type,
+            # so its plan has new topics, or the cache evicted it) is sent in full
+            unchanged = [section for section in frame.unchanged_sections(row)
+                         if topic_published(getattr(plan, section))]
+            publish_asset_data(client, asset, registry, plan,
+                               unchanged, (frame.dominant[row], frame.flags[row]))
+        elif PUBLISH_MODE == "field":
+            publish_asset_data(client, asset, registry, plan)
+        elif PUBLISH_MODE == "asset":
+            publish_asset_document(client, asset, registry, plan)
+        elif PUBLISH_MODE == "line":
+            collect_line_document(line_docs, asset, plan)
+        else:
+            sparkplug_node.collect(plan, build_asset_messages(asset, plan))
+    publish_line_documents(client, line_docs, registry)
+    if sparkplug_node is not None:
+        sparkplug_node.publish(client, asset_groups)
+    elif publish_groups:
+        publish_asset_list(client, asset_groups, registry)
+    if frame is not None:
+        columnar_index.commit(frame)
+    end_publish_cycle()
+    sweep_registry(registry)
+    return asset_groups
+
+def publish_snapshot_sharded(client, pool, assets, registry):
+    """
+    Coordinator side of the sharded mode: group every asset and hand it to
+    its shard worker, then publish the grouped ID lists on 'client'.
+    The workers build, diff and publish the asset data in parallel.
+    """
+    begin_publish_cycle()
+    asset_groups = {}
+    try:
+        for asset in assets:
+            group_asset(asset_groups, asset)
+            pool.submit(asset)
+    except BaseException:
+        pool.abort_cycle()
+        raise
+    pool.end_cycle()
+    publish_asset_list(client, asset_groups, registry)
+    end_publish_cycle()
+    sweep_registry(registry)
+    return asset_groups
+
+def start_shard_pool(shards, client_factory=None, registry_file=None):
+    """
+    Start 'shards' worker processes that each publish their share of every
+    snapshot; worker N keeps its topic registry in '<registry_file>.shard<N>'.
+    """
+    return ShardPool(
+        shards,
+        functools.partial(publish_snapshot, publish_groups=False),
+        client_factory or connect_mqtt,
+        functools.partial(TopicRegistry, flush_interval=REGISTRY_FLUSH_INTERVAL,
+                          payload_format=PAYLOAD_FORMAT),
+        registry_file or REGISTRY_FILE,
+        # a line document must be built by a single worker
+        by_line_only=PUBLISH_MODE == "line",
+    )
+
+def read_snapshot(path, header=None):
+    """
+    Parse the whole snapshot file and return its 'assets' list; the other
+    top-level keys ("tick", "scan") go into the 'header' dict if one is given.
+    Used when [publisher] streaming is off; see SnapshotStream otherwise.
+    Raises TruncatedSnapshotError if the file is not valid JSON (most
+    likely caught mid-write), ValueError if it has no usable asset list.
+    """
+    start = time.perf_counter()
+    with open(path, "r") as f:
+        text = f.read()
+    if metrics is not None:
+        metrics.add("read", time.perf_counter() - start)
+    return parse_snapshot(text, path, header)
+
+def parse_snapshot(text, path, header=None):
+    """The 'assets' list of a snapshot's JSON text or bytes read from 'path'; see read_snapshot."""
+    start = time.perf_counter()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise TruncatedSnapshotError(f"{path} is not valid JSON: {e}") from e
+    if metrics is not None:
+        metrics.add("parse", time.perf_counter() - start)
+
+    # data: {"tick": ..., "scan": {...}, "assets": [...]}
+    assets = data.get("assets", [])
+    if assets == {}:
+        assets = []   # an empty Lua table serializes as {}
+    if not isinstance(assets, list):
+        raise ValueError("data['assets'] is not a list.")
+    if header is not None:
+        header.update((key, value) for key, value in data.items() if key != "assets")
+    return assets
+
+# The mod's initial map scan, from the "scan" field of the last snapshot:
+# {"complete", "progress" (0..1), "chunks_scanned"}; None if the mod doesn't send it
+scan_state = None
+
+def note_scan_progress(scan):
+    """Report the initial map scan; until it completes, snapshots only hold part of the factory."""
+    global scan_state
+    if not isinstance(scan, dict) or scan == scan_state:
+        return
+    if not scan.get("complete"):
+        print(f"Initial map scan {scan.get('progress', 0):.0%} done "
+              f"({scan.get('chunks_scanned', 0)} chunks), snapshot is partial")
+    elif scan_state is not None and not scan_state.get("complete"):
+        print("Initial map scan complete")
+    scan_state = scan
+
+def instrument(client):
+    """
+    Install the [metrics] timers: wrap the encode and group stages and the
+    client's publish. Returns the wrapped client and the report scheduler.
+    Shard workers are not instrumented; their publish time shows up in
+    the coordinator's cycle time.
+    """
+    global metrics, encode_payload, group_asset
+    metrics = PublisherMetrics()
+    encode_payload = metrics.timed("encode", encode_payload)
+    group_asset = metrics.timed("group", group_asset)
+    textfile = METRICS.get('prometheus_textfile')
+    reporter = MetricsReporter(
+        metrics,
+        f"{TOPIC_PREFIX}/$SYS/publisher",
+        METRICS.get('interval', 10),
+        os.path.join(script_dir, textfile) if textfile else None,
+    )
+    return MetricsClient(client, metrics), reporter
+
+def client_gauges(client, gate=None, delta_log=None, slots=None):
+    """
+    Queue depths of the paho client and of the outbox/scheduler wrappers,
+    if any, the skipped snapshot counts of 'gate', the sequence gaps
+    of 'delta_log' and the overtaken reads of 'slots'.
+    """
+    gauges = {
+        # paho internals: packets waiting for the socket, messages awaiting acknowledgement
+        "paho_queued_packets": len(getattr(client, "_out_packet", ())),
+        "paho_inflight": getattr(client, "_inflight_messages", 0),
+        "change_cache_topics": len(last_published),
+    }
+    outbox = getattr(client, "outbox", None)
+    if isinstance(outbox, Outbox):
+        gauges["outbox_pending_bytes"] = outbox.pending_bytes()
+        gauges["outbox_dropped"] = outbox.dropped
+    queues = getattr(client, "queues", None)
+    if isinstance(queues, dict):
+        for priority, queue in queues.items():
+            gauges[f"scheduler_queued_{priority}"] = sum(len(messages) for messages in queue.values())
+        gauges["scheduler_patches_dropped"] = client.patches_dropped
+    if gate is not None:
+        gauges["snapshots_duplicate"] = gate.duplicates
+        gauges["snapshots_dropped"] = gate.dropped
+        gauges["snapshots_torn_reads"] = gate.torn_reads
+    if scan_state is not None:
+        gauges["map_scan_progress"] = scan_state.get("progress", 0)
+    if delta_log is not None:
+        gauges["snapshot_log_gaps"] = delta_log.gaps
+        gauges["snapshot_log_resyncs"] = delta_log.resyncs
+    if slots is not None:
+        gauges["snapshot_slots_overtaken"] = slots.overtaken
+    return gauges
 
 def main():
+    # fork the shard workers before paho's network thread (or any other) starts
+    pool = start_shard_pool(SHARDS) if SHARDS > 1 else None
     client = connect_mqtt()
     client.loop_start()
-
-    last_mtime = 0
+    reporter = None
+    if METRICS_ENABLED:
+        client, reporter = instrument(client)
+
+    registry = TopicRegistry(REGISTRY_FILE, REGISTRY_FLUSH_INTERVAL, PAYLOAD_FORMAT)
+    delta_log = DeltaLogReader(FACTORY_STATE_LOG) if SNAPSHOT_FORMAT == "delta" else None
+    slots = SlotReader(FACTORY_STATE_MANIFEST) if SNAPSHOT_FORMAT == "slots" else None
+    watched = {"slots": FACTORY_STATE_MANIFEST, "delta": FACTORY_STATE_LOG}.get(SNAPSHOT_FORMAT, FACTORY_STATE_FILE)
+    watcher = open_watcher(watched, WATCH_BACKEND, POLL_INTERVAL, WATCH_DEBOUNCE)
+    latency = LatencyStats()
+    gate = SnapshotGate(TORN_RETRIES, TORN_BACKOFF)
 
     while True:
-        time.sleep(2)
-        if not os.path.exists(FACTORY_STATE_FILE):
-            print(f"Error: {FACTORY_STATE_FILE} does not exist")
-            continue
-        mtime = os.path.getmtime(FACTORY_STATE_FILE)
-        if mtime > last_mtime:
-            last_mtime = mtime
-            # file changed, read new snapshot
-            try:
-                with open(FACTORY_STATE_FILE, "r") as f:
-                    data = json.load(f)
-
-                # data: {"tick": ..., "assets": [...]}
-                assets = data.get("assets", [])
-                if not isinstance(assets, list):
-                    print("Error: data['assets'] is not a list.")
+        mtime = watcher.wait()
+        cycle_start = time.perf_counter()
+        # file changed, read new snapshot
+        try:
+            if delta_log is not None:
+                # Only the new log entries are parsed; they update the in-memory state
+                read_start = time.perf_counter()
+                was_waiting = delta_log.waiting
+                if not delta_log.read():
+                    if delta_log.waiting and not was_waiting:
+                        print(f"{FACTORY_STATE_LOG} has no keyframe with unbroken deltas, "
+                              f"waiting for the mod to write the next one")
                     continue
-
-                # Open log file for writing (overwrite previous content)
-                with open(LOG_FILE, "w") as log_file:
-                    # 1) Build dict grouping by (category, type_slug) -> list of { "id": ... }
-                    asset_groups = {}
-                    for asset in assets:
-                        a_type     = asset.get("type", "unknown")
-                        category   = TYPE_TO_CATEGORY.get(a_type, "other")
-                        line_id = asset.get("line_id", "Isolated")  # get Line ID
-                        type_slug  = a_type.replace('-', '_')
-                        asset_id   = asset.get("id", asset.get("unit_number", "unknown_id"))
-
-                        key = (category, line_id, type_slug)
-                        if key not in asset_groups:
-                            asset_groups[key] = []
-                        asset_groups[key].append({"id": asset_id})
-                    
-                        # Publish subtopics for each asset
-                        for asset in assets:
-                            publish_asset_data(client, asset,log_file)
-
-            except Exception as e:
-                print("Error parsing factory_state.json:", e)
+                if was_waiting:
+                    print(f"{FACTORY_STATE_LOG} resynced at seq {delta_log.seq}")
+                if metrics is not None:
+                    metrics.add("parse", time.perf_counter() - read_start)
+                tick = delta_log.tick
+                assets = delta_log.snapshot()
+            elif slots is not None:
+                # The manifest names a complete slot: no head/tail probe needed
+                read_start = time.perf_counter()
+                raw = slots.read()
+                if raw is None:
+                    continue
+                if metrics is not None:
+                    metrics.add("read", time.perf_counter() - read_start)
+                tick = slots.tick
+                if gate.is_duplicate(tick):
+                    print(f"Snapshot tick {tick} already published, skipping ({gate.duplicates} duplicates so far)")
+                    continue
+                header = {}
+                assets = parse_snapshot(raw, FACTORY_STATE_MANIFEST, header)
+                # Only now: a slot that failed to parse is read again on the retry
+                slots.consumed()
+            else:
+                # Head/tail check first: a torn or already published snapshot is never parsed
+                tick = gate.probe(FACTORY_STATE_FILE)
+                if gate.is_duplicate(tick):
+                    print(f"Snapshot tick {tick} already published, skipping ({gate.duplicates} duplicates so far)")
+                    continue
+                if STREAMING:
+                    # Assets flow straight from the file into the publish pipeline
+                    assets = stream = SnapshotStream(FACTORY_STATE_FILE, STREAM_CHUNK_SIZE)
+                    if metrics is not None:
+                        # reading and parsing are interleaved: both count as "parse"
+                        assets = metrics.timed_iter("parse", assets)
+                else:
+                    header = {}
+                    assets = read_snapshot(FACTORY_STATE_FILE, header)
+
+            if pool:
+                publish_snapshot_sharded(client, pool, assets, registry)
+            else:
+                publish_snapshot(client, assets, registry)
+            # Topics only reach the disk when new or when the registry is due a compaction
+            registry.flush_if_due()
+            streamed = STREAMING and SNAPSHOT_FORMAT == "full"
+            gate.published(stream.tick if tick is None and streamed else tick)
+            if delta_log is not None:
+                note_scan_progress(delta_log.scan)
+            else:
+                note_scan_progress(stream.scan if streamed else header.get("scan"))
+            latency.record(time.time() - mtime)
+            if metrics is not None:
+                metrics.end_cycle(time.perf_counter() - cycle_start)
+                metrics.unchanged = last_published.unchanged
+                reporter.report_if_due(client, functools.partial(client_gauges, client, gate, delta_log, slots))
+
+        except TruncatedSnapshotError as e:
+            # Caught the mod mid-write: retry the same snapshot after a short backoff
+            delay = gate.torn()
+            if delay is None:
+                print(f"Dropped incomplete snapshot after {gate.retries} retries "
+                      f"({gate.dropped} dropped so far):", e)
+            else:
+                time.sleep(delay)
+                watcher.retry()
+        except Exception as e:
+            print("Error parsing the snapshot:", e)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,193 @@
+#####################################################################
+# Priority-aware publish scheduler for publisher.py.                #
+#                                                                   #
+# Every topic gets a priority from its section (status, basic, ...):#
+# each priority has a token bucket limiting messages/second. A      #
+# publish goes straight to the client while its bucket has tokens   #
+# and nothing of that priority is waiting; otherwise it is queued   #
+# per topic (latest value wins) and a background thread drains the  #
+# queues highest priority first as tokens come back. Status changes #
+# therefore never wait behind a flood of inventory updates.         #
+# Merge patches ('<topic>/delta') queue behind their topic's full   #
+# document, which supersedes them when it is queued again.          #
+#####################################################################
+import threading
+import time
+from collections import OrderedDict, deque
+
+from merge_patch import DELTA_SUFFIX
+
+PRIORITIES = ("high", "medium", "low")
+
+# Topic section -> priority; topics without a section (asset lists, documents) use "medium"
+DEFAULT_PRIORITIES = {
+    "status": "high",
+    "basic": "high",
+    "pos": "medium",
+    "production": "medium",
+    "electricity": "low",
+    "inventory": "low",
+    "fluids": "low",
+    "pollution": "low",
+}
+DEFAULT_PRIORITY = "medium"
+
+
+class TokenBucket:
+    """'rate' tokens per second, holding at most 'burst'. rate 0 means unlimited."""
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst else max(1, rate)
+        self.tokens = self.burst
+        self._stamp = time.monotonic()
+
+    def take(self):
+        if not self.rate:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+def topic_section(topic, sections):
+    """
+    The section a subtopic belongs to, looking at its last segments:
+    '.../status', '.../inventory/<label>', '.../fluids/box0', '.../pollution/delta'.
+    """
+    for segment in topic.rsplit('/', 3)[:0:-1]:
+        if segment in sections:
+            return segment
+    return None
+
+
+class PriorityScheduler:
+    """
+    Wraps a (paho or outbox-buffered) client: publish() is rate limited per
+    priority as described above, everything else is delegated.
+
+        client = PriorityScheduler(client, {"high": 0, "medium": 5000, "low": 2000})
+
+    Each queue maps a topic to its waiting messages: at most one full
+    value, followed by the merge patches published on '<topic>/delta'
+    after it. A new full value replaces the topic's messages in place, so
+    it keeps the topic's position. At most 'max_queued_patches' patches
+    wait in all; beyond that a topic's patches are dropped and
+    'on_patches_dropped(topic)' is called, so the next value for it can
+    be sent in full.
+
+    The priority of the last 'max_cached_topics' topics is cached, least
+    recently published first out.
+    """
+    def __init__(self, client, rates, priorities=None, default_priority=DEFAULT_PRIORITY,
+                 max_queued_patches=10000, on_patches_dropped=None, max_cached_topics=10000):
+        self._client = client
+        self.priorities = dict(DEFAULT_PRIORITIES, **(priorities or {}))
+        for priority in list(self.priorities.values()) + [default_priority]:
+            if priority not in PRIORITIES:
+                raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}, not '{priority}'")
+        self.default_priority = default_priority
+        self.buckets = {priority: TokenBucket(rates.get(priority, 0)) for priority in PRIORITIES}
+        self.queues = {priority: OrderedDict() for priority in PRIORITIES}   # topic -> deque of messages
+        self.max_queued_patches = max_queued_patches
+        self.on_patches_dropped = on_patches_dropped
+        self.coalesced = 0
+        self.patches_dropped = 0
+        self._queued_patches = 0
+        self.max_cached_topics = max_cached_topics
+        self._sections = OrderedDict()   # topic -> priority, least recently published first
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        threading.Thread(target=self._drain_loop, name="publish-scheduler", daemon=True).start()
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def priority(self, topic):
+        priority = self._sections.get(topic)
+        if priority is not None:
+            self._sections.move_to_end(topic)
+            return priority
+        section = topic_section(topic, self.priorities)
+        priority = self.priorities[section] if section else self.default_priority
+        self._sections[topic] = priority
+        if len(self._sections) > self.max_cached_topics:
+            self._sections.popitem(last=False)
+        return priority
+
+    def pending(self):
+        """Number of queued messages, per priority."""
+        with self._lock:
+            return {priority: sum(len(messages) for messages in queue.values())
+                    for priority, queue in self.queues.items()}
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        priority = self.priority(topic)
+        with self._lock:
+            queue = self.queues[priority]
+            if not queue and self.buckets[priority].take():
+                return self._client.publish(topic, payload, qos, retain, properties)
+            message = (topic, payload, qos, retain, properties)
+            if topic.endswith(DELTA_SUFFIX):
+                # Merge patches build on each other: never coalesce them
+                self._queue_patch(queue, topic[:-len(DELTA_SUFFIX)], message)
+            else:
+                messages = queue.get(topic)
+                if messages is None:
+                    queue[topic] = deque((message,))
+                else:
+                    # Replaces the old value and the patches computed against it
+                    self.coalesced += 1
+                    self._queued_patches -= sum(1 for queued in messages if queued[0] != topic)
+                    messages.clear()
+                    messages.append(message)
+        self._wake.set()
+        return None
+
+    def _queue_patch(self, queue, base, message):
+        messages = queue.get(base)
+        if self._queued_patches >= self.max_queued_patches > 0:
+            # A patch is useless without every patch before it: drop them all,
+            # keeping only a full value queued ahead of them
+            full = messages[0] if messages and messages[0][0] == base else None
+            if messages is not None:
+                self.patches_dropped += len(messages) - (full is not None)
+                self._queued_patches -= len(messages) - (full is not None)
+                if full is None:
+                    del queue[base]
+                else:
+                    messages.clear()
+                    messages.append(full)
+            self.patches_dropped += 1
+            if self.on_patches_dropped is not None:
+                self.on_patches_dropped(base)
+            return
+        if messages is None:
+            messages = queue[base] = deque()
+        messages.append(message)
+        self._queued_patches += 1
+
+    def _drain_once(self):
+        """Publish queued messages, highest priority first, while tokens last. Returns True if any remain."""
+        with self._lock:
+            for priority in PRIORITIES:
+                queue, bucket = self.queues[priority], self.buckets[priority]
+                while queue and bucket.take():
+                    topic, messages = next(iter(queue.items()))
+                    message = messages.popleft()
+                    if not messages:
+                        del queue[topic]
+                    if message[0] != topic:
+                        self._queued_patches -= 1
+                    self._client.publish(*message)
+            return any(self.queues.values())
+
+    def _drain_loop(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            while self._drain_once():
+                time.sleep(0.01)
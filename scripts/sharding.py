@@ -0,0 +1,144 @@
+#####################################################################
+# Multi-process sharded publishing for publisher.py.                #
+#                                                                   #
+# The coordinator (the main publisher process) parses the snapshot  #
+# and hands each asset to one of N worker processes, chosen by      #
+# hashing its line_id (or unit_number for "Isolated" assets). Every #
+# worker has its own MQTT client and change-detection state, and an #
+# asset always lands on the same worker, so per-asset ordering is   #
+# kept by the worker's FIFO inbox.                                  #
+#####################################################################
+import multiprocessing
+import queue
+import time
+import zlib
+
+_ASSETS, _END, _ABORT, _STOP = "assets", "end", "abort", "stop"
+
+
+class CycleAborted(Exception):
+    """The coordinator gave up on the current snapshot (e.g. it was truncated)."""
+
+
+def shard_key(asset, by_line_only=False):
+    """
+    The value an asset is partitioned on: its line_id, or its unit_number
+    for "Isolated" assets so the (large) isolated set spreads over all
+    workers. 'by_line_only' keeps whole lines, Isolated included, together.
+    """
+    line_id = asset.get("line_id", "Isolated")
+    if line_id == "Isolated" and not by_line_only:
+        return asset.get("id", asset.get("unit_number", "unknown_id"))
+    return line_id
+
+
+def shard_index(asset, shards, by_line_only=False):
+    # crc32 rather than hash(): stable across processes and runs
+    return zlib.crc32(str(shard_key(asset, by_line_only)).encode()) % shards
+
+
+def _cycle_assets(inbox, state):
+    """Yield the assets of one cycle from 'inbox' until the end-of-cycle marker."""
+    while True:
+        kind, payload = inbox.get()
+        if kind == _ASSETS:
+            yield from payload
+        elif kind == _ABORT:
+            # Raising skips the end-of-cycle work (group lists, cache sweep)
+            raise CycleAborted()
+        else:
+            state["stop"] = kind == _STOP
+            return
+
+
+def _worker(index, inbox, done, publish_cycle, client_factory, registry_factory, registry_path):
+    client = client_factory(f"shard{index}")
+    client.loop_start()
+    registry = registry_factory(registry_path)
+    state = {"stop": False}
+    while not state["stop"]:
+        start = time.perf_counter()
+        try:
+            publish_cycle(client, _cycle_assets(inbox, state), registry)
+            registry.flush_if_due()
+        except CycleAborted:
+            pass
+        done.put((index, time.perf_counter() - start))
+
+
+class ShardPool:
+    """
+    N worker processes, each running 'publish_cycle(client, assets, registry)'
+    on its share of every snapshot with a client from 'client_factory("shard<N>")' and
+    its own registry from 'registry_factory("<registry_file>.shard<N>")'.
+
+        pool.submit(asset)   # for every asset of the snapshot
+        pool.end_cycle()     # flush and tell every worker the snapshot is done
+                             # (or pool.abort_cycle() to drop it)
+        pool.wait()          # optional: block until all workers finished it
+    """
+    def __init__(self, shards, publish_cycle, client_factory, registry_factory, registry_file,
+                 batch_size=256, by_line_only=False, queue_size=64):
+        self.shards = shards
+        self.batch_size = batch_size
+        self.by_line_only = by_line_only
+        self._batches = [[] for _ in range(shards)]
+        self._inboxes = [multiprocessing.Queue(queue_size) for _ in range(shards)]
+        self._done = multiprocessing.Queue()
+        self._pending = 0
+        self._workers = []
+        for index, inbox in enumerate(self._inboxes):
+            worker = multiprocessing.Process(
+                target=_worker,
+                args=(index, inbox, self._done, publish_cycle, client_factory,
+                      registry_factory, f"{registry_file}.shard{index}"),
+                name=f"publisher-shard-{index}",
+                daemon=True,
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, asset):
+        index = shard_index(asset, self.shards, self.by_line_only)
+        batch = self._batches[index]
+        batch.append(asset)
+        if len(batch) >= self.batch_size:
+            self._inboxes[index].put((_ASSETS, batch))
+            self._batches[index] = []
+
+    def end_cycle(self):
+        for index, inbox in enumerate(self._inboxes):
+            if self._batches[index]:
+                inbox.put((_ASSETS, self._batches[index]))
+                self._batches[index] = []
+            inbox.put((_END, None))
+        self._pending += self.shards
+        self._collect(block=False)
+
+    def abort_cycle(self):
+        """Drop the current snapshot: workers skip their end-of-cycle work for it."""
+        for index, inbox in enumerate(self._inboxes):
+            self._batches[index] = []
+            inbox.put((_ABORT, None))
+        self._pending += self.shards
+        self._collect(block=False)
+
+    def _collect(self, block):
+        timings = []
+        while self._pending:
+            try:
+                timings.append(self._done.get(block))
+            except queue.Empty:
+                break
+            self._pending -= 1
+        return timings
+
+    def wait(self):
+        """Block until every worker has finished all submitted cycles; returns their timings."""
+        return self._collect(block=True)
+
+    def close(self):
+        for inbox in self._inboxes:
+            inbox.put((_STOP, None))
+        for worker in self._workers:
+            worker.join(timeout=5)
@@ -0,0 +1,288 @@
+#####################################################################
+# Snapshot recorder and time-accelerated replay for load testing.   #
+#                                                                   #
+# record: archive every new factory_state.json with its tick. Each  #
+#   entry is gzip-compressed and only holds the assets that changed #
+#   since the previous one (plus the unit_numbers that were         #
+#   removed), with a full keyframe every N snapshots; a rewrite     #
+#   with identical content is not stored at all.                    #
+# replay: feed the archive through publisher.publish_snapshot at    #
+#   1x, 10x, ... or maximum speed (paced by game ticks), or write   #
+#   it for a separately running publisher: slot files plus a        #
+#   manifest like the mod's "slots" format when the target is a     #
+#   *.manifest.json, a plain factory_state.json otherwise.          #
+#                                                                   #
+# Usage: python snapshot_archive.py record archive/                 #
+#        python snapshot_archive.py replay archive/ --speed 10      #
+#        python snapshot_archive.py replay archive/ --speed max     #
+#               --dry-run                                           #
+#        python snapshot_archive.py replay archive/                 #
+#               --target ../factory_state.manifest.json             #
+#####################################################################
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import statistics
+import time
+
+INDEX_FILE = "index.jsonl"
+TICKS_PER_SECOND = 60
+
+
+def _unit(asset):
+    return asset.get("unit_number", asset.get("id"))
+
+
+class SnapshotRecorder:
+    """
+    Appends snapshots to an archive directory:
+
+        recorder = SnapshotRecorder("archive")
+        recorder.record(raw_bytes)   # returns the index entry, or None if a duplicate
+
+    The index (index.jsonl) has one line per stored snapshot:
+    {"tick", "time", "file", "kind": "full"|"delta", "assets", "sha256"}.
+    """
+    def __init__(self, directory, keyframe_interval=100, compresslevel=6):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.compresslevel = compresslevel
+        self._previous = {}        # unit_number -> canonical JSON of the asset
+        self._last_sha = None
+        self._since_keyframe = 0
+        # Resuming an archive: start with a keyframe, as the previous state is not loaded
+        self._force_keyframe = True
+
+    def record(self, raw):
+        sha = hashlib.sha256(raw).hexdigest()
+        if sha == self._last_sha:
+            return None
+        data = json.loads(raw)
+        tick = data.get("tick", 0)
+        assets = data.get("assets") or []
+        if not isinstance(assets, list):
+            raise ValueError("data['assets'] is not a list.")
+
+        current = {}
+        for asset in assets:
+            current[_unit(asset)] = json.dumps(asset, separators=(",", ":"))
+        if self._force_keyframe or self._since_keyframe + 1 >= self.keyframe_interval:
+            kind, body = "full", raw
+            self._since_keyframe = 0
+            self._force_keyframe = False
+        else:
+            previous = self._previous
+            changed = [text for unit, text in current.items() if previous.get(unit) != text]
+            removed = [unit for unit in previous if unit not in current]
+            kind = "delta"
+            body = ('{"tick":%s,"removed":%s,"changed":[%s]}'
+                    % (json.dumps(tick), json.dumps(removed), ",".join(changed))).encode("utf-8")
+            self._since_keyframe += 1
+
+        name = f"snap-{tick:012d}-{sha[:12]}.json.gz"
+        with open(os.path.join(self.directory, name), "wb") as f:
+            f.write(gzip.compress(body, self.compresslevel))
+        entry = {"tick": tick, "time": time.time(), "file": name, "kind": kind,
+                 "assets": len(assets), "sha256": sha}
+        with open(os.path.join(self.directory, INDEX_FILE), "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+        self._previous = current
+        self._last_sha = sha
+        return entry
+
+
+class SlotWriter:
+    """
+    Writes snapshots the way the mod's SNAPSHOT_FORMAT = "slots" does:
+    factory_state.<seq % slots>.json next to the manifest, then the
+    manifest {"slot", "seq", "tick", "size", "slots"} naming it.
+    """
+    def __init__(self, manifest_path, slots=2):
+        self.manifest_path = manifest_path
+        self.directory = os.path.dirname(manifest_path)
+        self.slots = slots
+        self.seq = 0
+
+    def write(self, tick, assets):
+        self.seq += 1
+        slot = f"factory_state.{self.seq % self.slots}.json"
+        body = json.dumps({"tick": tick, "seq": self.seq, "assets": assets},
+                          separators=(",", ":")).encode("utf-8")
+        with open(os.path.join(self.directory, slot), "wb") as f:
+            f.write(body)
+        manifest = {"slot": slot, "seq": self.seq, "tick": tick, "size": len(body), "slots": self.slots}
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+
+def read_index(directory):
+    with open(os.path.join(directory, INDEX_FILE), "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def iter_archive(directory):
+    """
+    Yield (tick, assets list) for every archived snapshot, rebuilding delta
+    entries from the preceding ones. A delta whose base is missing (e.g. the
+    archive starts with one) is skipped until the next keyframe.
+    """
+    assets = None
+    for entry in read_index(directory):
+        with open(os.path.join(directory, entry["file"]), "rb") as f:
+            data = json.loads(gzip.decompress(f.read()))
+        if entry["kind"] == "full":
+            assets = {_unit(asset): asset for asset in data.get("assets") or []}
+        elif assets is None:
+            continue
+        else:
+            for unit in data["removed"]:
+                assets.pop(unit, None)
+            for asset in data["changed"]:
+                assets[_unit(asset)] = asset
+        # Copies: the publisher adds keys to the asset dicts it publishes
+        yield entry["tick"], [dict(asset) for asset in assets.values()]
+
+
+def record(args):
+    from snapshot_reader import SlotReader
+    from snapshot_watch import open_watcher
+
+    recorder = SnapshotRecorder(args.archive, args.keyframe_interval)
+    # A manifest source means the mod's "slots" format: record the committed slots
+    slots = SlotReader(args.source) if args.source.endswith(".manifest.json") else None
+    watcher = open_watcher(args.source, args.watch_backend)
+    print(f"Recording {args.source} into {args.archive}")
+    while True:
+        watcher.wait()
+        try:
+            if slots is not None:
+                raw = slots.read()
+                if raw is None:
+                    continue
+            else:
+                with open(args.source, "rb") as f:
+                    raw = f.read()
+            entry = recorder.record(raw)
+            if slots is not None:
+                slots.consumed()
+        except ValueError as e:
+            # Caught the mod mid-write: read the same snapshot again
+            watcher.retry()
+            print("Snapshot incomplete, retrying:", e)
+            continue
+        if entry:
+            print(f"tick {entry['tick']}: {entry['assets']} assets ({entry['kind']})")
+
+
+def replay(args):
+    import publisher
+    from topic_registry import TopicRegistry
+
+    client = registry = None
+    if args.dry_run:
+        from benchmark import FakeClient
+        client = FakeClient()
+    elif not args.target:
+        client = publisher.connect_mqtt("replay")
+        client.loop_start()
+    if client is not None:
+        registry = TopicRegistry(os.path.join(args.archive, "replay_registry.jsonl"),
+                                 publisher.REGISTRY_FLUSH_INTERVAL, publisher.PAYLOAD_FORMAT)
+    writer = None
+    if args.target:
+        if args.target.endswith(".manifest.json"):
+            writer = SlotWriter(args.target)
+            target_format = "slots"
+        else:
+            target_format = "full"
+        if publisher.SNAPSHOT_FORMAT != target_format:
+            print(f"Note: a publisher reading {args.target} needs [publisher] "
+                  f"snapshot_format = \"{target_format}\" (config.toml has \"{publisher.SNAPSHOT_FORMAT}\")")
+    speed = None if args.speed == "max" else float(args.speed)
+
+    for round_number in range(args.loops):
+        latencies, lags = [], []
+        first_tick = None
+        start = time.monotonic()
+        count = 0
+        for tick, assets in iter_archive(args.archive):
+            if first_tick is None:
+                first_tick = tick
+            if speed:
+                due = start + (tick - first_tick) / TICKS_PER_SECOND / speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                lags.append(max(0.0, -delay))
+            published = time.perf_counter()
+            if writer is not None:
+                writer.write(tick, assets)
+            elif client is None:
+                with open(args.target, "w", encoding="utf-8") as f:
+                    json.dump({"tick": tick, "assets": assets}, f, separators=(",", ":"))
+            else:
+                publisher.publish_snapshot(client, assets, registry)
+                registry.flush_if_due()
+            latencies.append(time.perf_counter() - published)
+            count += 1
+        if not count:
+            print("Archive is empty")
+            return
+        elapsed = time.monotonic() - start
+        line = (f"round {round_number + 1}: {count} snapshots in {elapsed:.2f} s "
+                f"({count / elapsed:.1f}/s), publish median {statistics.median(latencies) * 1000:.1f} ms, "
+                f"max {max(latencies) * 1000:.1f} ms")
+        if lags:
+            line += f", max lag behind schedule {max(lags) * 1000:.1f} ms"
+        if args.dry_run:
+            line += f", {client.messages} msgs, {client.bytes / 1024:.1f} KiB"
+            client.messages = client.bytes = 0
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and replay factory_state.json snapshots")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rec = commands.add_parser("record", help="archive every new snapshot")
+    rec.add_argument("archive")
+    rec.add_argument("--source", default=None,
+                     help="snapshot file, or the mod's factory_state.manifest.json for slot files "
+                          "(default: whichever matches [publisher] snapshot_format)")
+    rec.add_argument("--keyframe-interval", type=int, default=100,
+                     help="store a full snapshot every N snapshots, changed assets only in between")
+    rec.add_argument("--watch-backend", default="auto", choices=("auto", "inotify", "poll"))
+
+    rep = commands.add_parser("replay", help="feed an archive through the publisher")
+    rep.add_argument("archive")
+    rep.add_argument("--speed", default="1", help='game-time multiplier (1, 10, ...) or "max"')
+    rep.add_argument("--loops", type=int, default=1, help="replay the archive this many times")
+    rep.add_argument("--dry-run", action="store_true", help="publish to an in-process fake client")
+    rep.add_argument("--target", help="write each snapshot for a running publisher.py instead of publishing "
+                                      "it: slot files and the manifest for a *.manifest.json path "
+                                      "(snapshot_format = \"slots\"), that file otherwise (\"full\")")
+
+    args = parser.parse_args()
+    if args.command == "record":
+        if args.source is None:
+            import publisher
+            if publisher.SNAPSHOT_FORMAT == "delta":
+                parser.error("recording a delta log is not supported: pass --source")
+            args.source = (publisher.FACTORY_STATE_MANIFEST if publisher.SNAPSHOT_FORMAT == "slots"
+                           else publisher.FACTORY_STATE_FILE)
+        record(args)
+    else:
+        if args.speed != "max" and float(args.speed) <= 0:
+            parser.error('--speed must be positive or "max"')
+        if args.dry_run and args.target:
+            parser.error("--dry-run and --target are mutually exclusive")
+        replay(args)
+
+
+if __name__ == "__main__":
+    main()
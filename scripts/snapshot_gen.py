@@ -0,0 +1,196 @@
+#####################################################################
+# Deterministic synthetic factory_state.json generator.             #
+#                                                                   #
+# Produces snapshots with the same shape as build_snapshot() in     #
+# control.lua ({"tick": ..., "assets": [...]}, empty Lua tables as  #
+# {}), so publisher.py can be measured without running Factorio.    #
+# The same seed and options always give the same snapshot sequence. #
+#                                                                   #
+# Usage: python snapshot_gen.py factory_state.json --assets 10000   #
+#        python snapshot_gen.py out.json --assets 500 --ticks 10    #
+#####################################################################
+import argparse
+import json
+import random
+import time
+
+# type -> (entity name, inventories, max fluid boxes, crafts, electric)
+ENTITY_TYPES = {
+    "assembling-machine": ("assembling-machine-2", ("input", "output"), 2, True, True),
+    "furnace":            ("electric-furnace", ("input", "output"), 0, True, True),
+    "mining-drill":       ("electric-mining-drill", ("output",), 1, True, True),
+    "container":          ("iron-chest", ("chest",), 0, False, False),
+    "logistic-container": ("storage-chest", ("chest",), 0, False, False),
+    "car":                ("car", (), 0, False, False),
+    "cargo-wagon":        ("cargo-wagon", (), 0, False, False),
+    "fluid-wagon":        ("fluid-wagon", (), 1, False, False),
+    "locomotive":         ("locomotive", (), 0, False, False),
+    "spider-vehicle":     ("spidertron", (), 0, False, False),
+    "roboport":           ("roboport", (), 0, False, True),
+    "boiler":             ("boiler", (), 2, False, False),
+    "pump":               ("pump", (), 2, False, True),
+    "generator":          ("steam-engine", (), 1, False, False),
+    "electric-pole":      ("substation", (), 0, False, False),
+}
+
+# A factory is mostly production: default weights for the type mix
+DEFAULT_TYPE_MIX = {
+    "assembling-machine": 40, "furnace": 20, "mining-drill": 15, "container": 8,
+    "logistic-container": 3, "pump": 2, "boiler": 2, "generator": 2, "electric-pole": 5,
+    "roboport": 1, "car": 0.5, "cargo-wagon": 0.5, "fluid-wagon": 0.3, "locomotive": 0.5,
+    "spider-vehicle": 0.2,
+}
+
+ITEMS = ("iron-plate", "copper-plate", "iron-gear-wheel", "copper-cable", "electronic-circuit",
+         "steel-plate", "plastic-bar", "iron-ore", "copper-ore", "coal", "stone")
+FLUIDS = (("water", 15.0), ("steam", 165.0), ("crude-oil", 25.0), ("petroleum-gas", 25.0))
+# defines.entity_status values the mod sees most often
+STATUSES = (1, 1, 1, 1, 2, 5, 6, 34, 35, 37, 41)
+
+
+class SnapshotGenerator:
+    """
+    A synthetic factory whose assets change a little on every advance().
+
+        gen = SnapshotGenerator(10000, lines=200, seed=1)
+        gen.write("factory_state.json")     # tick 0
+        gen.advance()                       # one snapshot interval later
+        gen.write("factory_state.json")
+
+    'inventory_items' / 'fluid_boxes' cap the stacks per inventory and the
+    fluid boxes per entity; 'churn' is the fraction of assets that change
+    between two snapshots.
+    """
+    def __init__(self, count, type_mix=None, lines=None, inventory_items=3, fluid_boxes=2,
+                 churn=0.1, seed=0, interval=60):
+        self.rng = random.Random(seed)
+        self.churn = churn
+        self.interval = interval
+        self.tick = 0
+        type_mix = type_mix or DEFAULT_TYPE_MIX
+        types = [t for t in type_mix if type_mix[t] > 0]
+        weights = [type_mix[t] for t in types]
+        lines = lines or max(1, count // 50)
+        # Substation unit_numbers name the lines, as in assign_line_id()
+        line_ids = [f"Line{count + 1 + i}" for i in range(lines)]
+
+        rng = self.rng
+        self.assets = []
+        for unit_number, asset_type in enumerate(rng.choices(types, weights, k=count), start=1):
+            name, inventories, max_boxes, _, electric = ENTITY_TYPES[asset_type]
+            line = rng.randrange(lines + 1)
+            asset = {
+                "unit_number": unit_number,
+                "name": name,
+                "type": asset_type,
+                "position": {"x": rng.randrange(-2000, 2000) + 0.5, "y": rng.randrange(-2000, 2000) + 0.5},
+                "line_id": line_ids[line] if line < lines else "Isolated",
+                "last_status": rng.choice(STATUSES),
+                "state_changed_tick": 0,
+                "production_count": 0,
+                "production_last_updated": 0,
+                "inventory": {label: self._stacks(inventory_items) for label in inventories},
+                "fluids": [self._fluid() for _ in range(min(max_boxes, fluid_boxes))] or {},
+                "pollution": round(rng.uniform(0, 40), 6),
+            }
+            if electric:
+                asset["electric"] = {"energyUsage": rng.choice((2500, 5000, 6250, 15000)),
+                                     "currentEnergy": round(rng.uniform(0, 100000), 3)}
+            self.assets.append(asset)
+
+    def _stacks(self, count):
+        rng = self.rng
+        return [{"name": name, "count": rng.randrange(1, 200), "quality": "normal"}
+                for name in rng.sample(ITEMS, rng.randrange(0, count + 1))] or {}
+
+    def _fluid(self):
+        name, temperature = self.rng.choice(FLUIDS)
+        return {"name": name, "amount": round(self.rng.uniform(0, 200), 4), "temperature": temperature}
+
+    def advance(self, ticks=None):
+        """Move 'ticks' (default: one snapshot interval) forward, changing 'churn' of the assets."""
+        self.tick += ticks or self.interval
+        rng, tick = self.rng, self.tick
+        for asset in self.assets:
+            if rng.random() >= self.churn:
+                continue
+            crafts = ENTITY_TYPES[asset["type"]][3]
+            if crafts:
+                asset["production_count"] += 1
+                asset["production_last_updated"] = tick
+            if rng.random() < 0.2:
+                asset["last_status"] = rng.choice(STATUSES)
+                asset["state_changed_tick"] = tick
+            for stacks in asset["inventory"].values():
+                for stack in stacks:
+                    stack["count"] = max(1, stack["count"] + rng.randrange(-5, 6))
+            for fluid in asset["fluids"]:
+                fluid["amount"] = round(rng.uniform(0, 200), 4)
+            asset["pollution"] = round(max(0.0, asset["pollution"] + rng.uniform(-0.5, 0.5)), 6)
+            if "electric" in asset:
+                asset["electric"]["currentEnergy"] = round(rng.uniform(0, 100000), 3)
+
+    def snapshot(self):
+        return {"tick": self.tick, "assets": self.assets}
+
+    def decoded(self):
+        """A freshly parsed copy of the assets, as the publisher gets them from the file."""
+        return json.loads(self.dumps())["assets"]
+
+    def dumps(self):
+        # helpers.table_to_json writes compact JSON
+        return json.dumps(self.snapshot(), separators=(",", ":"))
+
+    def write(self, path):
+        """Write the current snapshot the way the mod does (whole file, in place)."""
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.dumps())
+
+
+def parse_type_mix(text):
+    """'assembling-machine=3,furnace=1' -> {"assembling-machine": 3.0, "furnace": 1.0}"""
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name not in ENTITY_TYPES:
+            raise ValueError(f"unknown entity type '{name}'")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def add_generator_arguments(parser):
+    parser.add_argument("--type-mix", type=parse_type_mix, default=None,
+                        help="comma-separated type=weight pairs (default: a production-heavy mix)")
+    parser.add_argument("--lines", type=int, default=None, help="number of line_ids (default: assets/50)")
+    parser.add_argument("--inventory-items", type=int, default=3, help="max stacks per inventory")
+    parser.add_argument("--fluid-boxes", type=int, default=2, help="max fluid boxes per entity")
+    parser.add_argument("--churn", type=float, default=0.1, help="fraction of assets changing per snapshot")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def generator_from_args(count, args):
+    return SnapshotGenerator(count, args.type_mix, args.lines, args.inventory_items,
+                             args.fluid_boxes, args.churn, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic factory_state.json snapshots")
+    parser.add_argument("path")
+    parser.add_argument("--assets", type=int, default=1000)
+    parser.add_argument("--ticks", type=int, default=1,
+                        help="snapshots to write, one snapshot interval apart (each overwrites the file)")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between snapshots")
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+
+    gen = generator_from_args(args.assets, args)
+    for i in range(args.ticks):
+        if i:
+            time.sleep(args.interval)
+            gen.advance()
+        gen.write(args.path)
+        print(f"tick {gen.tick}: {len(gen.assets)} assets -> {args.path}")
+
+
+if __name__ == "__main__":
+    main()
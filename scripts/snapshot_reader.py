@@ -0,0 +1,383 @@
+#####################################################################
+# Incremental reader for the factory_state.json snapshot.           #
+#                                                                   #
+# Instead of json.load()-ing the whole file, SnapshotStream reads   #
+# it in fixed-size chunks and yields the objects of the top-level   #
+# "assets" array one at a time, so peak memory is bounded by a      #
+# single asset rather than the whole snapshot.                      #
+#                                                                   #
+# SnapshotGate checks a snapshot cheaply before it is parsed: a     #
+# file the mod is still writing is retried with backoff, and one    #
+# whose tick was already published is skipped.                      #
+#                                                                   #
+# DeltaLogReader follows the mod's delta log (SNAPSHOT_FORMAT =     #
+# "delta" in control.lua) and keeps the full asset state in memory. #
+# SlotReader reads the snapshot slot the mod's manifest names       #
+# (SNAPSHOT_FORMAT = "slots"), which is complete by construction.   #
+#####################################################################
+import json
+import mmap
+import os
+import re
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+# The top-level key only: "state_changed_tick" etc. don't have a quote before "tick"
+_TICK = re.compile(rb'"tick"\s*:\s*(\d+)')
+
+
+class TruncatedSnapshotError(ValueError):
+    """The snapshot ended before its JSON document was complete (e.g. mid-write)."""
+
+
+class SnapshotStream:
+    """
+    Iterate over the assets of a snapshot file without loading it whole.
+
+        stream = SnapshotStream(path)
+        for asset in stream:
+            ...
+        stream.tick      # top-level "tick", once it has been read
+        stream.scan      # top-level "scan" (initial map scan progress), if any
+        stream.complete  # True once the closing brace was reached
+
+    Raises TruncatedSnapshotError when the file ends early, and ValueError
+    for anything else that is not a {"tick": ..., "assets": [...]} document.
+    """
+    def __init__(self, path, chunk_size=65536):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.tick = None
+        self.scan = None
+        self.complete = False
+
+    def __iter__(self):
+        self.tick = None
+        self.scan = None
+        self.complete = False
+        with open(self.path, "r", encoding="utf-8") as f:
+            self._file = f
+            self._buf = ""
+            self._pos = 0
+            self._eof = False
+            try:
+                yield from self._parse()
+            finally:
+                self._file = None
+                self._buf = ""
+
+    # -- top-level document ---------------------------------------------
+    def _parse(self):
+        if self._next_char() != "{":
+            raise ValueError("snapshot is not a JSON object")
+        if self._peek() == "}":
+            self._pos += 1
+            self.complete = True
+            return
+
+        while True:
+            key = self._value()
+            if self._next_char() != ":":
+                raise ValueError("expected ':' after snapshot key")
+            if key == "assets" and self._peek() == "[":
+                self._pos += 1
+                yield from self._assets()
+            else:
+                value = self._value()
+                if key == "tick":
+                    self.tick = value
+                elif key == "scan":
+                    self.scan = value
+                elif key == "assets" and value != {}:
+                    # An empty Lua table serializes as {}; anything else is invalid
+                    raise ValueError("data['assets'] is not a list.")
+
+            c = self._next_char()
+            if c == "}":
+                break
+            if c != ",":
+                raise ValueError("expected ',' or '}' in snapshot object")
+        self.complete = True
+
+    def _assets(self):
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            c = self._next_char()
+            if c == "]":
+                return
+            if c != ",":
+                raise ValueError("expected ',' or ']' in assets array")
+
+    # -- buffer handling --------------------------------------------------
+    def _fill(self):
+        """Read more of the file into the buffer. Returns False at EOF."""
+        if self._eof:
+            return False
+        # Grow the read size with the pending data so large objects don't go quadratic
+        pending = len(self._buf) - self._pos
+        chunk = self._file.read(max(self.chunk_size, pending))
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            buf, pos = self._buf, self._pos
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            self._pos = pos
+            if pos < len(buf):
+                return buf[pos]
+            if not self._fill():
+                raise TruncatedSnapshotError(f"{self.path} ended unexpectedly")
+
+    def _next_char(self):
+        c = self._peek()
+        self._pos += 1
+        return c
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError as e:
+                if not self._fill():
+                    raise TruncatedSnapshotError(f"{self.path} ended mid-value: {e}") from e
+                continue
+            # A number at the very end of the buffer may continue in the next chunk
+            if end == len(self._buf) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+
+class SnapshotGate:
+    """
+    Cheap pre-parse checks for the publish loop:
+
+        tick = gate.probe(path)        # raises TruncatedSnapshotError if torn
+        if gate.is_duplicate(tick):
+            ...skip, already published...
+        ...parse and publish...
+        gate.published(tick)
+
+    On a TruncatedSnapshotError, gate.torn() returns the backoff delay
+    before the next attempt, or None once 'retries' attempts failed and the
+    snapshot is dropped. 'duplicates', 'dropped' and 'torn_reads' count
+    what was skipped.
+    """
+    def __init__(self, retries=5, backoff=0.02, probe_size=256):
+        self.retries = retries
+        self.backoff = backoff
+        self.probe_size = probe_size
+        self.last_tick = None
+        self.duplicates = 0
+        self.dropped = 0
+        self.torn_reads = 0
+        self._attempts = 0
+
+    def probe(self, path):
+        """
+        Read only the head and tail of 'path': the document must start with
+        '{' and end with '}'. Returns the top-level tick when it is in the
+        head or tail (it is the first or last key), None otherwise.
+        """
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            head = f.read(self.probe_size)
+            f.seek(max(0, size - self.probe_size))
+            tail = f.read()
+        if not head.lstrip().startswith(b"{") or not tail.rstrip().endswith(b"}"):
+            raise TruncatedSnapshotError(f"{path} is incomplete ({size} bytes)")
+        match = _TICK.search(head)
+        if match is None:
+            matches = _TICK.findall(tail)
+            return int(matches[-1]) if matches else None
+        return int(match.group(1))
+
+    def is_duplicate(self, tick):
+        if tick is not None and tick == self.last_tick:
+            self.duplicates += 1
+            self._attempts = 0
+            return True
+        return False
+
+    def published(self, tick):
+        self.last_tick = tick
+        self._attempts = 0
+
+    def torn(self):
+        """Count a torn read; returns the seconds to wait before retrying, or None to give up."""
+        self.torn_reads += 1
+        self._attempts += 1
+        if self._attempts > self.retries:
+            self.dropped += 1
+            self._attempts = 0
+            return None
+        return self.backoff * 2 ** (self._attempts - 1)
+
+
+def _unit(asset):
+    return asset.get("unit_number", asset.get("id"))
+
+
+class DeltaLogReader:
+    """
+    Follow the delta log the mod writes with SNAPSHOT_FORMAT = "delta":
+    one JSON line per snapshot interval, {"seq", "tick", "kind": "full",
+    "assets": [...]} first, then {"seq", "tick", "kind": "delta",
+    "changed": [...], "removed": [unit_number, ...]} entries until the
+    mod truncates the log with the next keyframe.
+
+        reader = DeltaLogReader(path)
+        if reader.read():              # new entries were applied
+            publish(reader.tick, reader.snapshot())
+
+    Only complete lines are consumed. A sequence gap (or a line that does
+    not parse, e.g. read across a truncation) resyncs from the keyframe at
+    the top of the log. If the log is broken from the top too (e.g. an
+    older save appended seq numbers the log already had), retrying cannot
+    help: the read returns False and sets 'waiting' until the mod writes
+    its next keyframe, at most KEYFRAME_INTERVAL snapshots later.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.assets = {}        # unit_number -> asset, as of 'seq'
+        self.seq = None         # last applied sequence number (None: not synced)
+        self.tick = None
+        self.scan = None        # initial map scan progress of the last entry
+        self.gaps = 0
+        self.resyncs = 0
+        self.waiting = False    # out of sync until the next keyframe
+        self._offset = 0
+
+    def snapshot(self):
+        return list(self.assets.values())
+
+    def read(self):
+        """Apply the new complete entries of the log. Returns True if any were applied."""
+        from_top = self.seq is None
+        if from_top:
+            self._offset = 0
+        with open(self.path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < self._offset:
+                # Truncated: the mod started the log over with a keyframe
+                self._offset, self.seq, from_top = 0, None, True
+            f.seek(self._offset)
+            data = f.read()
+
+        start = 0
+        while True:
+            end = data.find(b"\n", start)
+            if end < 0:
+                break     # no new line yet, or the mod is still writing the last one
+            try:
+                entry = json.loads(data[start:end])
+            except ValueError:
+                entry = None
+            if entry is None or not self._apply(entry):
+                self.gaps += 1
+                self.seq = None
+                if from_top:
+                    # Everything up to here is skipped until the mod truncates the log
+                    self.waiting = True
+                    return False
+                self.resyncs += 1
+                return self.read()
+            start = end + 1
+        self._offset += start
+        if start > 0:
+            self.waiting = False
+        return start > 0
+
+    def _apply(self, entry):
+        kind = entry.get("kind")
+        if kind == "full":
+            assets = entry.get("assets") or []
+            if not isinstance(assets, list):
+                return False
+            self.assets = {_unit(asset): asset for asset in assets}
+        elif kind == "delta" and self.seq is not None and entry.get("seq") == self.seq + 1:
+            # Empty Lua tables serialize as {}
+            for unit_number in entry.get("removed") or []:
+                self.assets.pop(unit_number, None)
+            for asset in entry.get("changed") or []:
+                self.assets[_unit(asset)] = asset
+        else:
+            return False
+        self.seq = entry.get("seq")
+        self.tick = entry.get("tick")
+        self.scan = entry.get("scan")
+        return True
+
+
+class SlotReader:
+    """
+    Read the snapshot the mod committed last with SNAPSHOT_FORMAT = "slots":
+
+        reader = SlotReader(manifest_path)
+        raw = reader.read()    # bytes of a newly committed snapshot, or None
+        reader.tick            # of that snapshot
+        parse(raw)
+        reader.consumed()      # until then, read() returns the same snapshot again
+
+    The mod writes the manifest {"slot", "seq", "tick", "size", "slots"}
+    only after the slot it names is complete, so the slot is mapped and
+    copied without any head/tail checks. The mod starts overwriting that
+    slot once it commits seq + slots - 1; if the manifest got that far
+    during the copy, the copy is dropped ('overtaken') in favour of the
+    newer slot.
+    """
+    def __init__(self, manifest_path, max_attempts=3):
+        self.manifest_path = manifest_path
+        self.directory = os.path.dirname(manifest_path)
+        self.max_attempts = max_attempts
+        self.seq = None         # last consumed sequence number
+        self.tick = None
+        self.overtaken = 0
+        self._read_seq = None
+
+    def _manifest(self):
+        with open(self.manifest_path, "rb") as f:
+            raw = f.read()
+        try:
+            return json.loads(raw)
+        except ValueError as e:
+            # The manifest itself is rewritten in place, but it is tiny
+            raise TruncatedSnapshotError(f"{self.manifest_path} is incomplete: {e}") from e
+
+    def _copy(self, manifest):
+        """The slot's bytes, or None if its size does not match the manifest (being rewritten)."""
+        path = os.path.join(self.directory, os.path.basename(manifest["slot"]))
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size or size != manifest.get("size", size):
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[:]
+
+    def read(self):
+        manifest = self._manifest()
+        for _ in range(self.max_attempts):
+            if manifest.get("seq") == self.seq:
+                return None
+            raw = self._copy(manifest)
+            latest = self._manifest()
+            if raw is not None and latest.get("seq", 0) < manifest["seq"] + manifest.get("slots", 2) - 1:
+                self._read_seq = manifest["seq"]
+                self.tick = manifest.get("tick")
+                return raw
+            self.overtaken += 1
+            manifest = latest
+        raise TruncatedSnapshotError(f"{self.manifest_path}: slots kept being overwritten while read")
+
+    def consumed(self):
+        """The snapshot returned by the last read() was parsed; don't return it again."""
+        self.seq = self._read_seq
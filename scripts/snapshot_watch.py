@@ -0,0 +1,166 @@
+#####################################################################
+# Change notification for the factory_state.json snapshot.          #
+#                                                                   #
+# On Linux the directory is watched with inotify and a snapshot is  #
+# reported as soon as the mod closes the file after writing it.     #
+# Everywhere else (or if inotify is unavailable) the file's mtime   #
+# is polled, like the publisher always did.                         #
+#####################################################################
+import ctypes
+import ctypes.util
+import os
+import select
+import statistics
+import struct
+import sys
+import time
+from collections import deque
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+class PollingWatcher:
+    """Report a snapshot whenever the file's mtime moves forward."""
+    def __init__(self, path, poll_interval=0.25):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._last_mtime = 0
+        self._previous_mtime = 0
+        self._missing = False
+
+    def wait(self):
+        """Block until a new snapshot is available and return its mtime."""
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                # Say so once, not on every poll, until the file is back
+                if not self._missing:
+                    print(f"Error: {self.path} does not exist")
+                    self._missing = True
+                continue
+            self._missing = False
+            if mtime > self._last_mtime:
+                self._previous_mtime, self._last_mtime = self._last_mtime, mtime
+                return mtime
+
+    def retry(self):
+        """Report the current snapshot again on the next wait() (e.g. it was read mid-write)."""
+        self._last_mtime = self._previous_mtime
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Report a snapshot when the file is closed after writing (or renamed into
+    place). Bursts of events closer together than 'debounce' seconds are
+    folded into one, so partial writes don't trigger a read each.
+    """
+    def __init__(self, path, debounce=0.005):
+        self.path = path
+        self.debounce = debounce
+        self._name = os.fsencode(os.path.basename(path))
+        # Publish whatever snapshot is already there before waiting for the next one
+        self._pending = os.path.exists(path)
+        self._missing = False
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        directory = os.path.dirname(path) or "."
+        wd = libc.inotify_add_watch(self._fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f"inotify_add_watch failed for {directory}")
+
+    def _matching_event(self, timeout):
+        """Wait up to 'timeout' seconds (None = forever) for an event on our file."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            ready, _, _ = select.select([self._fd], [], [], remaining)
+            if not ready:
+                return False
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                continue
+            offset = 0
+            found = False
+            while offset < len(data):
+                _, _, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + name_len].rstrip(b"\0")
+                offset += name_len
+                if name == self._name:
+                    found = True
+            if found:
+                return True
+
+    def wait(self):
+        """Block until a new snapshot is available and return its mtime."""
+        while True:
+            if self._pending:
+                self._pending = False
+                time.sleep(self.debounce)
+            else:
+                self._matching_event(None)
+            # Debounce: let a burst of writes settle before reading
+            while self._matching_event(self.debounce):
+                pass
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                if not self._missing:
+                    print(f"Error: {self.path} does not exist")
+                    self._missing = True
+                continue
+            self._missing = False
+            return mtime
+
+    def retry(self):
+        """Report the current snapshot again on the next wait() (e.g. it was read mid-write)."""
+        self._pending = True
+
+    def close(self):
+        os.close(self._fd)
+
+
+def open_watcher(path, backend="auto", poll_interval=0.25, debounce=0.005):
+    """
+    Create the watcher for 'backend': "inotify", "poll" or "auto"
+    (inotify on Linux, polling if that is unavailable or fails).
+    """
+    if backend in ("auto", "inotify") and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(path, debounce)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable ({e}), falling back to polling")
+    elif backend == "inotify":
+        print("inotify is only available on Linux, falling back to polling")
+    return PollingWatcher(path, poll_interval)
+
+
+class LatencyStats:
+    """Rolling snapshot-to-publish latency, printed every 'report_every' snapshots."""
+    def __init__(self, window=120, report_every=60):
+        self.samples = deque(maxlen=window)
+        self.report_every = report_every
+        self._count = 0
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+        self._count += 1
+        if self.report_every and self._count % self.report_every == 0:
+            print(f"Snapshot-to-publish latency: median {self.median() * 1000:.1f} ms, "
+                  f"max {max(self.samples) * 1000:.1f} ms over {len(self.samples)} snapshots")
+
+    def median(self):
+        return statistics.median(self.samples) if self.samples else 0.0
@@ -0,0 +1,326 @@
+#####################################################################
+# Sparkplug B publish mode for publisher.py.                        #
+#                                                                   #
+# The publisher is one edge node; every line_id is a device whose   #
+# metrics are the flattened fields of its assets                    #
+# ("<category>/<type+id>/status/status", ...) plus the grouped      #
+# asset lists ("Assets/<category>/<type>"). Topics follow           #
+#   spBv1.0/<group_id>/<NBIRTH|NDATA|NDEATH|DBIRTH|DDATA|DDEATH>/   #
+#           <edge_node_id>[/<line_id>]                              #
+# BIRTH messages carry every metric with its name and alias; DATA   #
+# messages carry only the changed metrics, by alias. NDEATH is the  #
+# MQTT will. Payloads are Sparkplug B protobuf, encoded by hand so  #
+# no protobuf package is needed.                                    #
+#####################################################################
+import json
+import struct
+import threading
+import time
+
+NAMESPACE = "spBv1.0"
+
+# Sparkplug B data types used here
+UINT64 = 8
+DOUBLE = 10
+BOOLEAN = 11
+STRING = 12
+
+
+# -- protobuf wire format ------------------------------------------------
+def _varint(value):
+    value &= 0xFFFFFFFFFFFFFFFF   # negative int64s are sent as two's complement
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _field_varint(field, value):
+    return _varint(field << 3) + _varint(value)
+
+
+def _field_bytes(field, data):
+    return _varint(field << 3 | 2) + _varint(len(data)) + data
+
+
+_DOUBLE_KEY = _varint(13 << 3 | 1)   # Metric.double_value
+
+
+def metric_type(value):
+    """Sparkplug data type of a flattened metric value."""
+    if isinstance(value, bool):
+        return BOOLEAN
+    if isinstance(value, (int, float)):
+        # Lua writes whole floats as integers: keep every number a Double
+        # so a metric never changes type between snapshots
+        return DOUBLE
+    return STRING
+
+
+def encode_metric(value, datatype, alias=None, name=None, timestamp=None):
+    """One Payload.Metric: 'name' in BIRTH messages, only the 'alias' in DATA messages."""
+    out = b""
+    if name is not None:
+        out += _field_bytes(1, name.encode("utf-8"))
+    if alias is not None:
+        out += _field_varint(2, alias)
+    if timestamp is not None:
+        out += _field_varint(3, timestamp)
+    out += _field_varint(4, datatype)
+    if value is None:
+        out += _field_varint(7, 1)                       # is_null
+    elif datatype == DOUBLE:
+        out += _DOUBLE_KEY + struct.pack("<d", value)
+    elif datatype == BOOLEAN:
+        out += _field_varint(14, int(value))
+    elif datatype == UINT64:
+        out += _field_varint(11, value)
+    else:
+        out += _field_bytes(15, str(value).encode("utf-8"))
+    return out
+
+
+def encode_payload(metrics, seq=None, timestamp=None):
+    """A Payload from already encoded metrics."""
+    out = _field_varint(1, timestamp if timestamp is not None else int(time.time() * 1000))
+    for metric in metrics:
+        out += _field_bytes(2, metric)
+    if seq is not None:
+        out += _field_varint(3, seq)
+    return out
+
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+
+def _fields(data):
+    """Yield (field number, wire type, value) of a protobuf message."""
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        field, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire == 1:
+            value, pos = data[pos:pos + 8], pos + 8
+        elif wire == 2:
+            length, pos = _read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        elif wire == 5:
+            value, pos = data[pos:pos + 4], pos + 4
+        else:
+            raise ValueError(f"unsupported protobuf wire type {wire}")
+        yield field, wire, value
+
+
+def decode_payload(data):
+    """
+    Decode a Sparkplug B payload into {"timestamp", "seq", "metrics": [...]};
+    each metric is a dict with the name/alias/datatype/value it carries.
+    """
+    payload = {"metrics": []}
+    for field, _, value in _fields(data):
+        if field == 1:
+            payload["timestamp"] = value
+        elif field == 3:
+            payload["seq"] = value
+        elif field == 2:
+            metric = {}
+            for mfield, _, mvalue in _fields(value):
+                if mfield == 1:
+                    metric["name"] = mvalue.decode("utf-8")
+                elif mfield == 2:
+                    metric["alias"] = mvalue
+                elif mfield == 4:
+                    metric["datatype"] = mvalue
+                elif mfield == 7:
+                    metric["value"] = None
+                elif mfield in (10, 11):
+                    metric["value"] = mvalue
+                elif mfield == 12:
+                    metric["value"] = struct.unpack("<f", mvalue)[0]
+                elif mfield == 13:
+                    metric["value"] = struct.unpack("<d", mvalue)[0]
+                elif mfield == 14:
+                    metric["value"] = bool(mvalue)
+                elif mfield == 15:
+                    metric["value"] = mvalue.decode("utf-8")
+            payload["metrics"].append(metric)
+    return payload
+
+
+# -- edge node ------------------------------------------------------------
+def flatten(name, value, out):
+    """Scalars as they are, dicts one level per '/', lists as a JSON string."""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flatten(f"{name}/{key}", item, out)
+    elif isinstance(value, list):
+        out[name] = json.dumps(value)
+    else:
+        out[name] = value
+
+
+class SparkplugNode:
+    """
+    Sparkplug B state of the publisher as an edge node.
+
+        node.attach(paho_client)       # before connecting: will, callbacks
+        node.begin_cycle()
+        node.collect(plan, build_asset_messages(asset, plan))   # per asset
+        node.publish(client, asset_groups)                      # per snapshot
+
+    Births are (re)sent on the first snapshot after every connect and on a
+    "Node Control/Rebirth" NCMD; a device is reborn when its metric set
+    changes (assets added/removed) and gets a DDEATH when its line is gone.
+    """
+    def __init__(self, group_id, edge_node_id, qos=0):
+        self.group_id = group_id
+        self.edge_node_id = edge_node_id
+        self.qos = qos
+        self.bd_seq = 0
+        self.rebirth = threading.Event()
+        self.rebirth.set()
+        self._seq = 0
+        self._next_alias = 1
+        self._aliases = {}        # (device, metric name) -> alias
+        self._born = {}           # device -> {metric name: datatype} sent in its DBIRTH
+        self._last = {}           # device -> {metric name: last value sent}
+        self._current = {}
+
+    def topic(self, message_type, device=None):
+        topic = f"{NAMESPACE}/{self.group_id}/{message_type}/{self.edge_node_id}"
+        return f"{topic}/{device}" if device is not None else topic
+
+    # -- connection ---------------------------------------------------------
+    def _death_payload(self):
+        return encode_payload([encode_metric(self.bd_seq, UINT64, name="bdSeq")])
+
+    def attach(self, client):
+        """Set the NDEATH will and hook the connect/disconnect/message callbacks of a paho client."""
+        client.will_set(self.topic("NDEATH"), self._death_payload(), qos=1)
+        user_on_connect, user_on_disconnect = client.on_connect, client.on_disconnect
+
+        def on_connect(client, userdata, flags, reason_code, *args):
+            if reason_code == 0:
+                client.subscribe(self.topic("NCMD"))
+                self.rebirth.set()
+            if user_on_connect:
+                user_on_connect(client, userdata, flags, reason_code, *args)
+
+        def on_disconnect(client, userdata, *args):
+            # The broker sent our NDEATH: the next session gets a new bdSeq
+            self.bd_seq = (self.bd_seq + 1) % 256
+            client.will_set(self.topic("NDEATH"), self._death_payload(), qos=1)
+            if user_on_disconnect:
+                user_on_disconnect(client, userdata, *args)
+
+        client.on_connect = on_connect
+        client.on_disconnect = on_disconnect
+        client.message_callback_add(self.topic("NCMD"), self._on_command)
+
+    def _on_command(self, client, userdata, message):
+        try:
+            metrics = decode_payload(message.payload)["metrics"]
+        except (ValueError, IndexError) as e:
+            print(f"Ignoring malformed Sparkplug NCMD: {e}")
+            return
+        if any(m.get("name") == "Node Control/Rebirth" and m.get("value") for m in metrics):
+            print("Sparkplug rebirth requested")
+            self.rebirth.set()
+
+    # -- per snapshot -------------------------------------------------------
+    def clear(self):
+        """Forget every device: the next publish() sends all births again."""
+        self._born, self._last, self._current = {}, {}, {}
+        self.rebirth.set()
+
+    def begin_cycle(self):
+        self._current = {}
+
+    def collect(self, plan, messages):
+        """Add an asset's (subtopic, value) pairs as metrics of its line device."""
+        metrics = self._current.setdefault(plan.line_id, {})
+        prefix, skip = plan.line_key, len(plan.base)
+        for topic, value in messages:
+            flatten(prefix + topic[skip:], value, metrics)
+
+    def _next_seq(self):
+        seq = self._seq
+        self._seq = (seq + 1) % 256
+        return seq
+
+    def _alias(self, device, name):
+        key = (device, name)
+        alias = self._aliases.get(key)
+        if alias is None:
+            alias = self._aliases[key] = self._next_alias
+            self._next_alias += 1
+        return alias
+
+    def _publish(self, client, topic, metrics, seq=None):
+        seq = self._next_seq() if seq is None else seq
+        client.publish(topic, encode_payload(metrics, seq), qos=self.qos)
+
+    def _birth_device(self, client, device, metrics):
+        types = {name: metric_type(value) for name, value in metrics.items()}
+        self._publish(client, self.topic("DBIRTH", device), [
+            encode_metric(value, types[name], self._alias(device, name), name)
+            for name, value in metrics.items()])
+        self._born[device] = types
+        self._last[device] = metrics
+
+    def publish(self, client, asset_groups):
+        """Publish the collected snapshot: births if due, then DDATA with the changed metrics."""
+        for (category, line_id, type_slug), ids in asset_groups.items():
+            self._current.setdefault(line_id, {})[f"Assets/{category}/{type_slug}"] = json.dumps(ids)
+        current = self._current
+
+        if self.rebirth.is_set():
+            self.rebirth.clear()
+            self._born, self._last = {}, {}
+            self._aliases, self._next_alias = {}, 1
+            self._seq = 0
+            self._publish(client, self.topic("NBIRTH"), [
+                encode_metric(self.bd_seq, UINT64, name="bdSeq"),
+                encode_metric(False, BOOLEAN, name="Node Control/Rebirth"),
+            ], seq=self._next_seq())
+            for device, metrics in current.items():
+                self._birth_device(client, device, metrics)
+            return
+
+        now = int(time.time() * 1000)
+        for device, metrics in current.items():
+            born = self._born.get(device)
+            if born is None or born.keys() != metrics.keys():
+                self._birth_device(client, device, metrics)
+                continue
+            last = self._last[device]
+            changed = []
+            for name, value in metrics.items():
+                if last[name] != value:
+                    datatype = metric_type(value)
+                    if datatype != born[name]:
+                        break   # a metric changed type: only a new birth can announce it
+                    changed.append(encode_metric(value, datatype, self._aliases[(device, name)], timestamp=now))
+            else:
+                if changed:
+                    self._publish(client, self.topic("DDATA", device), changed)
+                self._last[device] = metrics
+                continue
+            self._birth_device(client, device, metrics)
+
+        for device in [device for device in self._born if device not in current]:
+            self._publish(client, self.topic("DDEATH", device), [])
+            del self._born[device]
+            del self._last[device]
@@ -0,0 +1,121 @@
+#####################################################################
+# MQTT v5 topic aliases for publisher.py.                           #
+#                                                                   #
+# The first publish on an aliased topic carries the full topic and  #
+# the alias number; later ones send an empty topic with the alias   #
+# only. Topics get aliases while any are free, up to the smaller of #
+# the configured maximum and the broker's TopicAliasMaximum from    #
+# CONNACK; once they run out, the hottest topics of the last        #
+# window take over the aliases of topics that went cold. Aliases    #
+# are only valid for one connection and reset on every reconnect.   #
+#####################################################################
+import threading
+from collections import Counter
+
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+
+class TopicAliasClient:
+    """
+    Wraps a paho client created with protocol=MQTTv5; everything but
+    publish() and the connect callbacks is delegated.
+
+        client = TopicAliasClient(paho_client, max_aliases=1024)
+    """
+    def __init__(self, client, max_aliases=0, rebalance_every=10000):
+        self._client = client
+        self.max_aliases = max_aliases          # 0 = whatever the broker allows
+        self.rebalance_every = rebalance_every
+        self.limit = 0                          # aliases usable on this connection
+        self.connected = False
+        self._aliases = {}                      # topic -> alias number
+        self._free = []                         # alias numbers not bound to a topic
+        self._hot = set()                       # most published topics of the last window
+        self._cold = []                         # aliased topics that were not among them
+        self._window = Counter()
+        self._window_count = 0
+        self._lock = threading.Lock()
+        self._user_on_connect = client.on_connect
+        self._user_on_disconnect = client.on_disconnect
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    # Wrappers above us (e.g. the outbox) install their callbacks through these
+    @property
+    def on_connect(self):
+        return self._user_on_connect
+
+    @on_connect.setter
+    def on_connect(self, callback):
+        self._user_on_connect = callback
+
+    @property
+    def on_disconnect(self):
+        return self._user_on_disconnect
+
+    @on_disconnect.setter
+    def on_disconnect(self, callback):
+        self._user_on_disconnect = callback
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties=None, *args):
+        broker_max = getattr(properties, "TopicAliasMaximum", 0) if properties else 0
+        limit = min(self.max_aliases, broker_max) if self.max_aliases else broker_max
+        with self._lock:
+            self.connected = reason_code == 0
+            self.limit = limit
+            self._aliases = {}
+            self._free = list(range(limit, 0, -1))
+            self._hot, self._cold = set(), []
+            self._window.clear()
+            self._window_count = 0
+        if self.connected:
+            print(f"MQTT v5 topic aliases: {limit} (broker maximum {broker_max})")
+        if self._user_on_connect:
+            self._user_on_connect(client, userdata, flags, reason_code, properties, *args)
+
+    def _on_disconnect(self, client, userdata, *args):
+        with self._lock:
+            self.connected = False
+            self.limit = 0
+            self._aliases = {}
+        if self._user_on_disconnect:
+            self._user_on_disconnect(client, userdata, *args)
+
+    def aliased(self):
+        return len(self._aliases)
+
+    def _rebalance(self):
+        """Note this window's hottest topics, and which aliased topics they may take over from."""
+        self._hot = {topic for topic, _ in self._window.most_common(self.limit)}
+        self._cold = [topic for topic in self._aliases if topic not in self._hot]
+        self._window.clear()
+        self._window_count = 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        with self._lock:
+            if not (self.connected and self.limit):
+                return self._client.publish(topic, payload, qos, retain, properties)
+            self._window[topic] += 1
+            self._window_count += 1
+            if self._window_count >= self.rebalance_every:
+                self._rebalance()
+            alias = self._aliases.get(topic)
+            send_topic = ""
+            if alias is None:
+                if self._free:
+                    alias = self._free.pop()
+                elif topic in self._hot and self._cold:
+                    alias = self._aliases.pop(self._cold.pop(), None)
+                if alias is None:
+                    return self._client.publish(topic, payload, qos, retain, properties)
+                # First use: full topic plus the alias it (re)binds to
+                self._aliases[topic] = alias
+                send_topic = topic
+            if properties is None:
+                properties = Properties(PacketTypes.PUBLISH)
+            properties.TopicAlias = alias
+            return self._client.publish(send_topic, payload, qos, retain, properties)
@@ -0,0 +1,85 @@
+#####################################################################
+# Per-asset topic plans for publisher.py.                           #
+#                                                                   #
+# Every topic an asset publishes on only depends on its type,       #
+# line_id and unit_number, so the strings are built (and interned)  #
+# once per asset and reused on every cycle until the asset changes  #
+# type or line, or disappears from the snapshot.                    #
+#####################################################################
+import sys
+
+
+class TopicPlan:
+    """Precomputed, interned topic strings for one asset."""
+    __slots__ = ("asset_type", "line_id", "base", "line_key", "group_key",
+                 "basic", "pos", "status", "production", "pollution", "electricity",
+                 "inventory", "_inventory_labels", "_fluid_boxes")
+
+    def __init__(self, asset_type, line_id, base, line_key, group_key):
+        intern = sys.intern
+        self.asset_type = asset_type
+        self.line_id = line_id
+        self.base = intern(base)
+        self.line_key = intern(line_key)   # "<category>/<type_slug><id>" inside a line document
+        self.group_key = group_key         # (category, line_id, type_slug) for publish_asset_list
+        self.basic = intern(f"{base}/basic")
+        self.pos = intern(f"{base}/pos")
+        self.status = intern(f"{base}/status")
+        self.production = intern(f"{base}/production")
+        self.pollution = intern(f"{base}/pollution")
+        self.electricity = intern(f"{base}/electricity")
+        self.inventory = intern(f"{base}/inventory")
+        self._inventory_labels = {}
+        self._fluid_boxes = []
+
+    def inventory_topic(self, label):
+        topic = self._inventory_labels.get(label)
+        if topic is None:
+            topic = self._inventory_labels[label] = sys.intern(f"{self.inventory}/{label}")
+        return topic
+
+    def fluid_topic(self, index):
+        boxes = self._fluid_boxes
+        while len(boxes) <= index:
+            boxes.append(sys.intern(f"{self.base}/fluids/box{len(boxes)}"))
+        return boxes[index]
+
+
+class TopicPlanCache:
+    """
+    unit_number -> TopicPlan. 'factory(asset)' builds a plan on a miss or
+    when the asset's type or line_id no longer match the cached plan.
+    Plans of assets missing from a (fully read) snapshot are dropped by sweep().
+    """
+    def __init__(self, factory):
+        self.factory = factory
+        self._plans = {}
+        self._seen = set()
+
+    def __len__(self):
+        return len(self._plans)
+
+    def get(self, asset):
+        unit_number = asset.get("unit_number", asset.get("id"))
+        if unit_number is None:
+            return self.factory(asset)
+        plan = self._plans.get(unit_number)
+        if (plan is None
+                or plan.asset_type != asset.get("type", "unknown")
+                or plan.line_id != asset.get("line_id", "Isolated")):
+            plan = self._plans[unit_number] = self.factory(asset)
+        self._seen.add(unit_number)
+        return plan
+
+    def begin_cycle(self):
+        self._seen = set()
+
+    def sweep(self):
+        stale = [unit_number for unit_number in self._plans if unit_number not in self._seen]
+        for unit_number in stale:
+            del self._plans[unit_number]
+        return len(stale)
+
+    def clear(self):
+        self._plans.clear()
+        self._seen = set()
@@ -0,0 +1,82 @@
+#####################################################################
+# Registry of published topics for publisher.py / excelGen.py.      #
+#                                                                   #
+# Keeps the latest payload of every topic in memory and persists    #
+# it as JSON lines ({"topic": ..., "payload": ...}): new topics are #
+# appended at the end of a cycle, and the whole file is compacted   #
+# to one line per topic on a timer. Topics that left the snapshot   #
+# are swept at the end of a cycle and dropped at the next           #
+# compaction. The publish loop itself never touches the disk.       #
+#####################################################################
+import json
+import os
+import time
+
+from payload_codec import get_decoder
+
+
+class TopicRegistry:
+    """
+    Topic -> latest payload, persisted as JSON lines. Binary payloads
+    (payload_format msgpack/cbor) are decoded to JSON only when written.
+
+        registry.record(topic, payload)   # from the publish loop, memory only
+        registry.sweep(still_published)   # end of a fully read snapshot
+        registry.flush_if_due()           # once per cycle
+    """
+    def __init__(self, path, flush_interval=60.0, payload_format="json"):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._decode = None if payload_format == "json" else get_decoder(payload_format)
+        self.topics = {}
+        self._new_topics = []
+        self._last_compact = None   # nothing written yet: the first flush rewrites the file
+
+    def record(self, topic, payload):
+        if topic not in self.topics:
+            self._new_topics.append(topic)
+        self.topics[topic] = payload
+
+    def sweep(self, keep):
+        """Forget every topic for which 'keep(topic)' is false. Returns the count."""
+        stale = [topic for topic in self.topics if not keep(topic)]
+        for topic in stale:
+            del self.topics[topic]
+        if stale:
+            self._new_topics = [topic for topic in self._new_topics if topic in self.topics]
+        return len(stale)
+
+    def _line(self, topic):
+        payload = self.topics[topic]
+        if self._decode is not None:
+            payload = json.dumps(self._decode(payload))
+        # JSON payloads are embedded as-is
+        return f'{{"topic": {json.dumps(topic)}, "payload": {payload}}}\n'
+
+    def flush_if_due(self):
+        """Append new topics now; compact the whole file every 'flush_interval' seconds."""
+        now = time.monotonic()
+        if self._last_compact is None or now - self._last_compact >= self.flush_interval:
+            self.compact()
+        elif self._new_topics:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.writelines(self._line(topic) for topic in self._new_topics)
+            self._new_topics = []
+
+    def compact(self):
+        """Rewrite the file with one line per topic holding its latest payload."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(self._line(topic) for topic in self.topics)
+        os.replace(tmp_path, self.path)
+        self._new_topics = []
+        self._last_compact = time.monotonic()
+
+
+def read_registry(path):
+    """Yield (topic, payload) from a registry file; later lines win for repeated topics."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record["topic"], record["payload"]